@@ -1,34 +1,69 @@
-from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import time
+import asyncio
+import hashlib
 import logging
 import uvicorn
+import aiofiles
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import List, Optional
-import shutil
 from datetime import datetime
 
-from app.config.settings import settings
+from app.config.settings import Settings, get_settings, settings
 from app.models.models import InvoiceData, EmailConfig, ProcessResult, JobStatus
 from app.main import InvoiceSync
+from app.modules.openai_processor.openai_processor import create_async_http_client
+from app.utils.logging_setup import configure_logging, stop_logging
 
 # Configurar logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("invoicesync_api.log")
-    ]
-)
+configure_logging("invoicesync_api.log")
 
 logger = logging.getLogger(__name__)
 
+# Tamaño de bloque para copiar archivos subidos (1 MiB)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Firma con la que empieza todo archivo PDF
+PDF_MAGIC = b"%PDF-"
+
+# Segundos durante los que se reutiliza el estado del archivo Excel
+EXCEL_STAT_TTL_SECONDS = 2
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Crea los recursos compartidos de la API al arrancar cada worker y los libera al apagarlo.
+    
+    Args:
+        app: Aplicación FastAPI.
+    """
+    # Cliente HTTP compartido para las llamadas a OpenAI
+    app.state.http = create_async_http_client()
+    app.state.sync = InvoiceSync(http_client=app.state.http)
+    await app.state.sync.start_excel_writer()
+    # Ejecutor dedicado para el procesamiento de correos en segundo plano: un único
+    # hilo, fuera del threadpool que atiende las peticiones HTTP
+    app.state.job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="invoicesync-job")
+    
+    try:
+        yield
+    finally:
+        app.state.job_executor.shutdown(wait=False)
+        await app.state.sync.aclose()
+        await app.state.http.aclose()
+        stop_logging()
+
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="InvoiceSync API",
     description="API para procesar facturas desde correo electrónico y exportarlas a Excel",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -40,12 +75,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Instancia global del procesador
-invoice_sync = InvoiceSync()
+def get_invoice_sync(request: Request) -> InvoiceSync:
+    """
+    Dependencia que devuelve la instancia de InvoiceSync creada en el lifespan.
+    
+    Args:
+        request: Petición en curso.
+        
+    Returns:
+        InvoiceSync: Procesador de facturas del worker.
+    """
+    return request.app.state.sync
+
+# Estado cacheado del archivo Excel: (ruta, momento de consulta, existe, fecha de modificación)
+_excel_stat_cache = (None, 0.0, False, None)
+
+def get_excel_stat(excel_path: str):
+    """
+    Obtiene la existencia y fecha de modificación del archivo Excel con un único
+    stat(), reutilizando el resultado durante EXCEL_STAT_TTL_SECONDS.
+    
+    Args:
+        excel_path: Ruta al archivo Excel.
+        
+    Returns:
+        Tuple: (existe, fecha de modificación o None)
+    """
+    global _excel_stat_cache
+    
+    cached_path, cached_at, exists, last_modified = _excel_stat_cache
+    now = time.monotonic()
+    if cached_path == excel_path and now - cached_at < EXCEL_STAT_TTL_SECONDS:
+        return exists, last_modified
+    
+    try:
+        last_modified = datetime.fromtimestamp(os.stat(excel_path).st_mtime)
+        exists = True
+    except FileNotFoundError:
+        last_modified = None
+        exists = False
+    
+    _excel_stat_cache = (excel_path, now, exists, last_modified)
+    return exists, last_modified
 
 # Tarea en segundo plano para procesar correos
-def process_emails_task():
-    """Tarea en segundo plano para procesar correos."""
+def process_emails_task(invoice_sync: InvoiceSync):
+    """
+    Tarea en segundo plano para procesar correos.
+    
+    Args:
+        invoice_sync: Procesador de facturas.
+    """
     try:
         result = invoice_sync.process_emails()
         logger.info(f"Tarea en segundo plano completada: {result.message}")
@@ -58,32 +138,43 @@ async def root():
     return {"message": "InvoiceSync API está en funcionamiento"}
 
 @app.post("/process", response_model=ProcessResult)
-async def process_emails(background_tasks: BackgroundTasks, run_async: bool = False):
+async def process_emails(
+    request: Request,
+    run_async: bool = False,
+    invoice_sync: InvoiceSync = Depends(get_invoice_sync)
+):
     """
     Procesa correos electrónicos para extraer facturas.
     
     Args:
-        background_tasks: Gestor de tareas en segundo plano.
+        request: Petición en curso.
         run_async: Si es True, el procesamiento se ejecuta en segundo plano.
+        invoice_sync: Procesador de facturas.
         
     Returns:
         ProcessResult: Resultado del procesamiento.
     """
+    if invoice_sync.is_processing():
+        return ProcessResult.model_construct(
+            success=False,
+            message="Procesamiento en curso"
+        )
+    
     try:
         if run_async:
-            # Ejecutar en segundo plano
-            background_tasks.add_task(process_emails_task)
-            return ProcessResult(
+            # Ejecutar en segundo plano en el ejecutor dedicado
+            request.app.state.job_executor.submit(process_emails_task, invoice_sync)
+            return ProcessResult.model_construct(
                 success=True,
                 message="Procesamiento iniciado en segundo plano"
             )
         else:
-            # Ejecutar de forma síncrona
-            result = invoice_sync.process_emails()
+            # Ejecutar de forma síncrona en un hilo para no bloquear el event loop
+            result = await asyncio.to_thread(invoice_sync.process_emails)
             return result
     except Exception as e:
         logger.error(f"Error al procesar correos: {str(e)}")
-        return ProcessResult(
+        return ProcessResult.model_construct(
             success=False,
             message=f"Error al procesar correos: {str(e)}"
         )
@@ -92,7 +183,9 @@ async def process_emails(background_tasks: BackgroundTasks, run_async: bool = Fa
 async def upload_pdf(
     file: UploadFile = File(...),
     sender: Optional[str] = Form(None),
-    date: Optional[str] = Form(None)
+    date: Optional[str] = Form(None),
+    settings: Settings = Depends(get_settings),
+    invoice_sync: InvoiceSync = Depends(get_invoice_sync)
 ):
     """
     Sube un archivo PDF para procesarlo directamente.
@@ -101,18 +194,30 @@ async def upload_pdf(
         file: Archivo PDF a procesar.
         sender: Remitente (opcional).
         date: Fecha del documento (opcional).
+        settings: Configuración de la aplicación.
+        invoice_sync: Procesador de facturas.
         
     Returns:
         ProcessResult: Resultado del procesamiento.
     """
-    if not file.filename.lower().endswith('.pdf'):
+    # Validar el contenido por su firma, no por la extensión del nombre
+    header = await file.read(len(PDF_MAGIC))
+    if header != PDF_MAGIC:
         raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
     
     try:
-        # Guardar el archivo
-        pdf_path = os.path.join(settings.TEMP_PDF_DIR, file.filename)
-        with open(pdf_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Guardar el archivo calculando su hash en la misma pasada
+        filename = os.path.basename(file.filename or "") or "factura.pdf"
+        pdf_path = os.path.join(settings.TEMP_PDF_DIR, filename)
+        digest = hashlib.sha256(header)
+        async with aiofiles.open(pdf_path, "wb") as buffer:
+            await buffer.write(header)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                await buffer.write(chunk)
         
         # Preparar metadatos
         email_meta = {
@@ -127,68 +232,85 @@ async def upload_pdf(
                 logger.warning(f"Formato de fecha incorrecto: {date}")
         
         # Procesar con OpenAI
-        invoice_data = invoice_sync.process_pdf(pdf_path, email_meta)
+        invoice_data = await invoice_sync.process_pdf(pdf_path, email_meta, digest.hexdigest())
         
-        # Exportar a Excel
+        # Encolar para el próximo volcado al Excel
         invoices = [invoice_data]
-        excel_path = invoice_sync.excel_exporter.export_invoices(invoices)
+        await invoice_sync.enqueue_invoice(invoice_data)
         
-        if not excel_path:
-            return ProcessResult(
-                success=False,
-                message="Error al exportar a Excel",
-                invoice_count=0,
-                invoices=invoices
-            )
-        
-        return ProcessResult(
+        return ProcessResult.model_construct(
             success=True,
-            message=f"Factura procesada correctamente. Excel: {excel_path}",
+            message="Factura procesada correctamente. Se agregará al Excel en el próximo volcado",
             invoice_count=1,
             invoices=invoices
         )
         
     except Exception as e:
         logger.error(f"Error al procesar el archivo: {str(e)}")
-        return ProcessResult(
+        return ProcessResult.model_construct(
             success=False,
             message=f"Error al procesar el archivo: {str(e)}"
         )
 
 @app.get("/excel")
-async def get_excel():
+async def get_excel(request: Request, settings: Settings = Depends(get_settings)):
     """
     Descarga el archivo Excel con las facturas procesadas.
     
+    Incluye un ETag derivado del tamaño y la fecha de modificación del archivo;
+    si el cliente ya tiene esa versión (If-None-Match) se responde 304 sin cuerpo.
+    
+    Args:
+        request: Petición HTTP entrante.
+        settings: Configuración de la aplicación.
+        
     Returns:
-        FileResponse: Archivo Excel para descargar.
+        FileResponse: Archivo Excel para descargar, o 304 si no ha cambiado.
     """
     excel_path = settings.EXCEL_OUTPUT_PATH
     
-    if not os.path.exists(excel_path):
+    try:
+        stat = await asyncio.to_thread(os.stat, excel_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Archivo Excel no encontrado")
     
+    etag = f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=5"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=cache_headers)
+    
     return FileResponse(
         path=excel_path,
         filename="facturas.xlsx",
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=cache_headers,
+        stat_result=stat
     )
 
 @app.get("/status")
-async def get_status():
+async def get_status(
+    settings: Settings = Depends(get_settings),
+    invoice_sync: InvoiceSync = Depends(get_invoice_sync)
+):
     """
     Obtiene el estado actual del sistema.
     
+    Args:
+        settings: Configuración de la aplicación.
+        invoice_sync: Procesador de facturas.
+    
     Returns:
         dict: Estado del sistema.
     """
-    excel_path = settings.EXCEL_OUTPUT_PATH
+    excel_exists, last_modified = get_excel_stat(settings.EXCEL_OUTPUT_PATH)
     job_status = invoice_sync.get_job_status()
     
     status_info = {
         "status": "active",
-        "excel_exists": os.path.exists(excel_path),
-        "last_modified": datetime.fromtimestamp(os.path.getmtime(excel_path)) if os.path.exists(excel_path) else None,
+        "excel_exists": excel_exists,
+        "last_modified": last_modified,
         "temp_dir": settings.TEMP_PDF_DIR,
         "email_configured": bool(settings.EMAIL_USERNAME and settings.EMAIL_PASSWORD),
         "openai_configured": bool(settings.OPENAI_API_KEY),
@@ -203,10 +325,13 @@ async def get_status():
     return status_info
 
 @app.post("/job/start", response_model=JobStatus)
-async def start_job():
+async def start_job(invoice_sync: InvoiceSync = Depends(get_invoice_sync)):
     """
     Inicia el trabajo programado para procesar correos periódicamente.
     
+    Args:
+        invoice_sync: Procesador de facturas.
+    
     Returns:
         JobStatus: Estado del trabajo.
     """
@@ -218,10 +343,13 @@ async def start_job():
         raise HTTPException(status_code=500, detail=f"Error al iniciar el job: {str(e)}")
 
 @app.post("/job/stop", response_model=JobStatus)
-async def stop_job():
+async def stop_job(invoice_sync: InvoiceSync = Depends(get_invoice_sync)):
     """
     Detiene el trabajo programado.
     
+    Args:
+        invoice_sync: Procesador de facturas.
+    
     Returns:
         JobStatus: Estado del trabajo.
     """
@@ -233,22 +361,35 @@ async def stop_job():
         raise HTTPException(status_code=500, detail=f"Error al detener el job: {str(e)}")
 
 @app.get("/job/status", response_model=JobStatus)
-async def job_status():
+async def job_status(invoice_sync: InvoiceSync = Depends(get_invoice_sync)):
     """
     Obtiene el estado actual del trabajo programado.
     
+    Args:
+        invoice_sync: Procesador de facturas.
+    
     Returns:
         JobStatus: Estado del trabajo.
     """
     return invoice_sync.get_job_status()
 
 def start():
-    """Inicia el servidor API."""
+    """
+    Inicia el servidor API.
+    
+    En modo DEBUG se usa un único proceso con recarga automática; en caso
+    contrario se levantan API_WORKERS procesos (1 por defecto). Con más de uno,
+    cada proceso tendría su propio job, su propio bloqueo de procesamiento y su
+    propia cola de escritura del Excel sobre el mismo buzón y el mismo archivo.
+    Con uvicorn[standard] instalado, uvicorn selecciona uvloop y httptools
+    automáticamente.
+    """
     uvicorn.run(
         "app.api.api:app",
         host=settings.API_HOST,
         port=settings.API_PORT,
-        reload=True
+        workers=1 if settings.DEBUG else settings.API_WORKERS,
+        reload=settings.DEBUG
     )
 
 if __name__ == "__main__":
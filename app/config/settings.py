@@ -1,6 +1,9 @@
 import os
+import re
 import json
-from typing import List
+import logging
+from functools import lru_cache
+from typing import List, Pattern
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -18,7 +21,24 @@ class Settings(BaseSettings):
     # Configuraciones de la App
     EXCEL_OUTPUT_PATH: str = os.getenv("EXCEL_OUTPUT_PATH", "./data/facturas.xlsx")
     TEMP_PDF_DIR: str = os.getenv("TEMP_PDF_DIR", "./data/temp_pdfs")
+    # Antigüedad a partir de la cual se eliminan los PDFs temporales (0 para conservarlos).
+    # Desactivado por defecto: la columna PDF del Excel apunta a estos archivos
+    TEMP_PDF_MAX_AGE_HOURS: float = float(os.getenv("TEMP_PDF_MAX_AGE_HOURS", 0))
+    # Escritura diferida del Excel: facturas pendientes en un diario JSONL hasta el próximo volcado.
+    # Cada proceso escribe el suyo, con su PID antes de la extensión (facturas.<pid>.jsonl)
+    EXCEL_JOURNAL_PATH: str = os.getenv("EXCEL_JOURNAL_PATH", "./data/facturas.jsonl")
+    # Filas más recientes de cada hoja que se escriben en el Excel (0 para todas); el historial las conserva todas
+    EXCEL_MAX_ROWS: int = int(os.getenv("EXCEL_MAX_ROWS", 0))
+    # Compresión del archivo Excel (1 rápida ... 9 más chica; 0 sin comprimir)
+    EXCEL_COMPRESS_LEVEL: int = int(os.getenv("EXCEL_COMPRESS_LEVEL", 1))
+    # Cache persistente de facturas extraídas por hash del PDF (vacío para usar solo memoria)
+    INVOICE_CACHE_PATH: str = os.getenv("INVOICE_CACHE_PATH", "./data/invoice_cache.sqlite3")
+    # Días que se conserva cada factura en la cache (0 para no caducar)
+    INVOICE_CACHE_TTL_DAYS: float = float(os.getenv("INVOICE_CACHE_TTL_DAYS", 30))
+    EXCEL_FLUSH_INTERVAL_SECONDS: float = float(os.getenv("EXCEL_FLUSH_INTERVAL_SECONDS", 5))
+    EXCEL_FLUSH_BATCH_SIZE: int = int(os.getenv("EXCEL_FLUSH_BATCH_SIZE", 20))
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_LEVEL_INT: int = logging.INFO
     
     # Configuración de OpenAI
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
@@ -26,10 +46,50 @@ class Settings(BaseSettings):
     # Configuraciones de la API
     API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
     API_PORT: int = int(os.getenv("API_PORT", 8000))
+    # Un solo proceso: el job programado, el bloqueo de /process, el Excel y su
+    # journal viven en memoria de cada proceso y no se coordinan entre varios
+    API_WORKERS: int = int(os.getenv("API_WORKERS", 1))
+    DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     
     # Configuraciones del Job
     JOB_INTERVAL_MINUTES: int = int(os.getenv("JOB_INTERVAL_MINUTES", 60))
+    # Intervalo adaptativo: crece con el multiplicador mientras no lleguen facturas
+    JOB_MIN_INTERVAL_MINUTES: int = int(os.getenv("JOB_MIN_INTERVAL_MINUTES", os.getenv("JOB_INTERVAL_MINUTES", 60)))
+    JOB_MAX_INTERVAL_MINUTES: int = int(os.getenv("JOB_MAX_INTERVAL_MINUTES", int(os.getenv("JOB_INTERVAL_MINUTES", 60)) * 4))
+    JOB_BACKOFF_MULTIPLIER: float = float(os.getenv("JOB_BACKOFF_MULTIPLIER", 2.0))
     EMAIL_SEARCH_CRITERIA: str = os.getenv("EMAIL_SEARCH_CRITERIA", "UNSEEN")
+    # Correos pedidos al servidor IMAP en cada FETCH
+    FETCH_BATCH_SIZE: int = int(os.getenv("FETCH_BATCH_SIZE", 100))
+    # Buscar enlaces a facturas en el cuerpo de los correos sin PDF adjunto
+    EMAIL_EXTRACT_LINKS: bool = os.getenv("EMAIL_EXTRACT_LINKS", "True").lower() == "true"
+    # Hilos que descargan enlaces y llaman a OpenAI durante el procesamiento de correos
+    EMAIL_WORKERS: int = int(os.getenv("EMAIL_WORKERS", 8))
+    # Peticiones simultáneas a OpenAI por procesador (descargas y conversión de imágenes no cuentan)
+    OPENAI_CONCURRENCY: int = int(os.getenv("OPENAI_CONCURRENCY", 8))
+    # Límites de la cuenta de OpenAI por minuto, compartidos por todo el servicio (0 sin límite)
+    OPENAI_MAX_REQUESTS_PER_MINUTE: int = int(os.getenv("OPENAI_MAX_REQUESTS_PER_MINUTE", 0))
+    OPENAI_MAX_TOKENS_PER_MINUTE: int = int(os.getenv("OPENAI_MAX_TOKENS_PER_MINUTE", 0))
+    # Reintentos ante errores 429 o de conexión, con espera exponencial
+    OPENAI_MAX_RETRIES: int = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+    # Modo daemon: extraer las facturas con la Batch API (mitad de costo, resultados en hasta 24 horas)
+    OPENAI_BATCH_MODE: bool = os.getenv("OPENAI_BATCH_MODE", "False").lower() == "true"
+    # Peticiones por lote y segundos de espera antes de enviar un lote incompleto
+    OPENAI_BATCH_SIZE: int = int(os.getenv("OPENAI_BATCH_SIZE", 500))
+    OPENAI_BATCH_FLUSH_SECONDS: float = float(os.getenv("OPENAI_BATCH_FLUSH_SECONDS", 60))
+    # Segundos entre consultas del estado de los lotes enviados
+    OPENAI_BATCH_POLL_SECONDS: float = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", 300))
+    # PDFs con al menos estos caracteres de texto se envían como texto al modelo de texto (0 para enviar siempre la imagen)
+    PDF_TEXT_MIN_CHARS: int = int(os.getenv("PDF_TEXT_MIN_CHARS", 500))
+    # Modelo para las facturas que se envían como texto
+    OPENAI_TEXT_MODEL: str = os.getenv("OPENAI_TEXT_MODEL", "gpt-4o-mini")
+    # Tokens máximos de la respuesta: también se reservan del límite de tokens por minuto
+    OPENAI_MAX_TOKENS: int = int(os.getenv("OPENAI_MAX_TOKENS", 1000))
+    # Enviar primero la imagen en detalle bajo (85 tokens) y reintentar en detalle alto solo si faltan
+    # datos o los montos no cuadran. Desactivado por defecto: a 512 px el texto de una factura A4
+    # ocupa pocos píxeles y el modelo puede leer mal dígitos que aun así cuadran
+    OPENAI_IMAGE_LOW_DETAIL_FIRST: bool = os.getenv("OPENAI_IMAGE_LOW_DETAIL_FIRST", "False").lower() == "true"
+    # Procesos que convierten los PDF a imagen fuera del GIL (0 para convertir en el mismo proceso)
+    PDF_RENDER_PROCESSES: int = int(os.getenv("PDF_RENDER_PROCESSES", os.cpu_count() or 1))
     EMAIL_SEARCH_TERMS: List[str] = []
     
     model_config = {
@@ -45,5 +105,78 @@ class Settings(BaseSettings):
         except json.JSONDecodeError:
             # Fallback para el formato antiguo
             self.EMAIL_SEARCH_TERMS = [term.strip() for term in search_terms_str.split(",")]
+        
+        # Nivel de log numérico, resuelto una sola vez
+        self.LOG_LEVEL_INT = getattr(logging, self.LOG_LEVEL.upper(), logging.INFO)
 
-settings = Settings()
+def reduce_search_terms(terms: List[str]) -> List[str]:
+    """
+    Reduce la lista de términos de búsqueda al mínimo equivalente.
+    
+    La búsqueda SUBJECT de IMAP es por subcadena e insensible a mayúsculas, por lo
+    que se eliminan duplicados que solo difieren en mayúsculas y los términos que
+    contienen a otro término más corto (p. ej. "facturacion" ya está cubierto por
+    "factura").
+    
+    Args:
+        terms: Términos de búsqueda configurados.
+        
+    Returns:
+        List[str]: Términos necesarios, en el orden original.
+    """
+    unique = {}
+    for term in terms:
+        term = term.strip()
+        if term:
+            # Muchos servidores solo ignoran mayúsculas en ASCII: los términos con
+            # acentos se conservan tal cual
+            unique.setdefault(term.lower() if term.isascii() else term, term)
+    
+    keys = list(unique)
+    return [
+        unique[key] for key in keys
+        if not any(other != key and other in key for other in keys)
+    ]
+
+def compile_search_terms(terms: List[str]) -> Pattern:
+    """
+    Compila los términos de búsqueda en una única expresión regular.
+    
+    Args:
+        terms: Términos de búsqueda.
+        
+    Returns:
+        Pattern: Expresión que encuentra cualquiera de los términos sin distinguir mayúsculas.
+    """
+    # Los términos más largos primero para que la alternancia prefiera la coincidencia más específica
+    ordered = sorted(reduce_search_terms(terms), key=len, reverse=True)
+    if not ordered:
+        return re.compile(r"(?!)")
+    return re.compile("|".join(re.escape(term) for term in ordered), re.IGNORECASE)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Devuelve la configuración de la aplicación, construida una sola vez.
+    
+    Returns:
+        Settings: Configuración compartida.
+    """
+    return Settings()
+
+settings = get_settings()
+
+# Términos de búsqueda compilados una sola vez al cargar la configuración
+SEARCH_TERMS_PATTERN = compile_search_terms(settings.EMAIL_SEARCH_TERMS)
+
+def matches_search_terms(text: str) -> bool:
+    """
+    Indica si un texto (asunto, cuerpo) contiene alguno de los términos configurados.
+    
+    Args:
+        text: Texto a analizar.
+        
+    Returns:
+        bool: True si aparece al menos un término.
+    """
+    return bool(text) and SEARCH_TERMS_PATTERN.search(text) is not None
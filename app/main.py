@@ -1,49 +1,111 @@
 import os
+import glob
+import json
+import uuid
+import asyncio
 import logging
 import time
 from typing import List, Dict, Any, Optional
 import argparse
-from datetime import datetime
+
+import httpx
+import aiofiles
 
 from app.config.settings import settings
 from app.models.models import InvoiceData, ProcessResult, EmailConfig, JobStatus
 from app.modules.email_processor.email_processor import EmailProcessor
 from app.modules.openai_processor.openai_processor import OpenAIProcessor
 from app.modules.excel_exporter.excel_exporter import ExcelExporter
+from app.utils.invoice_cache import InvoiceCache
+from app.utils.file_utils import release_page_cache
+from app.utils.logging_setup import configure_logging
 
 # Configurar logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("invoicesync.log")
-    ]
-)
+configure_logging("invoicesync.log")
 
 logger = logging.getLogger(__name__)
 
+def _process_journal_path(pid: int) -> str:
+    """
+    Ruta del diario de facturas pendientes de un proceso: EXCEL_JOURNAL_PATH con
+    el PID antes de la extensión (p. ej. ./data/facturas.1234.jsonl).
+    
+    Args:
+        pid: PID del proceso.
+    
+    Returns:
+        str: Ruta del diario.
+    """
+    root, ext = os.path.splitext(settings.EXCEL_JOURNAL_PATH)
+    return f"{root}.{pid}{ext}"
+
+def _process_alive(pid: int) -> bool:
+    """
+    Indica si existe un proceso con ese PID.
+    
+    Args:
+        pid: PID del proceso.
+    
+    Returns:
+        bool: True si el proceso existe (o no se puede comprobar).
+    """
+    # En Windows, os.kill termina el proceso en lugar de comprobarlo
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Existe, pero pertenece a otro usuario
+        pass
+    return True
+
 class InvoiceSync:
-    def __init__(self):
-        """Inicializa el sistema de sincronización de facturas usando OpenAI."""
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        """
+        Inicializa el sistema de sincronización de facturas usando OpenAI.
+        
+        Args:
+            http_client: Cliente HTTP asíncrono compartido para las llamadas a OpenAI (opcional).
+        """
         # Crear directorios necesarios
         os.makedirs(settings.TEMP_PDF_DIR, exist_ok=True)
         os.makedirs(os.path.dirname(settings.EXCEL_OUTPUT_PATH), exist_ok=True)
         
+        self.openai_processor = OpenAIProcessor(http_client=http_client)
+        
+        # Facturas ya extraídas, indexadas por el hash del PDF (compartidas con el procesador de correos)
+        self.invoice_cache = InvoiceCache(
+            path=settings.INVOICE_CACHE_PATH or None,
+            version=self.openai_processor.prompt_version,
+            ttl_days=settings.INVOICE_CACHE_TTL_DAYS
+        )
+        
         # Inicializar componentes
-        self.email_processor = EmailProcessor()
-        self.openai_processor = OpenAIProcessor()
+        self.email_processor = EmailProcessor(invoice_cache=self.invoice_cache)
         self.excel_exporter = ExcelExporter()
         
         # Estado del job
         self._job_status = JobStatus(
             running=False,
-            interval_minutes=settings.JOB_INTERVAL_MINUTES,
-            next_run=None,
-            last_run=None,
+            interval_minutes=settings.JOB_MIN_INTERVAL_MINUTES,
+            next_run_ts=None,
+            last_run_ts=None,
             last_result=None
         )
         
+        # Cache de la próxima ejecución: ((last_run, intervalo), next_run)
+        self._next_run_cache = None
+        
+        # Escritura diferida del Excel: facturas pendientes de volcar y tarea de volcado
+        self._pending: List[InvoiceData] = []
+        self._pending_lock: Optional[asyncio.Lock] = None
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # Diario propio de este proceso: ningún otro proceso lo reescribe
+        self._journal_path = _process_journal_path(os.getpid())
+        
         logger.info("Sistema InvoiceSync inicializado correctamente")
     
     def process_emails(self) -> ProcessResult:
@@ -56,7 +118,7 @@ class InvoiceSync:
         logger.info("Iniciando procesamiento de correos")
         
         # Registrar inicio del procesamiento
-        self._job_status.last_run = datetime.now().isoformat()
+        self._job_status.last_run_ts = time.time()
         
         # Procesar correos
         result = self.email_processor.process_emails()
@@ -66,19 +128,73 @@ class InvoiceSync:
         
         return result
 
-    def process_pdf(self, pdf_path: str, metadata: Dict[str, Any] = None) -> InvoiceData:
+    def is_processing(self) -> bool:
+        """
+        Indica si hay un procesamiento de correos en curso.
+        
+        Returns:
+            bool: True si ya se están procesando correos.
+        """
+        return self.email_processor.is_processing()
+
+    def run_daemon(self, interval: int):
+        """
+        Procesa los correos cada interval segundos hasta que se interrumpa el proceso.
+        
+        Con OPENAI_BATCH_MODE, las facturas se extraen con la Batch API de OpenAI:
+        cada ejecución espera a que se resuelvan sus lotes antes de exportar.
+        
+        Args:
+            interval: Segundos entre ejecuciones.
+        """
+        if settings.OPENAI_BATCH_MODE:
+            logger.info("Extracción con la Batch API de OpenAI habilitada")
+            self.email_processor.enable_batch_mode()
+        
+        try:
+            while True:
+                result = self.process_emails()
+                logger.info(f"Resultado del procesamiento: {result.message}")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Deteniendo daemon...")
+        finally:
+            self.email_processor.disable_batch_mode()
+            self.invoice_cache.close()
+
+    async def process_pdf(self, pdf_path: str, metadata: Dict[str, Any] = None, digest: Optional[str] = None) -> InvoiceData:
         """
         Procesa un archivo PDF para extraer datos de factura.
         
+        Si se proporciona el hash del contenido y ese PDF ya fue procesado, se
+        reutilizan los datos extraídos sin volver a llamar a OpenAI.
+        
         Args:
             pdf_path: Ruta al archivo PDF.
             metadata: Metadatos adicionales.
+            digest: Hash SHA-256 (hexadecimal) del contenido del PDF (opcional).
             
         Returns:
             InvoiceData: Datos extraídos de la factura.
         """
+        if digest:
+            cached = self.invoice_cache.get(digest)
+            if cached is not None:
+                logger.info(f"PDF ya procesado anteriormente, reutilizando datos: {pdf_path}")
+                update = {"pdf_path": pdf_path}
+                if metadata and "sender" in metadata:
+                    update["email_origen"] = metadata["sender"]
+                return cached.model_copy(update=update)
+        
         logger.info(f"Procesando PDF: {pdf_path}")
-        return self.openai_processor.extract_invoice_data(pdf_path, metadata)
+        invoice_data = await self.openai_processor.aextract_invoice_data(pdf_path, metadata)
+        release_page_cache(pdf_path)
+        
+        # Solo cachear extracciones que obtuvieron datos de la factura
+        if digest and (invoice_data.numero_factura or invoice_data.cdc):
+            self.invoice_cache.set(digest, invoice_data)
+        
+        return invoice_data
     
     def start_scheduled_job(self) -> JobStatus:
         """
@@ -90,7 +206,7 @@ class InvoiceSync:
         if not self._job_status.running:
             self.email_processor.start_scheduled_job()
             self._job_status.running = True
-            self._job_status.next_run = self._calculate_next_run()
+            self._job_status.next_run_ts = self._calculate_next_run()
             logger.info(f"Job programado iniciado. Próxima ejecución: {self._job_status.next_run}")
         
         return self._job_status
@@ -105,7 +221,8 @@ class InvoiceSync:
         if self._job_status.running:
             self.email_processor.stop_scheduled_job()
             self._job_status.running = False
-            self._job_status.next_run = None
+            self._job_status.next_run_ts = None
+            self._next_run_cache = None
             logger.info("Job programado detenido")
         
         return self._job_status
@@ -117,28 +234,241 @@ class InvoiceSync:
         Returns:
             JobStatus: Estado actual del trabajo.
         """
+        # Reflejar el intervalo actual del job adaptativo
+        self._job_status.interval_minutes = self.email_processor.current_interval_minutes
+        
         # Actualizar el tiempo de la próxima ejecución si el job está corriendo
         if self._job_status.running:
-            self._job_status.next_run = self._calculate_next_run()
+            self._job_status.next_run_ts = self._calculate_next_run()
         
         return self._job_status
     
-    def _calculate_next_run(self) -> str:
+    async def start_excel_writer(self):
+        """
+        Inicia el volcado periódico al Excel de las facturas encoladas.
+        
+        Las facturas que quedaron sin volcar en los diarios JSONL de procesos ya
+        terminados (por ejemplo tras una caída) se recuperan y se vuelcan en el
+        primer ciclo.
+        """
+        if self._flush_task is not None:
+            return
+        
+        self._pending_lock = asyncio.Lock()
+        self._flush_event = asyncio.Event()
+        self._pending = await asyncio.to_thread(self._recover_journals)
+        if self._pending:
+            logger.info(f"Recuperadas {len(self._pending)} facturas pendientes del diario")
+            self._flush_event.set()
+        
+        self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def enqueue_invoice(self, invoice: InvoiceData):
+        """
+        Encola una factura para agregarla al Excel en el próximo volcado.
+        
+        La factura se registra en el diario JSONL antes de responder, de modo que
+        no se pierde si el proceso termina antes del volcado.
+        
+        Args:
+            invoice: Datos de la factura.
+        """
+        if self._flush_task is None:
+            await self.start_excel_writer()
+        
+        async with self._pending_lock:
+            self._pending.append(invoice)
+            async with aiofiles.open(self._journal_path, "a", encoding="utf-8") as journal:
+                await journal.write(invoice.model_dump_json(warnings=False) + "\n")
+            
+            if len(self._pending) >= settings.EXCEL_FLUSH_BATCH_SIZE:
+                self._flush_event.set()
+    
+    async def flush_invoices(self) -> str:
+        """
+        Vuelca al Excel las facturas encoladas.
+        
+        Returns:
+            str: Ruta del archivo Excel, o cadena vacía si no había facturas o falló la exportación.
+        """
+        if self._pending_lock is None:
+            return ""
+        
+        async with self._pending_lock:
+            batch = self._pending
+            self._pending = []
+        
+        if not batch:
+            return ""
+        
+        excel_path = await asyncio.to_thread(self.excel_exporter.export_invoices, batch)
+        
+        async with self._pending_lock:
+            if not excel_path:
+                # Reintentar en el próximo volcado
+                logger.error(f"No se pudieron volcar {len(batch)} facturas al Excel; se reintentará")
+                self._pending = batch + self._pending
+            else:
+                logger.info(f"Volcadas {len(batch)} facturas al Excel")
+                # El diario solo conserva lo que sigue pendiente
+                await asyncio.to_thread(self._write_journal, list(self._pending))
+        
+        return excel_path
+    
+    async def _flush_loop(self):
+        """Vuelca las facturas pendientes cada EXCEL_FLUSH_INTERVAL_SECONDS o al llenarse el lote."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=settings.EXCEL_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            
+            try:
+                await self.flush_invoices()
+            except Exception as e:
+                logger.error(f"Error al volcar facturas al Excel: {str(e)}")
+    
+    def _recover_journals(self) -> List[InvoiceData]:
+        """
+        Reclama los diarios de procesos que ya no existen (y el diario sin PID de
+        versiones anteriores) y pasa sus facturas al diario de este proceso.
+        
+        Cada diario se reclama renombrándolo: si dos procesos arrancan a la vez,
+        solo uno lo consigue. Los diarios de procesos vivos no se tocan.
+        
+        Returns:
+            List[InvoiceData]: Facturas registradas y aún no volcadas.
+        """
+        root, ext = os.path.splitext(settings.EXCEL_JOURNAL_PATH)
+        pid = os.getpid()
+        
+        claimed = []
+        for path in [settings.EXCEL_JOURNAL_PATH] + glob.glob(f"{glob.escape(root)}.*{ext}"):
+            if path.endswith(".tmp"):
+                continue
+            if path != settings.EXCEL_JOURNAL_PATH:
+                owner = path[len(root) + 1:len(path) - len(ext)].split(".")[0]
+                if owner.isdigit() and int(owner) != pid and _process_alive(int(owner)):
+                    continue
+            # El nombre reclamado sigue siendo de este proceso: si se cae antes de
+            # terminar, el próximo arranque lo recupera
+            target = f"{root}.{pid}.{uuid.uuid4().hex[:8]}{ext}"
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+        
+        invoices = []
+        for path in claimed:
+            invoices.extend(self._load_journal(path))
+        if claimed:
+            self._write_journal(invoices)
+            for path in claimed:
+                os.remove(path)
+        return invoices
+    
+    def _load_journal(self, path: str) -> List[InvoiceData]:
+        """
+        Lee las facturas pendientes de un diario JSONL.
+        
+        Las líneas que no se pueden leer (por ejemplo una escritura cortada por una
+        caída) no se descartan: se agregan al archivo de rechazos
+        (EXCEL_JOURNAL_PATH + ".rejected") para revisarlas a mano.
+        
+        Args:
+            path: Ruta del diario.
+        
+        Returns:
+            List[InvoiceData]: Facturas registradas y aún no volcadas.
+        """
+        invoices = []
+        rejected = []
+        try:
+            with open(path, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        # Los datos estructurados en null toman su valor por defecto (ver NestedData)
+                        invoices.append(InvoiceData.model_validate(json.loads(line)))
+                    except Exception as e:
+                        logger.error(f"Línea inválida en el diario de facturas, se pasa a los rechazos: {str(e)}")
+                        rejected.append(line)
+        except FileNotFoundError:
+            pass
+        
+        if rejected:
+            with open(f"{settings.EXCEL_JOURNAL_PATH}.rejected", "a", encoding="utf-8") as rejects:
+                rejects.writelines(line + "\n" for line in rejected)
+        return invoices
+    
+    def _write_journal(self, invoices: List[InvoiceData]):
+        """
+        Reescribe el diario JSONL de este proceso con las facturas indicadas.
+        
+        Args:
+            invoices: Facturas que siguen pendientes de volcar.
+        """
+        tmp_path = f"{self._journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as journal:
+            for invoice in invoices:
+                journal.write(invoice.model_dump_json(warnings=False) + "\n")
+        os.replace(tmp_path, self._journal_path)
+    
+    async def aclose(self):
+        """
+        Libera los recursos del sistema: detiene el job programado, vuelca las
+        facturas pendientes al Excel y cierra los clientes HTTP propios del
+        procesador de OpenAI y la cache de facturas.
+        """
+        self.stop_scheduled_job()
+        
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+            await self.flush_invoices()
+            # Sin facturas pendientes, el diario de este proceso ya no hace falta
+            if not self._pending:
+                try:
+                    os.remove(self._journal_path)
+                except FileNotFoundError:
+                    pass
+        
+        await self.openai_processor.aclose()
+        self.invoice_cache.close()
+    
+    def _calculate_next_run(self) -> float:
         """
         Calcula el tiempo de la próxima ejecución del job.
         
+        El resultado se reutiliza mientras no cambien la última ejecución ni el
+        intervalo, de modo que las consultas repetidas de estado no lo recalculan.
+        
         Returns:
-            str: Tiempo de la próxima ejecución en formato ISO.
+            float: Tiempo de la próxima ejecución como timestamp epoch.
         """
-        # Esta es una estimación simple. El schedule.py podría tener un tiempo ligeramente diferente
-        now = datetime.now()
-        next_run = now.replace(second=0, microsecond=0)
+        # El scheduler conoce la próxima ejecución exacta mientras el job está activo
+        if self.email_processor.next_run_ts is not None:
+            return self.email_processor.next_run_ts
+        
+        interval_minutes = self.email_processor.current_interval_minutes
+        key = (self._job_status.last_run_ts, interval_minutes)
+        if self._next_run_cache and self._next_run_cache[0] == key:
+            return self._next_run_cache[1]
         
-        # Añadir los minutos del intervalo
-        from datetime import timedelta
-        next_run += timedelta(minutes=settings.JOB_INTERVAL_MINUTES)
+        # Estimación simple cuando el scheduler aún no programó la ejecución
+        # Redondear al minuto y añadir los minutos del intervalo
+        next_run_ts = (time.time() // 60) * 60 + interval_minutes * 60
         
-        return next_run.isoformat()
+        self._next_run_cache = (key, next_run_ts)
+        return next_run_ts
 
 def main():
     """Función principal para ejecutar desde línea de comandos."""
@@ -1,38 +1,64 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, computed_field, field_validator
 from typing import Optional, List
 from datetime import datetime
 
-class ProductoFactura(BaseModel):
+class NestedData(BaseModel):
+    """
+    Base de los datos estructurados de una factura. Un campo en null (respuestas del
+    modelo o facturas guardadas con versiones anteriores del esquema) toma su valor
+    por defecto en lugar de invalidar la factura completa.
+    """
+    
+    @field_validator("*", mode="before")
+    @classmethod
+    def _none_as_default(cls, value, info):
+        """Reemplaza null por el valor por defecto del campo."""
+        if value is None:
+            return cls.model_fields[info.field_name].get_default()
+        return value
+
+class ProductoFactura(NestedData):
     """Modelo para los productos/servicios en la factura."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     articulo: str = ""
     cantidad: float = 0
     precio_unitario: float = 0
     total: float = 0
 
-class EmpresaData(BaseModel):
+class EmpresaData(NestedData):
     """Datos de la empresa emisora."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     nombre: str = ""
     ruc: str = ""
     direccion: str = ""
     telefono: str = ""
     actividad_economica: str = ""
 
-class TimbradoData(BaseModel):
+class TimbradoData(NestedData):
     """Datos del timbrado."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     nro: str = ""
     fecha_inicio_vigencia: str = ""
     valido_hasta: str = ""
 
-class FacturaData(BaseModel):
+class FacturaData(NestedData):
     """Datos específicos de la factura."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     contado_nro: str = ""
     fecha: str = ""
     caja_nro: str = ""
     cdc: str = ""
     condicion_venta: str = ""
 
-class TotalesData(BaseModel):
+class TotalesData(NestedData):
     """Totales de la factura."""
+    # populate_by_name: model_dump_json escribe los IVA sin "%" (cache y journal)
+    model_config = ConfigDict(extra="ignore", frozen=True, populate_by_name=True)
+    
     cantidad_articulos: int = 0
     subtotal: float = 0
     total_a_pagar: float = 0
@@ -41,14 +67,44 @@ class TotalesData(BaseModel):
     iva_10: float = Field(0, alias="iva_10%")
     total_iva: float = 0
 
-class ClienteData(BaseModel):
+class ClienteData(NestedData):
     """Datos del cliente."""
+    model_config = ConfigDict(extra="ignore", frozen=True)
+    
     nombre: str = ""
     ruc: str = ""
     email: str = ""
 
 class InvoiceData(BaseModel):
     """Modelo completo para los datos extraídos de una factura."""
+    model_config = ConfigDict(
+        extra="ignore",
+        json_schema_extra={
+            "example": {
+                "fecha": "2023-09-15T00:00:00",
+                "ruc_emisor": "80014066-4",
+                "nombre_emisor": "Empresa ABC S.A.",
+                "numero_factura": "F001-12345",
+                "monto_total": 1180.0,
+                "iva": 180.0,
+                "pdf_path": "data/pdfs/factura_001.pdf",
+                "email_origen": "facturacion@empresa.com",
+                "procesado_en": "2023-09-16T10:30:45",
+                "timbrado": "12345678",
+                "cdc": "01234567890123456789012345678901234567890123",
+                "ruc_cliente": "5379057-0",
+                "nombre_cliente": "Cliente XYZ S.A.",
+                "email_cliente": "cliente@xyz.com",
+                "condicion_venta": "Contado",
+                "moneda": "PYG",
+                "subtotal_exentas": 0.0,
+                "subtotal_5": 100.0,
+                "subtotal_10": 1000.0,
+                "actividad_economica": "Servicios Informáticos"
+            }
+        }
+    )
+    
     fecha: Optional[datetime] = None
     ruc_emisor: Optional[str] = None
     nombre_emisor: Optional[str] = None
@@ -79,35 +135,11 @@ class InvoiceData(BaseModel):
     productos: List[ProductoFactura] = Field(default_factory=list)
     totales: Optional[TotalesData] = None
     cliente: Optional[ClienteData] = None
-    
-    class Config:
-        schema_extra = {
-            "example": {
-                "fecha": "2023-09-15T00:00:00",
-                "ruc_emisor": "80014066-4",
-                "nombre_emisor": "Empresa ABC S.A.",
-                "numero_factura": "F001-12345",
-                "monto_total": 1180.0,
-                "iva": 180.0,
-                "pdf_path": "data/pdfs/factura_001.pdf",
-                "email_origen": "facturacion@empresa.com",
-                "procesado_en": "2023-09-16T10:30:45",
-                "timbrado": "12345678",
-                "cdc": "01234567890123456789012345678901234567890123",
-                "ruc_cliente": "5379057-0",
-                "nombre_cliente": "Cliente XYZ S.A.",
-                "email_cliente": "cliente@xyz.com",
-                "condicion_venta": "Contado",
-                "moneda": "PYG",
-                "subtotal_exentas": 0.0,
-                "subtotal_5": 100.0,
-                "subtotal_10": 1000.0,
-                "actividad_economica": "Servicios Informáticos"
-            }
-        }
 
 class EmailConfig(BaseModel):
     """Configuración para la conexión al correo."""
+    model_config = ConfigDict(extra="ignore")
+    
     host: str
     port: int
     username: str
@@ -117,6 +149,8 @@ class EmailConfig(BaseModel):
 
 class ProcessResult(BaseModel):
     """Resultado del procesamiento de facturas."""
+    model_config = ConfigDict(extra="ignore")
+    
     success: bool
     message: str
     invoice_count: int = 0
@@ -124,8 +158,23 @@ class ProcessResult(BaseModel):
 
 class JobStatus(BaseModel):
     """Estado del job programado."""
+    model_config = ConfigDict(extra="ignore")
+    
     running: bool
-    next_run: Optional[str] = None
     interval_minutes: int
-    last_run: Optional[str] = None
+    # Marcas de tiempo epoch; se formatean a ISO solo al serializar
+    next_run_ts: Optional[float] = Field(default=None, exclude=True)
+    last_run_ts: Optional[float] = Field(default=None, exclude=True)
     last_result: Optional[ProcessResult] = None
+    
+    @computed_field
+    @property
+    def next_run(self) -> Optional[str]:
+        """Próxima ejecución en formato ISO."""
+        return datetime.fromtimestamp(self.next_run_ts).isoformat() if self.next_run_ts is not None else None
+    
+    @computed_field
+    @property
+    def last_run(self) -> Optional[str]:
+        """Última ejecución en formato ISO."""
+        return datetime.fromtimestamp(self.last_run_ts).isoformat() if self.last_run_ts is not None else None
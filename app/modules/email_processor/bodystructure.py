@@ -0,0 +1,295 @@
+import re
+import base64
+import binascii
+import quopri
+from urllib.parse import unquote
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+# Tokens de una respuesta IMAP: paréntesis, cadenas entre comillas, literales {n} y átomos.
+# Los átomos pueden contener una sección entre corchetes, p. ej. BODY[1.2]
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+# Caracteres escapados dentro de una cadena entre comillas
+_QUOTED_ESCAPE_RE = re.compile(rb'\\(.)')
+
+# Bytes que no pertenecen al alfabeto base64: b64decode los ignora, y la
+# decodificación por bloques los quita antes de agrupar de a 4 caracteres
+_NON_BASE64 = bytes(set(range(256)) - set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="))
+
+class BodyPart(NamedTuple):
+    """Parte simple (no multipart) de un mensaje, según su BODYSTRUCTURE."""
+    section: str
+    content_type: str
+    filename: str
+    encoding: str
+    charset: str
+    size: int
+    # Subparte directa de un multipart/alternative (otra versión del mismo contenido)
+    alternative: bool = False
+
+def _tokenize(text: bytes, tokens: List[Any]) -> bool:
+    """
+    Agrega a tokens los elementos de un fragmento de respuesta IMAP.
+
+    Args:
+        text: Fragmento de texto de la respuesta.
+        tokens: Lista donde se agregan los tokens.
+
+    Returns:
+        bool: True si el fragmento termina anunciando un literal {n}.
+    """
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            break
+        pos = match.end()
+
+        open_paren, close_paren, quoted, literal, atom = match.groups()
+        if open_paren:
+            tokens.append("(")
+        elif close_paren:
+            tokens.append(")")
+        elif quoted is not None:
+            tokens.append(_QUOTED_ESCAPE_RE.sub(rb'\1', quoted))
+        elif literal is not None:
+            return True
+        elif atom is not None:
+            tokens.append(None if atom.upper() == b"NIL" else atom)
+    return False
+
+def _build(tokens: List[Any], pos: int) -> Tuple[Any, int]:
+    """
+    Construye listas anidadas a partir de los tokens.
+
+    Args:
+        tokens: Tokens de la respuesta.
+        pos: Posición del token a interpretar.
+
+    Returns:
+        Tuple: (valor, siguiente posición)
+    """
+    token = tokens[pos]
+    if token != "(":
+        return token, pos + 1
+
+    items = []
+    pos += 1
+    while pos < len(tokens) and tokens[pos] != ")":
+        item, pos = _build(tokens, pos)
+        items.append(item)
+    return items, pos + 1
+
+def parse_fetch_response(data: List[Any]) -> Dict[str, Dict[bytes, Any]]:
+    """
+    Interpreta la respuesta de imaplib a un FETCH.
+
+    imaplib devuelve tuplas (texto, literal) para los datos enviados como
+    literales y bytes para el resto; aquí se reconstruye la estructura completa.
+
+    Args:
+        data: Datos devueltos por IMAP4.fetch().
+
+    Returns:
+        Dict: Por número de mensaje, los elementos recibidos (p. ej. b"BODYSTRUCTURE",
+            b"BODY[HEADER]", b"UID") con sus valores.
+    """
+    tokens: List[Any] = []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            if _tokenize(item[0], tokens):
+                tokens.append(item[1])
+        else:
+            _tokenize(item, tokens)
+
+    messages: Dict[str, Dict[bytes, Any]] = {}
+    pos = 0
+    while pos < len(tokens):
+        message_id = tokens[pos]
+        if pos + 1 >= len(tokens) or tokens[pos + 1] != "(" or not isinstance(message_id, bytes):
+            pos += 1
+            continue
+
+        items, pos = _build(tokens, pos + 1)
+        fields = messages.setdefault(message_id.decode(), {})
+        for i in range(0, len(items) - 1, 2):
+            key = items[i]
+            if isinstance(key, bytes):
+                fields[key.upper()] = items[i + 1]
+
+    return messages
+
+def _text(value: Any) -> str:
+    """Convierte un valor de BODYSTRUCTURE a texto."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return ""
+
+def _params(value: Any) -> Dict[str, str]:
+    """Convierte una lista de parámetros (clave valor ...) en un diccionario."""
+    params = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_text(value[i]).lower()] = _text(value[i + 1])
+    return params
+
+def _filename(params: Dict[str, str]) -> str:
+    """Obtiene el nombre de archivo de unos parámetros, incluida la forma RFC 2231 (filename*)."""
+    for key in ("filename", "name"):
+        if params.get(key):
+            return params[key]
+        extended = params.get(f"{key}*")
+        if extended:
+            # Formato charset'idioma'valor-con-%XX
+            charset, _, value = extended.split("'", 2) if extended.count("'") >= 2 else ("", "", extended)
+            return unquote(value, encoding=charset or "utf-8", errors="replace")
+    return ""
+
+def walk_bodystructure(structure: Any, section: str = "", alternative: bool = False) -> List[BodyPart]:
+    """
+    Enumera las partes simples de un BODYSTRUCTURE con su número de sección.
+
+    Args:
+        structure: BODYSTRUCTURE ya interpretado (listas anidadas).
+        section: Sección de la parte actual ("" para el mensaje completo).
+        alternative: Si la parte actual es subparte directa de un multipart/alternative.
+
+    Returns:
+        List[BodyPart]: Partes simples en orden.
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    # Multipart: las primeras entradas son las subpartes, luego el subtipo
+    if isinstance(structure[0], list):
+        children = []
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            children.append(child)
+        subtype = _text(structure[len(children)]).lower() if len(structure) > len(children) else ""
+
+        parts = []
+        for index, child in enumerate(children, 1):
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(walk_bodystructure(child, child_section, subtype == "alternative"))
+        return parts
+
+    # Un mensaje que no es multipart tiene su cuerpo en la sección 1
+    section = section or "1"
+
+    maintype = _text(structure[0]).lower()
+    subtype = _text(structure[1]).lower() if len(structure) > 1 else ""
+    params = _params(structure[2]) if len(structure) > 2 else {}
+    encoding = _text(structure[5]).lower() if len(structure) > 5 else ""
+    try:
+        size = int(structure[6]) if len(structure) > 6 and structure[6] is not None else 0
+    except ValueError:
+        size = 0
+
+    # Mensaje adjunto: recorrer su estructura interna
+    if maintype == "message" and subtype == "rfc822" and len(structure) > 8 and isinstance(structure[8], list):
+        inner = structure[8]
+        if inner and isinstance(inner[0], list):
+            return walk_bodystructure(inner, section)
+        return walk_bodystructure(inner, f"{section}.1")
+
+    # Posición de la disposición según el tipo de parte
+    disposition_index = 9 if maintype == "text" else 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    disposition_params = _params(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else {}
+
+    return [BodyPart(
+        section=section,
+        content_type=f"{maintype}/{subtype}",
+        filename=_filename(disposition_params) or _filename(params),
+        encoding=encoding,
+        charset=params.get("charset", ""),
+        size=size,
+        alternative=alternative
+    )]
+
+def decode_part(data: bytes, encoding: str, truncated: bool = False) -> bytes:
+    """
+    Decodifica el contenido de una parte según su Content-Transfer-Encoding.
+
+    Args:
+        data: Contenido tal como lo envía el servidor.
+        encoding: Codificación de la parte (base64, quoted-printable, 7bit...).
+        truncated: Si el contenido es solo el comienzo de la parte (FETCH parcial
+            BODY[sección]<0.n>); se descarta el último bloque codificado incompleto.
+
+    Returns:
+        bytes: Contenido decodificado.
+    """
+    encoding = (encoding or "").lower()
+    if truncated and encoding == "base64":
+        data = b"".join(data.split())
+        data = data[:len(data) - len(data) % 4]
+    elif truncated and encoding == "quoted-printable":
+        # Cortar en el último fin de línea para no dejar a medias una secuencia =XX;
+        # si aún no llegó ninguno, quitar la secuencia incompleta del final
+        end = data.rfind(b"\n") + 1
+        if end:
+            data = data[:end]
+        else:
+            escape = data.rfind(b"=", max(len(data) - 2, 0))
+            if escape != -1:
+                data = data[:escape]
+    if encoding == "base64":
+        return base64.b64decode(data)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
+
+def iter_decode_part(data: bytes, encoding: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Decodifica el contenido de una parte por bloques, sin crear una copia completa
+    del contenido decodificado.
+
+    Args:
+        data: Contenido tal como lo envía el servidor.
+        encoding: Codificación de la parte (base64, quoted-printable, 7bit...).
+        chunk_size: Tamaño de los bloques codificados a procesar.
+
+    Yields:
+        bytes: Bloques del contenido decodificado.
+    """
+    encoding = (encoding or "").lower()
+    if encoding not in ("base64", "quoted-printable"):
+        yield data
+        return
+
+    # Los bloques se toman como vistas del contenido original, sin copiarlo
+    view = memoryview(data)
+
+    if encoding == "quoted-printable":
+        # Cortar siempre en fin de línea: un salto suave (=) al final de un bloque
+        # solo une la línea con la siguiente, que empieza el bloque siguiente
+        start = 0
+        while start < len(data):
+            end = data.find(b"\n", start + chunk_size)
+            end = len(data) if end == -1 else end + 1
+            yield binascii.a2b_qp(view[start:end])
+            start = end
+        return
+
+    pending = b""
+    for start in range(0, len(view), chunk_size):
+        # Quitar saltos de línea y otros caracteres fuera del alfabeto; solo se
+        # decodifican grupos completos de 4 caracteres
+        encoded = pending + view[start:start + chunk_size].tobytes().translate(None, _NON_BASE64)
+        if b"=" in encoded:
+            # Relleno: en un adjunto válido solo aparece al final. El resto se decodifica
+            # de una vez, de modo que el resultado (o el binascii.Error si el relleno
+            # es inválido) es el mismo que con decode_part
+            yield base64.b64decode(encoded + view[start + chunk_size:].tobytes())
+            return
+        usable = len(encoded) - len(encoded) % 4
+        pending = encoded[usable:]
+        if usable:
+            yield binascii.a2b_base64(encoded[:usable])
+
+    if pending:
+        yield base64.b64decode(pending)
@@ -1,30 +1,540 @@
 import imaplib
 import email
 import os
+import atexit
 import logging
 import time
-import schedule
 import threading
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
+from itertools import chain, count, islice
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from email import policy
 from email.header import decode_header
-from typing import List, Tuple, Optional, Dict, Any
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import List, Tuple, Optional, Dict, Any, Iterator, Iterable, Pattern
 import re
-from datetime import datetime
+from urllib.parse import urlparse, urlsplit, parse_qs, parse_qsl, urlencode, urljoin
+from enum import Enum
 
-from app.config.settings import settings
+# Parser HTML: selectolax (Lexbor, en C) si está instalado; BeautifulSoup como alternativa
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# Backend de BeautifulSoup: lxml (en C) si está instalado; html.parser de la biblioteca estándar si no
+try:
+    import lxml  # noqa: F401
+    _BS4_PARSER = 'lxml'
+except ImportError:
+    _BS4_PARSER = 'html.parser'
+
+from app.config.settings import settings, reduce_search_terms
 from app.models.models import EmailConfig, InvoiceData, ProcessResult
 from app.modules.openai_processor.openai_processor import OpenAIProcessor
+from app.modules.openai_processor.batch_processor import BatchQueueProcessor
 from app.modules.excel_exporter.excel_exporter import ExcelExporter
+from app.modules.email_processor.bodystructure import BodyPart, decode_part, iter_decode_part, parse_fetch_response, walk_bodystructure
+from app.utils.invoice_cache import InvoiceCache, file_sha256
+from app.utils.file_utils import release_page_cache
 
 logger = logging.getLogger(__name__)
 
+# Conexiones IMAP autenticadas reutilizadas entre ejecuciones, por (host, usuario)
+_CONN_POOL: Dict[Tuple[str, str], imaplib.IMAP4_SSL] = {}
+# Último uso de cada conexión del pool (time.monotonic())
+_CONN_LAST_USED: Dict[Tuple[str, str], float] = {}
+_CONN_POOL_LOCK = threading.Lock()
+
+# Los servidores IMAP pueden cerrar sesiones inactivas a partir de 30 minutos (RFC 3501):
+# pasado este tiempo sin uso, la conexión del pool se reemplaza sin intentar NOOP
+IMAP_IDLE_TIMEOUT_SECONDS = 25 * 60
+
+# Cantidad máxima de IDs por comando STORE al marcar correos como leídos
+STORE_BATCH_SIZE = 500
+
+# Tamaño máximo (según BODYSTRUCTURE) de las secciones que se piden en un mismo FETCH
+# al descargar juntas las partes de varios correos (16 MiB)
+SECTION_FETCH_MAX_BYTES = 16 * 1024 * 1024
+
+# Tamaño de bloque para escribir descargas en disco (64 KiB)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Descargas simultáneas de enlaces en toda una ejecución (todos los correos comparten el pool)
+LINK_DOWNLOAD_WORKERS = 8
+# Descargas simultáneas hacia un mismo servidor de facturación (p. ej. facte.siga.com.py)
+LINK_DOWNLOADS_PER_HOST = 4
+
+# Cantidad máxima de enlaces que se toman de un correo: al alcanzarla no se
+# decodifican ni se analizan las partes de texto restantes
+MAX_LINKS_PER_EMAIL = 50
+
+# Tamaño máximo de una página HTML de factura que se lee en memoria (5 MiB)
+MAX_HTML_PAGE_SIZE = 5 * 1024 * 1024
+
+# Tamaño máximo que se descarga de cada parte de texto del correo (2 MiB). De las
+# partes mayores (p. ej. HTML con imágenes embebidas en base64) solo se pide el
+# comienzo con un FETCH parcial: los enlaces a la factura están antes que el resto
+MAX_TEXT_PART_SIZE = 2 * 1024 * 1024
+
+# Parser de encabezados con la política moderna: nunca recorre el cuerpo del mensaje,
+# las partes necesarias se piden aparte por sección
+_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+
+# Solo se descargan los encabezados que se usan en los metadatos; el resto
+# (Received, DKIM, etc.) puede ocupar varios KB por correo
+_HEADER_ITEM = "BODY.PEEK[HEADER.FIELDS (SUBJECT FROM DATE)]"
+
+# Errores que indican que la conexión IMAP ya no es utilizable
+_CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError)
+
+# Contador de archivos guardados: junto con la hora da nombres únicos sin formatear fechas
+_FILE_COUNTER = count()
+
+# Expresiones regulares compiladas una sola vez al importar el módulo
+# URLs de PDF desde el "://": al empezar por un literal, re salta directamente a cada
+# aparición en lugar de intentar una coincidencia en cada posición del texto.
+# El esquema (http o https) se comprueba después, en _find_pdf_urls
+_PDF_URL_RE = re.compile(r'://[^\s<>"]+\.(?i:pdf)')
+_SAFE_NAME_RE = re.compile(r'[^\w\-_\. ]')
+_RUC_RE = re.compile(r'ruc[=:]([^&\s]+)', re.IGNORECASE)
+_CDC_RE = re.compile(r'(?:cdc|codigo|code|document)[=:]([^&\s]+)', re.IGNORECASE)
+_ID_CLEAN_RE = re.compile(r'[^\w\-]')
+_DOMAIN_CLEAN_RE = re.compile(r'[^\w\-_]')
+
+# Palabras clave (en minúsculas, como el texto con el que se comparan) que identifican
+# enlaces de facturas en los correos y enlaces de descarga en las páginas de facturación
+_FACTURA_KEYWORDS = frozenset([
+    'visualizar documento', 'ver factura', 'descargar factura',
+    'factura electronica', 'visualizar',
+    'descargar xml', 'ver documento',
+    'pdf', 'imprimir', 'download', 'print',
+    'factura electrónica', 'generar pdf', 'exportar pdf', 'ver pdf'
+])
+_PDF_KEYWORDS = _FACTURA_KEYWORDS | frozenset(['descargar'])
+
+# Parámetros de seguimiento que no cambian el documento al que apunta un enlace
+_TRACKING_PARAMS = frozenset(['fbclid', 'gclid', 'mc_cid', 'mc_eid', '_hsenc', '_hsmi'])
+
+def _normalize_url(url: str) -> str:
+    """
+    Normaliza una URL para detectar enlaces repetidos: quita el fragmento y los
+    parámetros de seguimiento (utm_*, fbclid...).
+
+    Args:
+        url: URL a normalizar.
+
+    Returns:
+        str: URL normalizada.
+    """
+    parsed = urlparse(url.strip())
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in _TRACKING_PARAMS
+    ]
+    return parsed._replace(netloc=parsed.netloc.lower(), query=urlencode(query), fragment='').geturl()
+
+def _quote_imap(text: str) -> str:
+    """
+    Convierte un texto en una cadena entre comillas de IMAP, escapando comillas y barras.
+
+    Args:
+        text: Texto ASCII a enviar.
+
+    Returns:
+        str: Texto entre comillas.
+    """
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _uid_set(uids: List[str]) -> str:
+    """
+    Compacta una lista de UIDs en la sintaxis de conjuntos de IMAP (p. ej. "1:3,7"),
+    para que los lotes de UIDs consecutivos ocupen poco en el comando.
+
+    Args:
+        uids: UIDs de los correos.
+
+    Returns:
+        str: Conjunto de UIDs para FETCH o STORE.
+    """
+    try:
+        # El orden no importa en un conjunto: ordenar agrupa los UIDs consecutivos
+        numbers = sorted({int(uid) for uid in uids})
+    except ValueError:
+        return ",".join(uids)
+
+    ranges = []
+    start = previous = None
+    for number in numbers:
+        if previous is not None and number == previous + 1:
+            previous = number
+            continue
+        if start is not None:
+            ranges.append(f"{start}:{previous}" if previous != start else str(start))
+        start = previous = number
+    if start is not None:
+        ranges.append(f"{start}:{previous}" if previous != start else str(start))
+    return ",".join(ranges)
+
+def _section_item(part: BodyPart, filename: str) -> str:
+    """
+    Elemento FETCH con el que se descarga una parte elegida por _plan_email.
+
+    Args:
+        part: Parte del correo.
+        filename: Nombre del PDF adjunto, o "" para una parte de texto.
+
+    Returns:
+        str: BODY.PEEK[sección], o BODY.PEEK[sección]<0.n> para las partes de texto
+            mayores que MAX_TEXT_PART_SIZE.
+    """
+    if not filename and part.size > MAX_TEXT_PART_SIZE:
+        return f"BODY.PEEK[{part.section}]<0.{MAX_TEXT_PART_SIZE}>"
+    return f"BODY.PEEK[{part.section}]"
+
+def _index_by_uid(messages: Dict[str, Dict[bytes, Any]]) -> Dict[str, Dict[bytes, Any]]:
+    """
+    Reindexa por UID la respuesta de un UID FETCH, que el servidor envía por número de secuencia.
+
+    Args:
+        messages: Respuesta interpretada por parse_fetch_response.
+
+    Returns:
+        Dict: Por UID, los elementos recibidos. Se omiten las respuestas sin UID.
+    """
+    indexed = {}
+    for fields in messages.values():
+        uid = fields.get(b"UID")
+        if isinstance(uid, bytes):
+            indexed[uid.decode()] = fields
+    return indexed
+
+@lru_cache(maxsize=2048)
+def _decode_header_cached(header: str) -> str:
+    """
+    Decodifica un encabezado con palabras codificadas RFC 2047. Se cachea porque
+    en un lote de facturas los mismos remitentes y nombres de archivo se repiten.
+
+    Args:
+        header: Encabezado a decodificar (no vacío).
+
+    Returns:
+        str: Encabezado decodificado.
+    """
+    try:
+        decoded_parts = []
+        for part, encoding in decode_header(header):
+            if isinstance(part, bytes):
+                if encoding:
+                    decoded_part = part.decode(encoding)
+                else:
+                    decoded_part = part.decode('utf-8', errors='replace')
+            else:
+                decoded_part = part
+
+            decoded_parts.append(str(decoded_part))
+
+        return "".join(decoded_parts)
+
+    except Exception as e:
+        logger.warning(f"Error al decodificar encabezado '{header}': {str(e)}")
+        return header
+
+def _compile_keywords(keywords: Iterable[str]) -> Pattern:
+    """
+    Compila un conjunto de palabras clave en una única alternancia, de modo que el
+    texto se recorre una sola vez en lugar de una vez por palabra clave.
+
+    Args:
+        keywords: Palabras clave a buscar como subcadenas.
+
+    Returns:
+        Pattern: Expresión regular que encuentra cualquiera de las palabras clave.
+    """
+    return re.compile("|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)))
+
+_FACTURA_KEYWORDS_RE = _compile_keywords(_FACTURA_KEYWORDS)
+_PDF_KEYWORDS_RE = _compile_keywords(_PDF_KEYWORDS)
+
+def _find_pdf_urls(content: str) -> List[str]:
+    """
+    Busca en un texto las URLs http(s) que terminan en .pdf, en una sola pasada.
+
+    Args:
+        content: Texto o HTML donde buscar.
+
+    Returns:
+        List[str]: URLs encontradas, en orden de aparición.
+    """
+    urls = []
+    pos = 0
+    while True:
+        match = _PDF_URL_RE.search(content, pos)
+        if match is None:
+            return urls
+
+        start = match.start()
+        if content[start - 5:start].lower() == "https":
+            urls.append(content[start - 5:match.end()])
+            pos = match.end()
+        elif content[start - 4:start].lower() == "http":
+            urls.append(content[start - 4:match.end()])
+            pos = match.end()
+        else:
+            # Otro esquema (ftp://...): puede contener una URL http más adelante
+            pos = start + 3
+
+# Servidor de facturas electrónicas SIGA. Sus enlaces se encuentran por el texto
+# del enlace (_FACTURA_KEYWORDS_RE), no por la URL.
+# Para mi yo del futuro, verificar las URLS de las compañías que envian sus facturas por este metodo.
+_SIGA_HOST = "facte.siga.com.py"
+
+class LinkKind(Enum):
+    """Tipo de un enlace encontrado en un correo, según su URL."""
+    # Visualización de una factura electrónica de SIGA (printDE)
+    SIGA_PRINT = "siga_print"
+    # Descarga del XML de una factura electrónica de SIGA (downloadXML)
+    SIGA_XML = "siga_xml"
+    # Otra página de SIGA
+    SIGA = "siga"
+    # PDF directo: la ruta termina en .pdf
+    PDF = "pdf"
+    OTHER = "other"
+    
+    @property
+    def is_siga(self) -> bool:
+        """Indica si el enlace apunta al servidor de SIGA."""
+        return self in (LinkKind.SIGA_PRINT, LinkKind.SIGA_XML, LinkKind.SIGA)
+
+@lru_cache(maxsize=4096)
+def _classify_link(url: str) -> LinkKind:
+    """
+    Clasifica un enlace según su servidor y su ruta. La URL se interpreta una sola
+    vez (se cachea): el resto son comparaciones sobre el servidor y la ruta, en lugar
+    de buscar subcadenas en toda la URL, donde pueden aparecer en los parámetros.
+
+    Args:
+        url: URL del enlace.
+
+    Returns:
+        LinkKind: Tipo del enlace.
+    """
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+    except ValueError:
+        return LinkKind.OTHER
+
+    path = parts.path.lower()
+    if host == _SIGA_HOST:
+        if path.endswith("/printde"):
+            return LinkKind.SIGA_PRINT
+        if path.endswith("/downloadxml"):
+            return LinkKind.SIGA_XML
+        return LinkKind.SIGA
+    if path.endswith(".pdf"):
+        return LinkKind.PDF
+    return LinkKind.OTHER
+
+@lru_cache(maxsize=4096)
+def _filename_stem_from_url(url: str) -> str:
+    """
+    Genera la base del nombre de archivo de una factura a partir de su URL (RUC,
+    CDC o número de factura, o dominio y hash). Se cachea porque la misma URL se
+    procesa varias veces entre reintentos y ejecuciones del daemon.
+
+    Args:
+        url: URL del archivo.
+
+    Returns:
+        str: Nombre sin marca de tiempo ni extensión.
+    """
+    # Análisis dinámico de cualquier URL
+    try:
+        # Parsear la URL para extraer parámetros
+        parsed_url = urlparse(url)
+        query_params = parse_qs(parsed_url.query)
+
+        # Buscar parámetros comunes de facturas de forma dinámica
+        ruc = None
+        cdc = None
+        numero_factura = None
+
+        # Buscar información útil en parámetros de query
+        for param_name, values in query_params.items():
+            param_lower = param_name.lower()
+            if values and values[0]:  # Asegurar que hay valor
+                if 'ruc' in param_lower:
+                    ruc = values[0]
+                elif any(keyword in param_lower for keyword in ['cdc', 'codigo', 'code', 'document', 'doc']):
+                    cdc = values[0][:12]  # Limitar longitud
+                elif any(keyword in param_lower for keyword in ['factura', 'invoice', 'numero', 'number', 'num']):
+                    numero_factura = values[0][:10]  # Limitar longitud
+
+        # También buscar en la URL completa con regex (backup)
+        if not ruc:
+            ruc_match = _RUC_RE.search(url)
+            if ruc_match:
+                ruc = ruc_match.group(1)
+
+        if not cdc:
+            cdc_match = _CDC_RE.search(url)
+            if cdc_match:
+                cdc = cdc_match.group(1)[:12]
+
+        # Construir nombre basado en información disponible
+        parts = []
+
+        if ruc:
+            # Limpiar RUC de caracteres especiales
+            ruc_clean = _ID_CLEAN_RE.sub('', ruc)
+            parts.append(f"ruc_{ruc_clean}")
+
+        if cdc:
+            # Limpiar CDC de caracteres especiales
+            cdc_clean = _ID_CLEAN_RE.sub('', cdc)
+            parts.append(f"cdc_{cdc_clean}")
+
+        if numero_factura:
+            # Limpiar número de factura
+            num_clean = _ID_CLEAN_RE.sub('', numero_factura)
+            parts.append(f"num_{num_clean}")
+
+        # Si tenemos información útil, usarla
+        if parts:
+            identifier = "_".join(parts)
+            return f"factura_{identifier}"
+
+    except Exception as e:
+        logger.warning(f"Error al parsear URL para nombre de archivo: {str(e)}")
+
+    # Fallback universal: usar dominio + hash de la URL
+    try:
+        parsed_url = urlparse(url)
+        domain = parsed_url.netloc.replace('.', '_').replace(':', '_')
+        # Usar solo los primeros caracteres del dominio para mantener nombre corto
+        domain = domain[:20] if domain else "unknown"
+        # Limpiar caracteres especiales del dominio
+        domain = _DOMAIN_CLEAN_RE.sub('', domain)
+    except:
+        domain = "unknown"
+
+    # Crear hash corto de la URL para garantizar unicidad. No necesita ser
+    # criptográfico: BLAKE2 con un digest de 4 bytes evita calcular el MD5
+    # completo para descartarlo (y MD5 no está disponible en sistemas FIPS)
+    url_hash = hashlib.blake2b(url.encode(), digest_size=4).hexdigest()
+
+    # Fallback: nombre con dominio y hash
+    return f"factura_{domain}_{url_hash}"
+
+def _parse_html(content: str) -> Optional[Tuple[List[Tuple[str, str]], List[str]]]:
+    """
+    Extrae de un documento HTML los enlaces <a href> y las acciones de los formularios.
+
+    Usa selectolax cuando está disponible y BeautifulSoup (con lxml si está
+    instalado) en caso contrario.
+
+    Args:
+        content: Contenido HTML.
+
+    Returns:
+        Tuple: (lista de (href, texto del enlace), lista de acciones de <form>),
+            o None si no hay ningún parser HTML disponible.
+    """
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(content)
+        anchors = [(node.attributes.get('href') or '', node.text()) for node in tree.css('a[href]')]
+        actions = [node.attributes.get('action') or '' for node in tree.css('form')]
+        return anchors, actions
+
+    if BeautifulSoup is not None:
+        soup = BeautifulSoup(content, _BS4_PARSER)
+        anchors = [(a_tag['href'], a_tag.get_text()) for a_tag in soup.find_all('a', href=True)]
+        actions = [form.get('action', '') for form in soup.find_all('form')]
+        return anchors, actions
+
+    return None
+
+def close_connection_pool():
+    """Cierra todas las conexiones IMAP del pool. Se ejecuta al terminar el proceso."""
+    with _CONN_POOL_LOCK:
+        connections = list(_CONN_POOL.values())
+        _CONN_POOL.clear()
+        _CONN_LAST_USED.clear()
+    
+    for conn in connections:
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+atexit.register(close_connection_pool)
+
+def _create_http_session() -> requests.Session:
+    """
+    Crea la sesión HTTP compartida para descargar facturas.
+
+    La sesión mantiene las conexiones abiertas (keep-alive) entre descargas al mismo
+    servidor y reintenta los errores transitorios del servidor.
+
+    Returns:
+        requests.Session: Sesión configurada.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Sesión HTTP reutilizada por todas las descargas (y por los hilos del pool de correos)
+_HTTP_SESSION = _create_http_session()
+atexit.register(_HTTP_SESSION.close)
+
+# Límite de descargas simultáneas por servidor, compartido por todos los hilos
+_HOST_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+def _host_slots(url: str) -> threading.BoundedSemaphore:
+    """
+    Obtiene el semáforo de descargas del servidor de una URL, creándolo al primer uso.
+
+    Args:
+        url: URL a descargar.
+
+    Returns:
+        threading.BoundedSemaphore: Semáforo de LINK_DOWNLOADS_PER_HOST descargas.
+    """
+    host = urlparse(url).netloc.lower()
+    with _HOST_SLOTS_LOCK:
+        slots = _HOST_SLOTS.get(host)
+        if slots is None:
+            slots = _HOST_SLOTS[host] = threading.BoundedSemaphore(LINK_DOWNLOADS_PER_HOST)
+        return slots
+
 class EmailProcessor:
-    def __init__(self, config: EmailConfig = None):
+    def __init__(self, config: EmailConfig = None, invoice_cache: Optional[InvoiceCache] = None):
         """
         Inicializa el procesador de correos.
         
         Args:
             config: Configuración para la conexión al correo. Si no se proporciona,
                   se utilizan los valores de las variables de entorno.
+            invoice_cache: Cache de facturas extraídas por hash del PDF. Si no se
+                  proporciona, se crea una propia.
         """
         if config is None:
             self.config = EmailConfig(
@@ -41,6 +551,24 @@ class EmailProcessor:
         self.conn = None
         self.openai_processor = OpenAIProcessor()
         self.excel_exporter = ExcelExporter()
+        if invoice_cache is None:
+            invoice_cache = InvoiceCache(
+                version=self.openai_processor.prompt_version, ttl_days=settings.INVOICE_CACHE_TTL_DAYS
+            )
+        self.invoice_cache = invoice_cache
+        
+        # Cola de la Batch API de OpenAI (solo en modo daemon, ver enable_batch_mode)
+        self.batch_queue: Optional[BatchQueueProcessor] = None
+        # Correos cuyas facturas siguen en un lote sin resolver: email_id -> futures.
+        # Quedan sin marcar como leídos y se recogen en una ejecución posterior
+        self._deferred: Dict[str, list] = {}
+        
+        # Hashes de los PDFs ya enviados a extraer en la ejecución actual
+        self._run_digests = set()
+        self._run_digests_lock = threading.Lock()
+        
+        # Pool de descargas de enlaces de la ejecución actual (ver _process_emails)
+        self._download_pool: Optional[ThreadPoolExecutor] = None
         
         # Crear directorios necesarios
         os.makedirs(settings.TEMP_PDF_DIR, exist_ok=True)
@@ -49,26 +577,72 @@ class EmailProcessor:
         # Control para job programado
         self._job_running = False
         self._job_thread = None
+        self._stop_event = threading.Event()
+        self.next_run_ts: Optional[float] = None
+        self.current_interval_minutes = settings.JOB_MIN_INTERVAL_MINUTES
+        
+        # Evita ejecuciones solapadas (API y job programado comparten la sesión IMAP)
+        self._process_lock = threading.Lock()
+    
+    def enable_batch_mode(self):
+        """
+        Extrae las facturas con la Batch API de OpenAI en lugar de una petición por PDF.
+        
+        OpenAI resuelve los lotes en diferido (hasta 24 horas): los correos cuyas
+        facturas aún no llegaron quedan sin marcar como leídos y se recogen en una
+        ejecución posterior, por lo que solo se usa en modo daemon.
+        """
+        if self.batch_queue is None:
+            self.batch_queue = BatchQueueProcessor(self.openai_processor)
+    
+    def disable_batch_mode(self):
+        """Vuelve a una petición por PDF y detiene la cola de la Batch API."""
+        if self.batch_queue is not None:
+            self.batch_queue.close()
+            self.batch_queue = None
     
     def connect(self) -> bool:
         """
         Establece la conexión con el servidor de correo.
         
+        Reutiliza la conexión del pool para (host, usuario) si sigue activa;
+        si no, abre y autentica una nueva y la guarda en el pool.
+        
         Returns:
             bool: True si la conexión fue exitosa, False en caso contrario.
         """
+        key = (self.config.host, self.config.username)
+        
+        with _CONN_POOL_LOCK:
+            conn = _CONN_POOL.get(key)
+            last_used = _CONN_LAST_USED.get(key, 0.0)
+        
+        if conn is not None:
+            if time.monotonic() - last_used > IMAP_IDLE_TIMEOUT_SECONDS:
+                logger.info("Conexión IMAP sin uso durante demasiado tiempo, reconectando")
+                self._invalidate(conn)
+            elif self._ensure_alive(conn):
+                self.conn = conn
+                self._touch()
+                return True
+        
         try:
             # Crear conexión
             logger.info(f"host {self.config.host}")
             logger.info(f"port {self.config.port}")
             logger.info(f"username {self.config.username}")
-            self.conn = imaplib.IMAP4_SSL(self.config.host, self.config.port)
+            conn = imaplib.IMAP4_SSL(self.config.host, self.config.port)
             
             # Iniciar sesión
-            self.conn.login(self.config.username, self.config.password)
+            conn.login(self.config.username, self.config.password)
             
             # Seleccionar bandeja de entrada
-            self.conn.select("INBOX")
+            conn.select("INBOX")
+            
+            with _CONN_POOL_LOCK:
+                _CONN_POOL[key] = conn
+                _CONN_LAST_USED[key] = time.monotonic()
+            self.conn = conn
             
             logger.info(f"Conexión exitosa al correo {self.config.username}")
             return True
@@ -77,22 +651,119 @@ class EmailProcessor:
             logger.error(f"Error al conectar al correo: {str(e)}")
             return False
     
-    def disconnect(self):
-        """Cierra la conexión con el servidor de correo."""
-        if self.conn:
+    def _ensure_alive(self, conn: imaplib.IMAP4_SSL) -> bool:
+        """
+        Comprueba con NOOP que una conexión del pool sigue activa; si no, la descarta.
+        
+        Args:
+            conn: Conexión a comprobar.
+            
+        Returns:
+            bool: True si la conexión se puede seguir usando.
+        """
+        try:
+            status, _ = conn.noop()
+            if status == "OK":
+                return True
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.info(f"Conexión IMAP inactiva, reconectando: {str(e)}")
+        
+        self._invalidate(conn)
+        return False
+    
+    def _invalidate(self, conn: Optional[imaplib.IMAP4_SSL] = None):
+        """
+        Elimina una conexión del pool y la cierra.
+        
+        Args:
+            conn: Conexión a descartar; por defecto la conexión actual.
+        """
+        conn = conn or self.conn
+        key = (self.config.host, self.config.username)
+        
+        with _CONN_POOL_LOCK:
+            if _CONN_POOL.get(key) is conn:
+                del _CONN_POOL[key]
+                _CONN_LAST_USED.pop(key, None)
+        
+        if conn is self.conn:
+            self.conn = None
+        
+        if conn is not None:
             try:
-                self.conn.close()
-                self.conn.logout()
-                logger.info("Desconexión exitosa del servidor de correo")
-            except Exception as e:
-                logger.error(f"Error al desconectar del servidor de correo: {str(e)}")
+                conn.shutdown()
+            except Exception:
+                pass
+    
+    def _touch(self):
+        """Registra el uso de la conexión del pool para el control de inactividad."""
+        with _CONN_POOL_LOCK:
+            _CONN_LAST_USED[(self.config.host, self.config.username)] = time.monotonic()
+    
+    def close_connection(self):
+        """
+        Cierra la conexión del pool de este usuario (LOGOUT). La próxima operación
+        abrirá una nueva.
+        """
+        key = (self.config.host, self.config.username)
+        
+        with _CONN_POOL_LOCK:
+            conn = _CONN_POOL.pop(key, None)
+            _CONN_LAST_USED.pop(key, None)
+        
+        self.conn = None
+        if conn is not None:
+            try:
+                conn.logout()
+            except Exception:
+                pass
+    
+    def _imap(self, command: str, *args, literal: Optional[bytes] = None):
+        """
+        Ejecuta un comando IMAP sobre la conexión actual, reconectando y
+        reintentando una vez si la conexión se perdió.
+        
+        Args:
+            command: Nombre del método de imaplib (search, fetch, store...).
+            *args: Argumentos del comando.
+            literal: Literal a enviar como último argumento (opcional).
+            
+        Returns:
+            Tuple: (status, data) devueltos por imaplib.
+        """
+        for attempt in range(2):
+            if not self.conn and not self.connect():
+                raise imaplib.IMAP4.abort("No se pudo conectar al servidor de correo")
+            try:
+                if literal is not None:
+                    self.conn.literal = literal
+                response = getattr(self.conn, command)(*args)
+                self._touch()
+                return response
+            except _CONNECTION_ERRORS as e:
+                logger.warning(f"Conexión IMAP perdida durante {command.upper()}: {str(e)}")
+                self._invalidate()
+                if attempt:
+                    raise
+    
+    def disconnect(self):
+        """
+        Libera la conexión con el servidor de correo.
+        
+        La conexión permanece abierta en el pool para la próxima ejecución; se
+        cierra al terminar el proceso (ver close_connection_pool).
+        """
+        self.conn = None
     
     def search_emails(self) -> List[str]:
         """
         Busca correos según los criterios configurados.
         
+        Se usan UIDs en lugar de números de secuencia para que los IDs no cambien
+        si se eliminan correos del buzón durante el procesamiento.
+        
         Returns:
-            List[str]: Lista de IDs de correos encontrados.
+            List[str]: Lista de UIDs de correos encontrados.
         """
         if not self.conn:
             if not self.connect():
@@ -100,45 +771,48 @@ class EmailProcessor:
 
         try:
             base_criteria = self.config.search_criteria.split() if self.config.search_criteria else []
-
+            
+            # Consultas a ejecutar: (criterios, literal)
+            queries = []
             if self.config.search_terms:
-                terms = self.config.search_terms
-
-                if len(terms) == 1:
-                    # Caso simple: un solo término
-                    search_query = base_criteria + ["SUBJECT", f'"{terms[0]}"']
-                    logger.debug(f"IMAP search query: {search_query}")
-                    status, messages = self.conn.search(None, *search_query)
-                else:
-                    # Si hay múltiples términos, hacemos búsquedas separadas y combinamos los resultados
-                    email_ids_set = set()
-                    for term in terms:
-                        term_query = base_criteria + ["SUBJECT", f'"{term}"']
-                        logger.debug(f"IMAP search query (término '{term}'): {term_query}")
-                        status, messages = self.conn.search(None, *term_query)
-
-                        if status == "OK":
-                            ids = messages[0].split()
-                            email_ids_set.update(ids)
-                        else:
-                            logger.warning(f"No se pudo obtener resultados para término '{term}': {status}")
-
-                    email_ids = list(email_ids_set)
-                    logger.info(f"Se encontraron {len(email_ids)} correos combinando términos: {terms}")
-                    return [eid.decode() for eid in email_ids]
-
+                terms = reduce_search_terms(self.config.search_terms)
+                
+                # Términos ASCII: un único UID SEARCH combinándolos por OR:
+                # OR SUBJECT "t1" OR SUBJECT "t2" SUBJECT "t3"
+                ascii_terms = [term for term in terms if term.isascii()]
+                if ascii_terms:
+                    subject_query = ["SUBJECT", _quote_imap(ascii_terms[-1])]
+                    for term in reversed(ascii_terms[:-1]):
+                        subject_query = ["OR", "SUBJECT", _quote_imap(term)] + subject_query
+                    queries.append((base_criteria + subject_query, None))
+                
+                # imaplib solo envía ASCII en la línea de comando: cada término con acentos
+                # va como literal UTF-8, que tiene que ser el último argumento
+                for term in terms:
+                    if not term.isascii():
+                        queries.append((["CHARSET", "UTF-8"] + base_criteria + ["SUBJECT"], term.encode("utf-8")))
             else:
-                # Si no hay términos definidos, usar solo los criterios base
-                logger.debug(f"IMAP search query: {base_criteria}")
-                status, messages = self.conn.search(None, *base_criteria)
-
-            if status != "OK":
-                logger.error(f"Error en la búsqueda de correos: {status}")
+                queries.append((base_criteria, None))
+            
+            email_ids = set()
+            failed = 0
+            for query, literal in queries:
+                logger.debug(f"IMAP search query: {query} {literal or ''}")
+                status, messages = self._imap("uid", "SEARCH", None, *query, literal=literal)
+                
+                if status != "OK":
+                    logger.warning(f"No se pudo obtener resultados para la búsqueda {query}: {status}")
+                    failed += 1
+                    continue
+                
+                email_ids.update(messages[0].split())
+            
+            if failed == len(queries):
+                logger.error("Error en la búsqueda de correos")
                 return []
-
-            email_ids = messages[0].split()
+            
             logger.info(f"Se encontraron {len(email_ids)} correos que coinciden con los criterios")
-            return [eid.decode() for eid in email_ids]
+            return [eid.decode() for eid in sorted(email_ids, key=int)]
 
         except Exception as e:
             logger.error(f"Error al buscar correos: {str(e)}")
@@ -151,81 +825,288 @@ class EmailProcessor:
         Obtiene el contenido de un correo específico.
         
         Args:
-            email_id: ID del correo a obtener.
+            email_id: UID del correo a obtener.
             
         Returns:
             Tuple: (metadata, attachments)
                 - metadata: Diccionario con asunto, remitente, fecha
-                - attachments: Lista de adjuntos con nombre y contenido
+                - attachments: Lista de adjuntos con nombre y ruta del PDF guardado
+        """
+        try:
+            for _, metadata, attachments in self.fetch_emails_bulk([email_id]):
+                return metadata, attachments
+        except Exception as e:
+            logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
+        
+        return {}, []
+    
+    def fetch_emails_bulk(self, email_ids: List[str]) -> Iterator[Tuple[str, dict, list]]:
+        """
+        Descarga correos en lotes de FETCH_BATCH_SIZE con un único FETCH por lote.
+        
+        Por cada lote se piden solo Subject, From, Date y el BODYSTRUCTURE; después se
+        descargan únicamente las secciones necesarias de cada correo (adjuntos PDF
+        y partes de texto donde buscar enlaces), con un FETCH por grupo de correos
+        que necesitan las mismas secciones. Si el servidor rechaza un lote, se
+        reintenta dividiéndolo a la mitad.
+        
+        Args:
+            email_ids: UIDs de los correos a descargar.
+            
+        Yields:
+            Tuple: (email_id, metadata, attachments)
         """
         if not self.conn:
             if not self.connect():
-                return {}, []
+                return
+        
+        ids = iter(email_ids)
+        while True:
+            chunk = list(islice(ids, settings.FETCH_BATCH_SIZE))
+            if not chunk:
+                break
+            yield from self._fetch_chunk(chunk)
+    
+    def _fetch_chunk(self, chunk: List[str]) -> Iterator[Tuple[str, dict, list]]:
+        """
+        Descarga un lote de correos, dividiéndolo a la mitad si el servidor lo rechaza.
         
+        Args:
+            chunk: UIDs de los correos del lote.
+            
+        Yields:
+            Tuple: (email_id, metadata, attachments)
+        """
         try:
-            # Obtener el mensaje completo
-            status, data = self.conn.fetch(email_id, "(RFC822)")
+            status, data = self._imap("uid", "FETCH", _uid_set(chunk), f"({_HEADER_ITEM} BODYSTRUCTURE)")
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            status, data = "BAD", [str(e)]
+        
+        if status != "OK":
+            if len(chunk) > 1:
+                middle = len(chunk) // 2
+                logger.warning(f"FETCH de {len(chunk)} correos rechazado ({data}), reintentando en lotes de {middle}")
+                yield from self._fetch_chunk(chunk[:middle])
+                yield from self._fetch_chunk(chunk[middle:])
+            else:
+                logger.error(f"Error al obtener el correo {chunk[0]}: {status}")
+            return
+        
+        messages = _index_by_uid(parse_fetch_response(data))
+        del data
+        
+        # Elegir las secciones de cada correo. Los correos que necesitan las mismas
+        # secciones (p. ej. "1" y "2": cuerpo y PDF adjunto) se descargan juntos con un
+        # único FETCH, en grupos de hasta SECTION_FETCH_MAX_BYTES
+        groups: Dict[Tuple[str, ...], List[Tuple[str, dict, list]]] = {}
+        for email_id in list(messages):
+            fields = messages.pop(email_id)
             
-            if status != "OK":
-                logger.error(f"Error al obtener el correo {email_id}: {status}")
-                return {}, []
+            # Ignorar respuestas no solicitadas (p. ej. cambios de FLAGS)
+            if b"BODYSTRUCTURE" not in fields:
+                continue
             
-            # Analizar el mensaje
-            message = email.message_from_bytes(data[0][1])
+            try:
+                metadata, wanted = self._plan_email(email_id, fields)
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
+                continue
             
-            # Extraer metadata
-            subject = self._decode_email_header(message.get("Subject", ""))
-            sender = self._decode_email_header(message.get("From", ""))
-            date_str = message.get("Date", "")
+            sections = tuple(_section_item(part, filename) for part, filename in wanted)
+            groups.setdefault(sections, []).append((email_id, metadata, wanted))
+        
+        for sections, plans in groups.items():
+            batch = []
+            batch_size = 0
+            for plan in plans:
+                size = sum(part.size if filename else min(part.size, MAX_TEXT_PART_SIZE) for part, filename in plan[2])
+                if batch and batch_size + size > SECTION_FETCH_MAX_BYTES:
+                    yield from self._fetch_sections(sections, batch)
+                    batch, batch_size = [], 0
+                batch.append(plan)
+                batch_size += size
+            if batch:
+                yield from self._fetch_sections(sections, batch)
+    
+    def _fetch_sections(self, sections: Tuple[str, ...], plans: List[Tuple[str, dict, list]]) -> Iterator[Tuple[str, dict, list]]:
+        """
+        Descarga con un único FETCH las mismas secciones de varios correos y los procesa.
+        Si el servidor rechaza el FETCH, se pide cada correo por separado.
+        
+        Args:
+            sections: Elementos FETCH de las secciones a descargar de cada correo (ver _section_item).
+            plans: (email_id, metadata, partes elegidas) de cada correo (ver _plan_email).
             
-            # Convertir fecha a formato datetime
-            date = None
-            if date_str:
-                try:
-                    date = email.utils.parsedate_to_datetime(date_str)
-                except Exception as e:
-                    logger.warning(f"Error al parsear la fecha '{date_str}': {str(e)}")
+        Yields:
+            Tuple: (email_id, metadata, attachments)
+        """
+        bodies_by_uid = {}
+        if sections:
+            email_ids = [email_id for email_id, _, _ in plans]
+            items = " ".join(sections)
+            try:
+                status, data = self._imap("uid", "FETCH", _uid_set(email_ids), f"({items})")
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                status, data = "BAD", [str(e)]
+            
+            if status == "OK":
+                bodies_by_uid = _index_by_uid(parse_fetch_response(data))
+            elif len(plans) > 1:
+                logger.warning(f"FETCH de las partes de {len(plans)} correos rechazado ({status}), se piden por separado")
+                for plan in plans:
+                    yield from self._fetch_sections(sections, [plan])
+                return
+            else:
+                logger.error(f"Error al obtener las partes del correo {email_ids[0]}: {status}")
+            # Las secciones ya están en bodies_by_uid: no conservar también la respuesta cruda
+            del data
+        
+        # Cada correo se retira de bodies_by_uid al procesarlo, para liberar su contenido
+        for email_id, metadata, wanted in plans:
+            try:
+                attachments = self._load_email(email_id, metadata, wanted, bodies_by_uid.pop(email_id, {}))
+            except Exception as e:
+                logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
+                continue
             
-            metadata = {
-                "subject": subject,
-                "sender": sender,
-                "date": date,
-                "message_id": email_id
-            }
+            yield email_id, metadata, attachments
+    
+    def _plan_email(self, email_id: str, fields: Dict[bytes, Any]) -> Tuple[dict, list]:
+        """
+        Obtiene los metadatos de un correo y elige, según su BODYSTRUCTURE, las
+        secciones a descargar (adjuntos PDF y partes de texto donde buscar enlaces).
+        
+        Args:
+            email_id: ID del correo.
+            fields: Elementos de la respuesta FETCH (BODY[HEADER.FIELDS ...], BODYSTRUCTURE).
             
-            # Buscar adjuntos y enlaces
-            attachments = []
-            links = self._extract_links_from_email(message)
+        Returns:
+            Tuple: (metadata, lista de (parte, nombre del PDF o "" para texto))
+        """
+        # El servidor repite la lista de campos a su manera (comillas, mayúsculas): buscar por prefijo
+        raw_headers = next((value for key, value in fields.items() if key.startswith(b"BODY[HEADER")), None)
+        headers = _HEADER_PARSER.parsebytes(raw_headers if isinstance(raw_headers, bytes) else b"")
+        metadata = self._build_metadata(email_id, headers)
+        
+        # Localizar en una sola pasada las partes que interesan (adjuntos PDF y
+        # partes de texto donde buscar enlaces) sin descargar el resto del mensaje
+        wanted = []
+        has_pdf = False
+        has_html = False
+        for part in walk_bodystructure(fields[b"BODYSTRUCTURE"]):
+            filename = self._decode_email_header(part.filename) if part.filename else ""
+            if filename.lower().endswith(".pdf"):
+                wanted.append((part, filename))
+                has_pdf = True
+            elif part.content_type in ("text/plain", "text/html"):
+                wanted.append((part, ""))
+                has_html = has_html or part.content_type == "text/html"
+        
+        # El texto plano de un multipart/alternative repite el contenido del HTML, que
+        # además trae los enlaces <a>: no se descarga ni se analiza dos veces
+        if has_html:
+            wanted = [
+                (part, filename) for part, filename in wanted
+                if filename or not (part.alternative and part.content_type == "text/plain")
+            ]
+        
+        # Con un PDF adjunto, los enlaces del cuerpo suelen apuntar a la misma factura:
+        # no se descargan ni se analizan las partes de texto (tampoco si la búsqueda
+        # de enlaces está desactivada)
+        if has_pdf or not settings.EMAIL_EXTRACT_LINKS:
+            wanted = [(part, filename) for part, filename in wanted if filename]
+        
+        return metadata, wanted
+    
+    def _load_email(self, email_id: str, metadata: dict, wanted: list, bodies: Dict[bytes, Any]) -> list:
+        """
+        Guarda los adjuntos PDF de un correo y busca enlaces en sus partes de texto,
+        a partir de las secciones ya descargadas.
+        
+        Args:
+            email_id: ID del correo.
+            metadata: Metadatos del correo; se les agregan los enlaces encontrados.
+            wanted: Partes elegidas por _plan_email.
+            bodies: Secciones descargadas del correo (BODY[sección] o BODY[sección]<0> -> contenido).
             
-            # Procesar adjuntos
-            for part in message.walk():
-                if part.get_content_maintype() == "multipart":
+        Returns:
+            list: Adjuntos PDF guardados en disco.
+        """
+        # Cada sección se retira de bodies al procesarla, para no mantener a la vez
+        # la versión codificada y la decodificada de todo el correo. Los adjuntos se
+        # decodifican por bloques directamente a disco: solo se guarda la ruta
+        texts: List[Tuple[str, str]] = []
+        attachments = []
+        for part, filename in wanted:
+            # Las partes de texto grandes llegan truncadas por el FETCH parcial
+            truncated = not filename and part.size > MAX_TEXT_PART_SIZE
+            key = f"BODY[{part.section}]<0>" if truncated else f"BODY[{part.section}]"
+            content = bodies.pop(key.encode(), None)
+            
+            if filename:
+                if not isinstance(content, bytes):
+                    logger.warning(f"No se recibió el adjunto {filename} del correo {email_id}")
                     continue
-                
-                filename = part.get_filename()
-                if filename:
-                    # Decodificar nombre de archivo si es necesario
-                    filename = self._decode_email_header(filename)
-                    
-                    # Verificar si es un PDF
-                    if filename.lower().endswith(".pdf"):
-                        content = part.get_payload(decode=True)
-                        attachments.append({
-                            "filename": filename,
-                            "content": content,
-                            "content_type": part.get_content_type()
-                        })
-            
-            logger.info(f"Correo {email_id} procesado: {subject} - {len(attachments)} adjuntos, {len(links)} enlaces")
-            
-            # Incluir los enlaces encontrados en los metadatos
-            metadata["links"] = links
-            
-            return metadata, attachments
+                path = self.save_pdf_stream(iter_decode_part(content, part.encoding, DOWNLOAD_CHUNK_SIZE), filename)
+                if path:
+                    attachments.append({
+                        "filename": filename,
+                        "path": path,
+                        "content_type": part.content_type
+                    })
+                continue
+            
+            if not isinstance(content, bytes):
+                continue
+            try:
+                texts.append((part.content_type, decode_part(content, part.encoding, truncated).decode(part.charset or "utf-8", errors="replace")))
+            except Exception as e:
+                logger.warning(f"Error al decodificar la parte {part.section} del correo {email_id}: {str(e)}")
+        
+        links = self._extract_links_from_texts(texts)
+        
+        logger.info(f"Correo {email_id} procesado: {metadata['subject']} - {len(attachments)} adjuntos, {len(links)} enlaces")
+        
+        # Incluir los enlaces encontrados en los metadatos
+        metadata["links"] = links
+        
+        return attachments
+    
+    def _build_metadata(self, email_id: str, headers: Message) -> dict:
+        """
+        Construye los metadatos de un correo a partir de sus encabezados.
+        
+        Args:
+            email_id: ID del correo.
+            headers: Encabezados del correo.
             
-        except Exception as e:
-            logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
-            return {}, []
+        Returns:
+            dict: Asunto, remitente, fecha e ID del correo.
+        """
+        subject = self._decode_email_header(str(headers.get("Subject", "")))
+        sender = self._decode_email_header(str(headers.get("From", "")))
+        date_str = str(headers.get("Date", ""))
+        
+        # Convertir fecha a formato datetime
+        date = None
+        if date_str:
+            try:
+                date = email.utils.parsedate_to_datetime(date_str)
+            except Exception as e:
+                logger.warning(f"Error al parsear la fecha '{date_str}': {str(e)}")
+        
+        return {
+            "subject": subject,
+            "sender": sender,
+            "date": date,
+            "message_id": email_id
+        }
     
     def _decode_email_header(self, header: str) -> str:
         """
@@ -240,26 +1121,9 @@ class EmailProcessor:
         if not header:
             return ""
         
-        try:
-            decoded_parts = []
-            for part, encoding in decode_header(header):
-                if isinstance(part, bytes):
-                    if encoding:
-                        decoded_part = part.decode(encoding)
-                    else:
-                        decoded_part = part.decode('utf-8', errors='replace')
-                else:
-                    decoded_part = part
-                
-                decoded_parts.append(str(decoded_part))
-            
-            return "".join(decoded_parts)
-            
-        except Exception as e:
-            logger.warning(f"Error al decodificar encabezado '{header}': {str(e)}")
-            return header
+        return _decode_header_cached(header)
     
-    def _extract_links_from_email(self, message) -> List[str]:
+    def _extract_links_from_email(self, message: Message) -> List[str]:
         """
         Extrae enlaces de un mensaje de correo, buscando PDFs directos y facturas electrónicas.
         
@@ -269,17 +1133,36 @@ class EmailProcessor:
         Returns:
             List[str]: Lista de enlaces encontrados.
         """
-        links = []
+        return self._extract_links_from_texts(self._iter_text_parts(message))
+    
+    def _iter_text_parts(self, message: Message) -> Iterator[Tuple[str, str]]:
+        """
+        Decodifica, a medida que se piden, las partes de texto de un mensaje donde buscar enlaces.
         
-        # Patrones para buscar diferentes tipos de enlaces
-        pdf_url_pattern = r'https?://[^\s<>"]+\.pdf'
-        # Para mi yo del futuro, verificar las URLS de las compañías que envian sus facturas por este metodo.
-        #siga_pattern = r'https?://facte\.siga\.com\.py/[^\s<>"]*'
+        Args:
+            message: Mensaje de correo electrónico.
+            
+        Yields:
+            Tuple: (content_type, contenido decodificado) de cada parte text/plain o text/html.
+        """
+        # Partes de texto plano que son alternativa de un HTML: repiten su contenido,
+        # y el HTML además trae los enlaces <a>, así que no se decodifican
+        plain_alternatives = set()
         
         # Buscar en partes HTML y de texto
         for part in message.walk():
             content_type = part.get_content_type()
             
+            if content_type == "multipart/alternative" and any(
+                subpart.get_content_type() == "text/html" for subpart in part.walk()
+            ):
+                plain_alternatives.update(
+                    id(child) for child in part.get_payload() if child.get_content_type() == "text/plain"
+                )
+            
+            if id(part) in plain_alternatives:
+                continue
+            
             if content_type == "text/plain" or content_type == "text/html":
                 try:
                     # Obtener el contenido y decodificarlo
@@ -291,51 +1174,62 @@ class EmailProcessor:
                     else:
                         content = content.decode('utf-8', errors='replace')
                     
-                    # Buscar enlaces a PDFs directos
-                    pdf_links = re.findall(pdf_url_pattern, content)
-                    links.extend(pdf_links)
-                    
-                    # Buscar enlaces de facturas electrónicas SIGA
-                    # siga_links = re.findall(siga_pattern, content)
-                    # links.extend(siga_links)
-                    
-                    # Si es contenido HTML, buscar enlaces adicionales usando BeautifulSoup
-                    if content_type == "text/html":
-                        try:
-                            from bs4 import BeautifulSoup
-                            soup = BeautifulSoup(content, 'html.parser')
-                            
-                            # Palabras clave para identificar enlaces de facturas
-                            factura_keywords = [
-                                'visualizar documento', 'ver factura', 'descargar factura', 
-                                'factura electronica', 'visualizar',
-                                'descargar xml', 'ver documento',
-                                'pdf', 'imprimir', 'download', 'print','VISUALIZAR DOCUMENTO',
-                                'factura electrónica', 'generar pdf', 'exportar pdf', 'ver pdf'
-                            ]
-                            
-                            # Buscar enlaces <a> con texto relacionado a facturas
-                            for a_tag in soup.find_all('a', href=True):
-                                link_text = a_tag.get_text().lower().strip()
-                                href = a_tag['href']
-                                
-                                # Verificar si el texto del enlace contiene palabras clave de factura
-                                if any(keyword in link_text for keyword in factura_keywords):
-                                    # Asegurarse de que sea una URL completa
-                                    if href.startswith('http'):
-                                        links.append(href)
-                                        logger.info(f"Encontrado enlace de factura: {href} (texto: '{link_text}')")
-                                    
-                        except ImportError:
-                            logger.warning("BeautifulSoup no está disponible. Solo se buscarán patrones de texto.")
-                        except Exception as e:
-                            logger.warning(f"Error al procesar HTML con BeautifulSoup: {str(e)}")
-                    
                 except Exception as e:
                     logger.warning(f"Error al extraer enlaces: {str(e)}")
+                    continue
+                
+                yield content_type, content
+    
+    def _extract_links_from_texts(self, texts: Iterable[Tuple[str, str]]) -> List[str]:
+        """
+        Extrae enlaces de las partes de texto de un correo, buscando PDFs directos y facturas electrónicas.
+        
+        Args:
+            texts: (content_type, contenido decodificado) de las partes text/plain y text/html.
+                Con MAX_LINKS_PER_EMAIL enlaces ya no se piden más partes.
+            
+        Returns:
+            List[str]: Lista de enlaces encontrados.
+        """
+        # Diccionario como conjunto ordenado: sin duplicados y en orden de aparición
+        links: Dict[str, None] = {}
+        
+        for content_type, content in texts:
+            try:
+                # Buscar enlaces a PDFs directos
+                links.update(dict.fromkeys(_find_pdf_urls(content)))
+                
+                # Si es contenido HTML, buscar enlaces adicionales con el parser HTML
+                if content_type == "text/html":
+                    try:
+                        parsed = _parse_html(content)
+                        if parsed is None:
+                            logger.warning("No hay un parser HTML disponible. Solo se buscarán patrones de texto.")
+                            continue
+                        
+                        # Buscar enlaces <a> con texto relacionado a facturas
+                        for href, text in parsed[0]:
+                            link_text = text.lower().strip()
+                            
+                            # Verificar si el texto del enlace contiene palabras clave de factura
+                            if _FACTURA_KEYWORDS_RE.search(link_text):
+                                # Asegurarse de que sea una URL completa
+                                if href.startswith('http') and href not in links:
+                                    links[href] = None
+                                    logger.info(f"Encontrado enlace de factura: {href} (texto: '{link_text}')")
+                                
+                    except Exception as e:
+                        logger.warning(f"Error al procesar HTML: {str(e)}")
+                
+            except Exception as e:
+                logger.warning(f"Error al extraer enlaces: {str(e)}")
+            
+            # Cortar antes de pedir (y decodificar) la siguiente parte
+            if len(links) >= MAX_LINKS_PER_EMAIL:
+                logger.info(f"Se alcanzó el máximo de {MAX_LINKS_PER_EMAIL} enlaces por correo, no se analizan más partes")
+                break
         
-        # Eliminar duplicados
-        unique_links = list(set(links))
+        unique_links = list(links)[:MAX_LINKS_PER_EMAIL]
         if unique_links:
             logger.info(f"Enlaces encontrados: {unique_links}")
         
@@ -352,22 +1246,53 @@ class EmailProcessor:
         Returns:
             str: Ruta al archivo guardado o cadena vacía en caso de error.
         """
-        try:
-            # Crear el directorio si no existe
-            os.makedirs(settings.TEMP_PDF_DIR, exist_ok=True)
-            
-            # Generar un nombre único para evitar colisiones
-            safe_filename = re.sub(r'[^\w\-_\. ]', '_', filename)
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            unique_filename = f"{timestamp}_{safe_filename}"
-            
-            # Ruta completa del archivo
-            file_path = os.path.join(settings.TEMP_PDF_DIR, unique_filename)
-            
-            # Guardar el archivo
-            with open(file_path, "wb") as f:
-                f.write(content)
+        return self.save_pdf_stream([content], filename)
+    
+    def save_pdf_stream(self, chunks: Iterable[bytes], filename: str) -> str:
+        """
+        Guarda un PDF en un archivo escribiéndolo bloque a bloque, sin tener el
+        contenido completo en memoria.
+        
+        Args:
+            chunks: Bloques de bytes del PDF (p. ej. response.iter_content()).
+            filename: Nombre del archivo.
             
+        Returns:
+            str: Ruta al archivo guardado o cadena vacía en caso de error.
+        """
+        try:
+            # Generar un nombre único para evitar colisiones: el contador distingue
+            # los PDFs guardados en el mismo segundo
+            safe_filename = _SAFE_NAME_RE.sub('_', filename)
+            unique_filename = f"{int(time.time())}_{next(_FILE_COUNTER):06x}_{safe_filename}"
+            
+            # Crear el archivo en exclusiva: tras un reinicio el contador vuelve a empezar
+            # y podría repetir un nombre creado en el mismo segundo
+            base, extension = os.path.splitext(unique_filename)
+            counter = 0
+            while True:
+                file_path = os.path.join(settings.TEMP_PDF_DIR, unique_filename)
+                try:
+                    f = open(file_path, "xb")
+                    break
+                except FileExistsError:
+                    counter += 1
+                    unique_filename = f"{base}_{counter}{extension}"
+                except FileNotFoundError:
+                    # El directorio se crea en __init__; solo falta si se borró después
+                    os.makedirs(settings.TEMP_PDF_DIR, exist_ok=True)
+            
+            # Guardar el archivo. Si falla a mitad (p. ej. un adjunto base64 mal
+            # formado), se borra: no debe quedar un PDF cortado con un nombre válido
+            try:
+                with f:
+                    for chunk in chunks:
+                        if chunk:
+                            f.write(chunk)
+            except BaseException:
+                os.remove(file_path)
+                raise
+
             logger.info(f"PDF guardado: {file_path}")
             return file_path
             
@@ -386,9 +1311,6 @@ class EmailProcessor:
             str: Ruta al archivo descargado o cadena vacía en caso de error.
         """
         try:
-            import requests
-            from urllib.parse import urlparse
-            
             logger.info(f"Intentando descargar desde: {url}")
             
             # Headers para simular un navegador real
@@ -400,58 +1322,84 @@ class EmailProcessor:
                 'Connection': 'keep-alive',
             }
             
-            # Realizar la solicitud HTTP
-            response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
-            
-            if response.status_code != 200:
-                logger.error(f"Error al acceder a {url}: Código {response.status_code}")
-                return ""
-            
-            content_type = response.headers.get("Content-Type", "").lower()
-            logger.info(f"Tipo de contenido recibido: {content_type}")
-            
-            # Verificar si tenemos contenido
-            content_bytes = response.content
-            if not content_bytes:
-                logger.warning("Respuesta vacía, no hay contenido para procesar")
-                return ""
-            
-            # Verificar si el contenido es realmente un PDF analizando los primeros bytes
-            is_pdf_content = content_bytes.startswith(b'%PDF-')
-            is_xml_content = content_bytes.startswith(b'<?xml')
-            
-            logger.info(f"Análisis de contenido - PDF: {is_pdf_content}, XML: {is_xml_content}, Tamaño: {len(content_bytes)} bytes")
-            
-            # Si es un PDF directo (detectado por Content-Type o por contenido)
-            if (content_type.startswith("application/pdf") or 
-                is_pdf_content or 
-                (content_type.startswith("application/octet-stream") and is_pdf_content)):
-                logger.info("PDF directo detectado, guardando...")
-                filename = self._generate_filename_from_url(url, "pdf")
-                return self.save_pdf_from_binary(content_bytes, filename)
-            
-            # Si es XML (para facturas electrónicas)
-            elif (content_type.startswith("application/xml") or 
-                  content_type.startswith("text/xml") or
-                  is_xml_content or
-                  (content_type.startswith("application/octet-stream") and 
-                   url.lower().find('xml') > -1)):
-                logger.info("Archivo XML detectado, saltando (no es PDF)...")
-                return ""
-            
-            # Si es HTML (página de factura), buscar enlaces de descarga de PDF
-            elif content_type.startswith("text/html"):
-                logger.info("Página HTML detectada, buscando enlaces de descarga PDF...")
-                return self._extract_pdf_from_html_page(response.text, url, headers)
-            
-            else:
-                logger.warning(f"Tipo de contenido no soportado: {content_type}")
-                return ""
+            # Realizar la solicitud HTTP en modo streaming, sin pasar del límite de
+            # descargas simultáneas al servidor (incluye la segunda petición de las
+            # páginas HTML de factura)
+            with _host_slots(url), \
+                    _HTTP_SESSION.get(url, headers=headers, timeout=30, allow_redirects=True, stream=True) as response:
+                if response.status_code != 200:
+                    logger.error(f"Error al acceder a {url}: Código {response.status_code}")
+                    return ""
+                
+                content_type = response.headers.get("Content-Type", "").lower()
+                logger.info(f"Tipo de contenido recibido: {content_type}")
+                
+                # Leer solo el primer bloque para identificar el contenido
+                chunks = response.iter_content(DOWNLOAD_CHUNK_SIZE)
+                head = next(chunks, b"")
+                if not head:
+                    logger.warning("Respuesta vacía, no hay contenido para procesar")
+                    return ""
+                
+                # Verificar si el contenido es realmente un PDF analizando los primeros bytes
+                is_pdf_content = head.startswith(b'%PDF-')
+                is_xml_content = head.startswith(b'<?xml')
+                
+                logger.info(f"Análisis de contenido - PDF: {is_pdf_content}, XML: {is_xml_content}")
+                
+                # Si es un PDF directo (detectado por Content-Type o por contenido)
+                if (content_type.startswith("application/pdf") or 
+                    is_pdf_content or 
+                    (content_type.startswith("application/octet-stream") and is_pdf_content)):
+                    logger.info("PDF directo detectado, guardando...")
+                    filename = self._generate_filename_from_url(url, "pdf")
+                    return self.save_pdf_stream(chain([head], chunks), filename)
+                
+                # Si es XML (para facturas electrónicas)
+                elif (content_type.startswith("application/xml") or 
+                      content_type.startswith("text/xml") or
+                      is_xml_content or
+                      (content_type.startswith("application/octet-stream") and 
+                       url.lower().find('xml') > -1)):
+                    logger.info("Archivo XML detectado, saltando (no es PDF)...")
+                    return ""
+                
+                # Si es HTML (página de factura), buscar enlaces de descarga de PDF
+                elif content_type.startswith("text/html"):
+                    logger.info("Página HTML detectada, buscando enlaces de descarga PDF...")
+                    html_content = self._read_limited(head, chunks, MAX_HTML_PAGE_SIZE).decode(response.encoding or "utf-8", errors="replace")
+                    return self._extract_pdf_from_html_page(html_content, url, headers)
+                
+                else:
+                    logger.warning(f"Tipo de contenido no soportado: {content_type}")
+                    return ""
             
         except Exception as e:
             logger.error(f"Error al descargar PDF desde {url}: {str(e)}")
             return ""
  
+    def _read_limited(self, head: bytes, chunks: Iterator[bytes], limit: int) -> bytes:
+        """
+        Lee una respuesta en streaming hasta un tamaño máximo.
+        
+        Args:
+            head: Primer bloque ya leído.
+            chunks: Bloques restantes de la respuesta.
+            limit: Cantidad máxima de bytes a leer.
+            
+        Returns:
+            bytes: Contenido leído (truncado si supera el límite).
+        """
+        parts = [head]
+        size = len(head)
+        for chunk in chunks:
+            if size >= limit:
+                logger.warning(f"Página de más de {limit} bytes, se analiza solo el comienzo")
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        return b"".join(parts)[:limit]
+    
     def _generate_filename_from_url(self, url: str, extension: str) -> str:
         """
         Genera un nombre de archivo único basado en la URL.
@@ -463,87 +1411,7 @@ class EmailProcessor:
         Returns:
             str: Nombre de archivo único.
         """
-        timestamp = int(time.time())
-        
-        # Análisis dinámico de cualquier URL
-        import re
-        from urllib.parse import urlparse, parse_qs
-        
-        try:
-            # Parsear la URL para extraer parámetros
-            parsed_url = urlparse(url)
-            query_params = parse_qs(parsed_url.query)
-            
-            # Buscar parámetros comunes de facturas de forma dinámica
-            ruc = None
-            cdc = None
-            numero_factura = None
-            
-            # Buscar información útil en parámetros de query
-            for param_name, values in query_params.items():
-                param_lower = param_name.lower()
-                if values and values[0]:  # Asegurar que hay valor
-                    if 'ruc' in param_lower:
-                        ruc = values[0]
-                    elif any(keyword in param_lower for keyword in ['cdc', 'codigo', 'code', 'document', 'doc']):
-                        cdc = values[0][:12]  # Limitar longitud
-                    elif any(keyword in param_lower for keyword in ['factura', 'invoice', 'numero', 'number', 'num']):
-                        numero_factura = values[0][:10]  # Limitar longitud
-            
-            # También buscar en la URL completa con regex (backup)
-            if not ruc:
-                ruc_match = re.search(r'ruc[=:]([^&\s]+)', url, re.IGNORECASE)
-                if ruc_match:
-                    ruc = ruc_match.group(1)
-            
-            if not cdc:
-                cdc_match = re.search(r'(?:cdc|codigo|code|document)[=:]([^&\s]+)', url, re.IGNORECASE)
-                if cdc_match:
-                    cdc = cdc_match.group(1)[:12]
-            
-            # Construir nombre basado en información disponible
-            parts = []
-            
-            if ruc:
-                # Limpiar RUC de caracteres especiales
-                ruc_clean = re.sub(r'[^\w\-]', '', ruc)
-                parts.append(f"ruc_{ruc_clean}")
-            
-            if cdc:
-                # Limpiar CDC de caracteres especiales
-                cdc_clean = re.sub(r'[^\w\-]', '', cdc)
-                parts.append(f"cdc_{cdc_clean}")
-            
-            if numero_factura:
-                # Limpiar número de factura
-                num_clean = re.sub(r'[^\w\-]', '', numero_factura)
-                parts.append(f"num_{num_clean}")
-            
-            # Si tenemos información útil, usarla
-            if parts:
-                identifier = "_".join(parts)
-                return f"factura_{identifier}_{timestamp}.{extension}"
-            
-        except Exception as e:
-            logger.warning(f"Error al parsear URL para nombre de archivo: {str(e)}")
-        
-        # Fallback universal: usar dominio + hash de la URL
-        try:
-            parsed_url = urlparse(url)
-            domain = parsed_url.netloc.replace('.', '_').replace(':', '_')
-            # Usar solo los primeros caracteres del dominio para mantener nombre corto
-            domain = domain[:20] if domain else "unknown"
-            # Limpiar caracteres especiales del dominio
-            domain = re.sub(r'[^\w\-_]', '', domain)
-        except:
-            domain = "unknown"
-        
-        # Crear hash corto de la URL para garantizar unicidad
-        import hashlib
-        url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
-        
-        # Fallback: nombre con dominio y hash
-        return f"factura_{domain}_{url_hash}_{timestamp}.{extension}"
+        return f"{_filename_stem_from_url(url)}_{int(time.time())}.{extension}"
 
     def _extract_pdf_from_html_page(self, html_content: str, base_url: str, headers: dict) -> str:
         """
@@ -558,29 +1426,21 @@ class EmailProcessor:
             str: Ruta al PDF descargado o cadena vacía si no se encuentra.
         """
         try:
-            from bs4 import BeautifulSoup
-            from urllib.parse import urljoin
-            import requests
-            
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # Buscar enlaces de descarga de PDF en la página
-            pdf_keywords = [
-                'descargar', 'pdf', 'imprimir', 'download', 'print','VISUALIZAR DOCUMENTO','visualizar documento',
-                'ver factura', 'descargar factura', 'factura electronica','ver documento',
-                'factura electrónica', 'visualizar','generar pdf', 'exportar pdf', 'ver pdf'
-            ]
+            parsed = _parse_html(html_content)
+            if parsed is None:
+                logger.error("No hay un parser HTML disponible. No se puede procesar páginas HTML.")
+                return ""
+            anchors, form_actions = parsed
             
             logger.info("Buscando enlaces de descarga PDF en la página HTML...")
             
             # Buscar enlaces <a> con texto o atributos que indiquen descarga de PDF
-            for a_tag in soup.find_all('a', href=True):
-                href = a_tag['href']
-                link_text = a_tag.get_text().lower().strip()
+            for href, text in anchors:
+                link_text = text.lower().strip()
                 
                 # Verificar si el enlace contiene palabras clave de PDF
                 is_pdf_link = (
-                    any(keyword in link_text for keyword in pdf_keywords) or
+                    _PDF_KEYWORDS_RE.search(link_text) is not None or
                     href.lower().endswith('.pdf') or
                     'pdf' in href.lower()
                 )
@@ -591,20 +1451,19 @@ class EmailProcessor:
                     
                     # Intentar descargar este enlace como PDF
                     try:
-                        pdf_response = requests.get(full_url, headers=headers, timeout=30, allow_redirects=True)
-                        
-                        if pdf_response.status_code == 200:
-                            response_content_type = pdf_response.headers.get("Content-Type", "").lower()
-                            
-                            if response_content_type.startswith("application/pdf"):
-                                logger.info(f"PDF encontrado y descargado desde: {full_url}")
-                                filename = self._generate_filename_from_url(full_url, "pdf")
-                                return self.save_pdf_from_binary(pdf_response.content, filename)
+                        with _HTTP_SESSION.get(full_url, headers=headers, timeout=30, allow_redirects=True, stream=True) as pdf_response:
+                            if pdf_response.status_code == 200:
+                                response_content_type = pdf_response.headers.get("Content-Type", "").lower()
+                                
+                                if response_content_type.startswith("application/pdf"):
+                                    logger.info(f"PDF encontrado y descargado desde: {full_url}")
+                                    filename = self._generate_filename_from_url(full_url, "pdf")
+                                    return self.save_pdf_stream(pdf_response.iter_content(DOWNLOAD_CHUNK_SIZE), filename)
+                                else:
+                                    logger.debug(f"El enlace no devolvió un PDF: {response_content_type}")
                             else:
-                                logger.debug(f"El enlace no devolvió un PDF: {response_content_type}")
-                        else:
-                            logger.debug(f"Error al acceder al enlace: {pdf_response.status_code}")
-                            
+                                logger.debug(f"Error al acceder al enlace: {pdf_response.status_code}")
+                        
                     except Exception as e:
                         logger.debug(f"Error al intentar descargar desde {full_url}: {str(e)}")
                         continue
@@ -612,8 +1471,7 @@ class EmailProcessor:
             # Si no encontramos enlaces específicos, buscar formularios o scripts que puedan generar PDFs
             logger.info("No se encontraron enlaces directos, buscando formularios...")
             
-            for form in soup.find_all('form'):
-                action = form.get('action', '')
+            for action in form_actions:
                 if 'pdf' in action.lower() or 'print' in action.lower():
                     logger.info(f"Encontrado formulario que puede generar PDF: {action}")
                     # Aquí podrías implementar lógica para enviar el formulario si es necesario
@@ -621,9 +1479,6 @@ class EmailProcessor:
             logger.warning(f"No se encontró enlace de descarga PDF en la página: {base_url}")
             return ""
             
-        except ImportError:
-            logger.error("BeautifulSoup no está disponible. No se puede procesar páginas HTML.")
-            return ""
         except Exception as e:
             logger.error(f"Error al extraer PDF de página HTML: {str(e)}")
             return ""
@@ -633,7 +1488,7 @@ class EmailProcessor:
         Marca un correo como leído.
         
         Args:
-            email_id: ID del correo a marcar.
+            email_id: UID del correo a marcar.
             
         Returns:
             bool: True si se marcó correctamente, False en caso contrario.
@@ -643,22 +1498,128 @@ class EmailProcessor:
                 return False
         
         try:
-            self.conn.store(email_id, '+FLAGS', '\\Seen')
+            status, _ = self._imap("uid", "STORE", email_id, '+FLAGS', '\\Seen')
+            if status != "OK":
+                raise imaplib.IMAP4.error(status)
             logger.info(f"Correo {email_id} marcado como leído")
             return True
         except Exception as e:
             logger.error(f"Error al marcar el correo {email_id} como leído: {str(e)}")
             return False
     
+    def mark_as_read_bulk(self, email_ids: List[str]) -> bool:
+        """
+        Marca varios correos como leídos con un STORE por lote de IDs.
+        
+        Usa +FLAGS.SILENT para que el servidor no responda con los flags de cada correo.
+        Si el servidor rechaza un lote (p. ej. porque uno de los UIDs ya no existe),
+        los correos de ese lote se marcan de a uno.
+        
+        Args:
+            email_ids: UIDs de los correos a marcar.
+            
+        Returns:
+            bool: True si se marcaron todos correctamente, False en caso contrario.
+        """
+        if not email_ids:
+            return True
+        
+        if not self.conn:
+            if not self.connect():
+                return False
+        
+        success = True
+        ids = iter(email_ids)
+        for chunk in iter(lambda: list(islice(ids, STORE_BATCH_SIZE)), []):
+            try:
+                status, _ = self._imap("uid", "STORE", _uid_set(chunk), '+FLAGS.SILENT', '\\Seen')
+                if status != "OK":
+                    raise imaplib.IMAP4.error(status)
+                logger.info(f"{len(chunk)} correos marcados como leídos")
+            except Exception as e:
+                logger.warning(f"Error al marcar {len(chunk)} correos como leídos, se marcarán de a uno: {str(e)}")
+                # Marcar todos los del lote aunque alguno falle
+                results = [self.mark_as_read(email_id) for email_id in chunk]
+                success = success and all(results)
+        
+        return success
+    
+    def is_processing(self) -> bool:
+        """
+        Indica si hay un procesamiento de correos en curso.
+        
+        Returns:
+            bool: True si process_emails se está ejecutando.
+        """
+        return self._process_lock.locked()
+    
     def process_emails(self) -> ProcessResult:
         """
         Procesa correos electrónicos para extraer facturas.
         
+        Solo se permite una ejecución a la vez; si ya hay una en curso se
+        devuelve inmediatamente un resultado no exitoso.
+        
+        Returns:
+            ProcessResult: Resultado del procesamiento.
+        """
+        if not self._process_lock.acquire(blocking=False):
+            logger.warning("Ya hay un procesamiento de correos en curso")
+            return ProcessResult.model_construct(
+                success=False,
+                message="Procesamiento en curso"
+            )
+        
+        try:
+            self._sweep_temp_dir()
+            return self._process_emails()
+        finally:
+            self._process_lock.release()
+    
+    def _sweep_temp_dir(self):
+        """
+        Elimina de TEMP_PDF_DIR los archivos más antiguos que TEMP_PDF_MAX_AGE_HOURS,
+        recorriendo el directorio una sola vez con os.scandir.
+        
+        Es opcional (por defecto 0, no se elimina nada): la columna PDF del Excel
+        apunta a estos archivos. Los PDFs que esperan un lote de la Batch API se
+        conservan aunque superen la antigüedad.
+        """
+        max_age_hours = settings.TEMP_PDF_MAX_AGE_HOURS
+        if max_age_hours <= 0:
+            return
+        
+        in_use = self.batch_queue.pending_paths() if self.batch_queue is not None else set()
+        cutoff = time.time() - max_age_hours * 3600
+        removed = 0
+        try:
+            with os.scandir(settings.TEMP_PDF_DIR) as entries:
+                for entry in entries:
+                    try:
+                        if (
+                            entry.is_file(follow_symlinks=False)
+                            and entry.stat(follow_symlinks=False).st_mtime < cutoff
+                            and os.path.abspath(entry.path) not in in_use
+                        ):
+                            os.unlink(entry.path)
+                            removed += 1
+                    except OSError as e:
+                        logger.warning(f"No se pudo eliminar el archivo temporal {entry.path}: {str(e)}")
+        except FileNotFoundError:
+            return
+        
+        if removed:
+            logger.info(f"Eliminados {removed} archivos temporales con más de {max_age_hours} horas")
+    
+    def _process_emails(self) -> ProcessResult:
+        """
+        Implementación de process_emails; se ejecuta con el lock de procesamiento adquirido.
+        
         Returns:
             ProcessResult: Resultado del procesamiento.
         """
         # Resultado por defecto
-        result = ProcessResult(
+        result = ProcessResult.model_construct(
             success=True,
             message="Procesamiento completado",
             invoice_count=0,
@@ -668,7 +1629,7 @@ class EmailProcessor:
         try:
             # Conectar al servidor de correo
             if not self.connect():
-                return ProcessResult(
+                return ProcessResult.model_construct(
                     success=False,
                     message="Error al conectar al servidor de correo"
                 )
@@ -676,9 +1637,15 @@ class EmailProcessor:
             # Buscar correos con facturas
             email_ids = self.search_emails()
             
-            if not email_ids:
+            # Los correos que esperan un lote de la Batch API de una ejecución anterior
+            # siguen sin leer: no se vuelven a descargar ni a encolar
+            deferred = self._deferred
+            self._deferred = {}
+            email_ids = [email_id for email_id in email_ids if email_id not in deferred]
+            
+            if not email_ids and not deferred:
                 self.disconnect()
-                return ProcessResult(
+                return ProcessResult.model_construct(
                     success=True,
                     message="No se encontraron correos con facturas",
                     invoice_count=0
@@ -686,78 +1653,54 @@ class EmailProcessor:
             
             logger.info(f"Procesando {len(email_ids)} correos")
             
-            # Procesar cada correo
-            for email_id in email_ids:
+            with self._run_digests_lock:
+                self._run_digests.clear()
+            
+            # Descargar los correos en lotes (hilo actual, dueño de la conexión IMAP) y
+            # procesarlos en el pool en dos etapas: primero se reúnen los PDFs de cada
+            # correo (descarga de enlaces) y después se extrae cada PDF por separado, de
+            # modo que los correos con varias facturas también se reparten entre hilos.
+            # Las descargas de enlaces de todos los correos comparten un único pool, que
+            # acota las conexiones HTTP simultáneas y no crea hilos nuevos por correo
+            with ThreadPoolExecutor(max_workers=settings.EMAIL_WORKERS, thread_name_prefix="invoicesync-email") as executor, \
+                    ThreadPoolExecutor(max_workers=LINK_DOWNLOAD_WORKERS, thread_name_prefix="invoicesync-download") as downloader:
+                self._download_pool = downloader
                 try:
-                    # Obtener contenido del correo
-                    metadata, attachments = self.get_email_content(email_id)
-                    
-                    if not metadata:
-                        logger.warning(f"No se pudo obtener metadatos del correo {email_id}")
-                        continue
-                    
-                    # Procesar PDFs adjuntos y enlaces
-                    processed_pdfs = []
-                    
-                    # 1. Procesar adjuntos directos
-                    for attachment in attachments:
-                        if attachment.get("filename", "").lower().endswith(".pdf"):
-                            # Guardar el PDF
-                            pdf_path = self.save_pdf_from_binary(
-                                attachment["content"],
-                                attachment["filename"]
-                            )
-                            
-                            if pdf_path:
-                                processed_pdfs.append({
-                                    "path": pdf_path,
-                                    "source": "attachment"
-                                })
-                    
-                    # 2. Procesar enlaces a PDFs y facturas electrónicas
-                    if "links" in metadata and metadata["links"]:
-                        logger.info(f"Procesando {len(metadata['links'])} enlaces encontrados")
-                        
-                        for link in metadata["links"]:
-                            logger.info(f"Intentando procesar enlace: {link}")
-                            
-                            # Intentar descargar desde cualquier enlace (no solo los que terminan en .pdf)
-                            pdf_path = self.download_pdf_from_url(link)
-                            
-                            if pdf_path:
-                                logger.info(f"PDF descargado exitosamente desde: {link}")
-                                processed_pdfs.append({
-                                    "path": pdf_path,
-                                    "source": "link",
-                                    "original_url": link
-                                })
-                            else:
-                                logger.warning(f"No se pudo descargar PDF desde: {link}")
+                    # Primera etapa en curso: future -> (email_id, metadata)
+                    collecting = {}
+                    # Extracciones de cada correo, en orden de llegada: email_id -> futures
+                    extractions = {}
+                    # Tareas de ambas etapas aún sin terminar
+                    in_flight = set()
                     
-                    # Procesar cada PDF encontrado con OpenAI
-                    for pdf_info in processed_pdfs:
-                        pdf_path = pdf_info["path"]
+                    for email_id, metadata, attachments in self.fetch_emails_bulk(email_ids):
+                        if not metadata:
+                            logger.warning(f"No se pudo obtener metadatos del correo {email_id}")
+                            continue
                         
-                        # Preparar metadatos para el procesador de OpenAI
-                        email_meta_for_ai = {
-                            "sender": metadata.get("sender", ""),
-                            "subject": metadata.get("subject", ""),
-                            "date": metadata.get("date")
-                        }
+                        future = executor.submit(self._collect_pdfs, metadata, attachments)
+                        collecting[future] = (email_id, metadata)
+                        in_flight.add(future)
                         
-                        # Extraer datos con OpenAI
-                        invoice_data = self.openai_processor.extract_invoice_data(pdf_path, email_meta_for_ai)
-                        
-                        # Agregar a la lista de facturas procesadas
-                        result.invoices.append(invoice_data)
-                        result.invoice_count += 1
-                    
-                    # Marcar correo como leído
-                    self.mark_as_read(email_id)
+                        # Limitar las tareas en vuelo para acotar la memoria de metadatos y resultados pendientes
+                        while len(in_flight) >= settings.EMAIL_WORKERS * 4:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            in_flight |= self._submit_extractions(executor, done, collecting, extractions)
                     
-                except Exception as e:
-                    logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
-                    continue
+                    while in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        in_flight |= self._submit_extractions(executor, done, collecting, extractions)
+                finally:
+                    self._download_pool = None
+            
+            # En modo lote, enviar ya las peticiones restantes en lugar de esperar al temporizador
+            if self.batch_queue is not None:
+                self.batch_queue.flush()
+            
+            # Correos procesados, a marcar como leídos (primero los de ejecuciones anteriores)
+            processed_ids = []
+            self._collect_processed({**deferred, **extractions}, result, processed_ids)
+            self.mark_as_read_bulk(processed_ids)
             
             # Exportar a Excel si hay facturas
             if result.invoices:
@@ -775,11 +1718,289 @@ class EmailProcessor:
         except Exception as e:
             logger.error(f"Error general en el procesamiento: {str(e)}")
             self.disconnect()
-            return ProcessResult(
+            return ProcessResult.model_construct(
                 success=False,
                 message=f"Error en el procesamiento: {str(e)}"
             )
     
+    def _collect_pdfs(self, metadata: dict, attachments: list) -> List[dict]:
+        """
+        Reúne los PDFs de un correo: adjuntos y documentos descargados desde sus enlaces.
+        
+        Se omiten los PDFs cuyo contenido ya apareció en esta ejecución.
+        
+        Args:
+            metadata: Metadatos del correo (incluye los enlaces encontrados).
+            attachments: Adjuntos PDF del correo, ya guardados en disco.
+            
+        Returns:
+            List[dict]: PDFs a procesar, con su ruta, origen y hash.
+        """
+        # Procesar PDFs adjuntos y enlaces
+        processed_pdfs = []
+        
+        # 1. Procesar adjuntos directos (ya guardados en disco al descargar el correo)
+        for attachment in attachments:
+            if attachment.get("filename", "").lower().endswith(".pdf"):
+                processed_pdfs.append({
+                    "path": attachment["path"],
+                    "source": "attachment"
+                })
+        
+        # 2. Procesar enlaces a PDFs y facturas electrónicas
+        if "links" in metadata and metadata["links"]:
+            logger.info(f"Procesando {len(metadata['links'])} enlaces encontrados")
+            
+            # Un mismo documento suele enlazarse varias veces con distintos parámetros de seguimiento
+            seen_urls = set()
+            links = []
+            
+            for link in metadata["links"]:
+                normalized = _normalize_url(link)
+                if normalized in seen_urls:
+                    logger.info(f"Enlace repetido, se omite: {link}")
+                    continue
+                # El XML de SIGA se descartaría al recibirlo: no se descarga
+                if _classify_link(link) is LinkKind.SIGA_XML:
+                    logger.info(f"Enlace al XML de SIGA, se omite (no es PDF): {link}")
+                    continue
+                seen_urls.add(normalized)
+                links.append(link)
+            
+            # Intentar descargar desde cualquier enlace (no solo los que terminan en .pdf);
+            # con varios enlaces, las descargas se solapan en el pool de la ejecución
+            downloader = self._download_pool
+            if len(links) > 1 and downloader is not None:
+                pdf_paths = list(downloader.map(self.download_pdf_from_url, links))
+            elif len(links) > 1:
+                with ThreadPoolExecutor(max_workers=min(len(links), LINK_DOWNLOAD_WORKERS), thread_name_prefix="invoicesync-download") as downloader:
+                    pdf_paths = list(downloader.map(self.download_pdf_from_url, links))
+            else:
+                pdf_paths = [self.download_pdf_from_url(link) for link in links]
+            
+            for link, pdf_path in zip(links, pdf_paths):
+                if pdf_path:
+                    logger.info(f"PDF descargado exitosamente desde: {link}")
+                    processed_pdfs.append({
+                        "path": pdf_path,
+                        "source": "link",
+                        "original_url": link
+                    })
+                else:
+                    logger.warning(f"No se pudo descargar PDF desde: {link}")
+        
+        unique_pdfs = []
+        for pdf_info in processed_pdfs:
+            pdf_path = pdf_info["path"]
+            
+            # Un mismo PDF puede llegar como adjunto y como enlace, o en varios correos
+            try:
+                pdf_info["digest"] = file_sha256(pdf_path)
+            except OSError as e:
+                logger.warning(f"No se pudo calcular el hash de {pdf_path}: {str(e)}")
+                pdf_info["digest"] = None
+            
+            if pdf_info["digest"] and not self._claim_digest(pdf_info["digest"]):
+                logger.info(f"PDF duplicado en esta ejecución, se omite: {pdf_path}")
+                continue
+            
+            unique_pdfs.append(pdf_info)
+        
+        return unique_pdfs
+    
+    def _extract_pdf(self, pdf_info: dict, metadata: dict) -> InvoiceData:
+        """
+        Extrae la factura de uno de los PDFs de un correo.
+        
+        Se ejecuta en el pool de trabajo: no usa la conexión IMAP.
+        
+        Args:
+            pdf_info: PDF a procesar (ver _collect_pdfs).
+            metadata: Metadatos del correo.
+            
+        Returns:
+            InvoiceData: Datos extraídos de la factura.
+        """
+        pdf_path = pdf_info["path"]
+        
+        # Extraer datos con OpenAI (o reutilizarlos si el PDF ya fue procesado)
+        invoice_data = self._extract_invoice(pdf_path, self._metadata_for_ai(metadata), pdf_info.get("digest"))
+        release_page_cache(pdf_path)
+        
+        return invoice_data
+    
+    def _metadata_for_ai(self, metadata: dict) -> Dict[str, Any]:
+        """
+        Metadatos del correo que se pasan al procesador de OpenAI.
+        
+        Args:
+            metadata: Metadatos del correo.
+            
+        Returns:
+            Dict: Remitente, asunto y fecha del correo.
+        """
+        return {
+            "sender": metadata.get("sender", ""),
+            "subject": metadata.get("subject", ""),
+            "date": metadata.get("date")
+        }
+    
+    def _queue_pdf(self, pdf_info: dict, metadata: dict) -> Future:
+        """
+        Encola la extracción de uno de los PDFs de un correo en la Batch API, o
+        devuelve la factura ya resuelta si el PDF está en la cache.
+        
+        Args:
+            pdf_info: PDF a procesar (ver _collect_pdfs).
+            metadata: Metadatos del correo.
+            
+        Returns:
+            Future: Se resuelve con los datos extraídos de la factura.
+        """
+        pdf_path = pdf_info["path"]
+        email_meta_for_ai = self._metadata_for_ai(metadata)
+        digest = pdf_info.get("digest")
+        
+        if digest:
+            cached = self.invoice_cache.get(digest)
+            if cached is not None:
+                logger.info(f"PDF ya procesado anteriormente, reutilizando datos: {pdf_path}")
+                future = Future()
+                future.set_result(cached.model_copy(update={"pdf_path": pdf_path, "email_origen": email_meta_for_ai["sender"]}))
+                return future
+        
+        future = self.batch_queue.submit(pdf_path, email_meta_for_ai, digest)
+        
+        def _cache_result(done: Future):
+            # Solo cachear extracciones que obtuvieron datos de la factura
+            invoice_data = None if done.exception() else done.result()
+            if digest and invoice_data is not None and (invoice_data.numero_factura or invoice_data.cdc):
+                self.invoice_cache.set(digest, invoice_data)
+        
+        future.add_done_callback(_cache_result)
+        return future
+    
+    def _claim_digest(self, digest: str) -> bool:
+        """
+        Registra el hash de un PDF para la ejecución actual.
+        
+        Args:
+            digest: Hash SHA-256 (hexadecimal) del PDF.
+            
+        Returns:
+            bool: True si es la primera vez que aparece en esta ejecución.
+        """
+        with self._run_digests_lock:
+            if digest in self._run_digests:
+                return False
+            self._run_digests.add(digest)
+            return True
+    
+    def _extract_invoice(self, pdf_path: str, metadata: Dict[str, Any], digest: Optional[str] = None) -> InvoiceData:
+        """
+        Extrae los datos de una factura, consultando primero la cache por el hash
+        SHA-256 del PDF para no repetir la llamada a OpenAI con el mismo documento.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            metadata: Metadatos del correo para el procesador de OpenAI.
+            digest: Hash SHA-256 (hexadecimal) del PDF, si ya se calculó.
+            
+        Returns:
+            InvoiceData: Datos extraídos de la factura.
+        """
+        if digest is None:
+            try:
+                digest = file_sha256(pdf_path)
+            except OSError as e:
+                logger.warning(f"No se pudo calcular el hash de {pdf_path}: {str(e)}")
+        
+        if digest:
+            cached = self.invoice_cache.get(digest)
+            if cached is not None:
+                logger.info(f"PDF ya procesado anteriormente, reutilizando datos: {pdf_path}")
+                return cached.model_copy(update={"pdf_path": pdf_path, "email_origen": metadata.get("sender", "")})
+        
+        invoice_data = self.openai_processor.extract_invoice_data(pdf_path, metadata)
+        
+        # Solo cachear extracciones que obtuvieron datos de la factura
+        if digest and (invoice_data.numero_factura or invoice_data.cdc):
+            self.invoice_cache.set(digest, invoice_data)
+        
+        return invoice_data
+    
+    def _submit_extractions(self, executor: ThreadPoolExecutor, done: Iterable[Any],
+                            collecting: Dict[Any, Tuple[str, dict]], extractions: Dict[str, list]) -> set:
+        """
+        Lanza la extracción de cada PDF de los correos cuya primera etapa terminó.
+        
+        Se ejecuta en el hilo dueño de la conexión IMAP.
+        
+        Args:
+            executor: Pool de trabajo.
+            done: Tareas terminadas (de cualquiera de las dos etapas).
+            collecting: Tareas de _collect_pdfs en curso, con el ID y metadatos de su correo.
+            extractions: Extracciones lanzadas por correo; se agregan las nuevas.
+            
+        Returns:
+            set: Nuevas tareas de extracción.
+        """
+        submitted = set()
+        for future in done:
+            if future not in collecting:
+                continue
+            
+            email_id, metadata = collecting.pop(future)
+            try:
+                pdfs = future.result()
+            except Exception as e:
+                logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
+                continue
+            
+            if self.batch_queue is not None:
+                # Los lotes tardan horas: no cuentan como tareas en vuelo, y
+                # _collect_processed recoge sus resultados cuando estén resueltos
+                extractions[email_id] = [self._queue_pdf(pdf_info, metadata) for pdf_info in pdfs]
+                continue
+            
+            futures = [executor.submit(self._extract_pdf, pdf_info, metadata) for pdf_info in pdfs]
+            extractions[email_id] = futures
+            submitted.update(futures)
+        
+        return submitted
+    
+    def _collect_processed(self, extractions: Dict[str, list], result: ProcessResult, processed_ids: List[str]):
+        """
+        Agrega al resultado las facturas de los correos procesados y registra sus IDs
+        para marcarlos como leídos.
+        
+        Un correo cuenta como procesado si todas sus extracciones terminaron sin error.
+        Los correos con extracciones aún en un lote de la Batch API no se esperan:
+        pasan a _deferred y se recogen en una ejecución posterior.
+        
+        Args:
+            extractions: Extracciones terminadas de cada correo.
+            result: Resultado del procesamiento a completar.
+            processed_ids: Lista donde se agregan los IDs de los correos procesados.
+        """
+        for email_id, futures in extractions.items():
+            if not all(future.done() for future in futures):
+                self._deferred[email_id] = futures
+                continue
+            
+            try:
+                invoices = [future.result() for future in futures]
+            except Exception as e:
+                logger.error(f"Error al procesar el correo {email_id}: {str(e)}")
+                continue
+            
+            result.invoices.extend(invoices)
+            result.invoice_count += len(invoices)
+            processed_ids.append(email_id)
+        
+        if self._deferred:
+            logger.info(f"{len(self._deferred)} correos esperan lotes de la Batch API; se recogerán en la próxima ejecución")
+    
     def start_scheduled_job(self):
         """
         Inicia el trabajo programado para ejecutarse periódicamente.
@@ -788,11 +2009,12 @@ class EmailProcessor:
             logger.warning("El job ya está en ejecución")
             return
         
-        interval_minutes = settings.JOB_INTERVAL_MINUTES
-        logger.info(f"Iniciando job programado para ejecutarse cada {interval_minutes} minutos")
+        self.current_interval_minutes = settings.JOB_MIN_INTERVAL_MINUTES
+        logger.info(f"Iniciando job programado para ejecutarse cada {self.current_interval_minutes} minutos")
         
-        # Programar la tarea
-        schedule.every(interval_minutes).minutes.do(self._run_job)
+        # Programar la primera ejecución
+        self.next_run_ts = time.time() + self.current_interval_minutes * 60
+        self._stop_event.clear()
         
         # Iniciar el thread para el scheduler
         self._job_running = True
@@ -810,21 +2032,35 @@ class EmailProcessor:
         
         logger.info("Deteniendo job programado")
         self._job_running = False
+        self._stop_event.set()
         
         # Esperar a que el thread termine
         if self._job_thread and self._job_thread.is_alive():
             self._job_thread.join(timeout=2)
         
-        # Limpiar todas las tareas programadas
-        schedule.clear()
+        self.next_run_ts = None
+        
+        # Sin job programado no tiene sentido mantener la sesión IMAP abierta
+        if not self._process_lock.locked():
+            self.close_connection()
     
     def _schedule_loop(self):
         """
         Bucle para ejecutar las tareas programadas.
+        
+        El hilo queda bloqueado hasta la próxima ejecución (o hasta que se detenga el
+        job), sin despertarse periódicamente mientras no hay trabajo. La espera se
+        mide con el reloj monotónico, de modo que un ajuste de la hora del sistema
+        no adelanta ni retrasa la ejecución; next_run_ts solo se usa para informar.
         """
-        while self._job_running:
-            schedule.run_pending()
-            time.sleep(1)
+        deadline = time.monotonic() + max(0.0, self.next_run_ts - time.time())
+        while not self._stop_event.wait(max(0.0, deadline - time.monotonic())):
+            self._run_job()
+            # La próxima ejecución se cuenta desde el fin de esta, con el intervalo ya ajustado
+            interval_seconds = self.current_interval_minutes * 60
+            deadline = time.monotonic() + interval_seconds
+            if not self._stop_event.is_set():
+                self.next_run_ts = time.time() + interval_seconds
     
     def _run_job(self):
         """
@@ -838,4 +2074,29 @@ class EmailProcessor:
         else:
             logger.error(result.message)
         
+        self._adjust_interval(result)
+        
         return result
+    
+    def _adjust_interval(self, result: ProcessResult):
+        """
+        Ajusta el intervalo del job según el resultado de la última ejecución.
+        
+        Si no se encontraron facturas el intervalo se multiplica por
+        JOB_BACKOFF_MULTIPLIER hasta JOB_MAX_INTERVAL_MINUTES; si se procesaron
+        facturas (o hubo un error) vuelve a JOB_MIN_INTERVAL_MINUTES.
+        
+        Args:
+            result: Resultado de la última ejecución.
+        """
+        min_interval = settings.JOB_MIN_INTERVAL_MINUTES
+        max_interval = max(settings.JOB_MAX_INTERVAL_MINUTES, min_interval)
+        
+        if result.success and result.invoice_count == 0:
+            new_interval = min(int(self.current_interval_minutes * settings.JOB_BACKOFF_MULTIPLIER), max_interval)
+        else:
+            new_interval = min_interval
+        
+        if new_interval != self.current_interval_minutes:
+            logger.info(f"Intervalo del job ajustado de {self.current_interval_minutes} a {new_interval} minutos")
+            self.current_interval_minutes = new_interval
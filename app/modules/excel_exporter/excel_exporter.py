@@ -1,17 +1,115 @@
 import os
 import logging
+import sqlite3
+import threading
+from contextlib import closing
 import pandas as pd
-from typing import List, Dict, Any, Optional
-from datetime import datetime
-import openpyxl
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from typing import Any, List, Tuple
 
 from app.models.models import InvoiceData
+from app.modules.excel_exporter.xlsx_writer import write_xlsx, DATA_STYLE, NUMERIC_STYLE
 from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+# Serializa las escrituras al archivo Excel: la exportación puede ejecutarse
+# desde varios hilos (API y job programado) sobre el mismo archivo.
+_EXPORT_LOCK = threading.Lock()
+
+# Columnas que identifican una fila de cada hoja: al repetirse se conserva la última
+FACTURAS_KEY = ["RUC Emisor", "Nro. Factura", "Monto Total", "CDC"]
+PRODUCTOS_KEY = ["Factura", "RUC Emisor", "Artículo"]
+
+# Campos de InvoiceData que se exportan; model_dump no serializa el resto
+# (factura_data, cliente, datos anidados que no tienen columna)
+EXPORT_FIELDS = {
+    "fecha": True, "ruc_emisor": True, "nombre_emisor": True, "numero_factura": True,
+    "condicion_venta": True, "moneda": True, "monto_total": True, "iva": True,
+    "subtotal_exentas": True, "subtotal_5": True, "subtotal_10": True,
+    "ruc_cliente": True, "nombre_cliente": True, "email_cliente": True,
+    "timbrado": True, "cdc": True, "actividad_economica": True,
+    "pdf_path": True, "email_origen": True, "procesado_en": True,
+    "empresa": {"nombre", "direccion", "telefono"},
+    "timbrado_data": {"fecha_inicio_vigencia", "valido_hasta"},
+    "totales": {"subtotal", "total_iva"},
+    "productos": {"__all__": {"articulo", "cantidad", "precio_unitario", "total"}}
+}
+
+# Columnas de texto con pocos valores distintos (se repiten entre facturas): al leer
+# el historial se guardan como category, un diccionario de valores más códigos enteros
+CATEGORY_COLUMNS = ["RUC Emisor", "Nombre Emisor", "Moneda", "Condición Venta", "Actividad Económica", "Timbrado", "Email Cliente", "Origen (correo)"]
+
+# Filas que se examinan para calcular el ancho de cada columna
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 50
+
+# Búfer de escritura del archivo .xlsx (1 MiB)
+SAVE_BUFFER_SIZE = 1024 * 1024
+
+# Memoria mapeada para leer el historial sin copiarlo a buffers de SQLite (256 MiB)
+HISTORY_MMAP_SIZE = 256 * 1024 * 1024
+
+def _quote_sql(name: str) -> str:
+    """Cita un identificador de SQLite (los nombres de columna tienen espacios y acentos)."""
+    return '"' + name.replace('"', '""') + '"'
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    """Devuelve una columna, o una columna vacía si ninguna factura tenía ese dato."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+def _text(df: pd.DataFrame, name: str) -> pd.Series:
+    """Columna de texto con "" en lugar de valores vacíos."""
+    return _column(df, name).fillna("")
+
+def _number(df: pd.DataFrame, name: str) -> pd.Series:
+    """Columna numérica con 0.0 en lugar de valores vacíos o no numéricos."""
+    return pd.to_numeric(_column(df, name), errors="coerce").fillna(0.0).astype(float)
+
+def _to_float(values: List[Any]) -> pd.Series:
+    """Lista de valores como columna float64, con 0.0 para los vacíos o no numéricos."""
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").fillna(0.0).astype(float)
+
+def _flatten(df: pd.DataFrame, name: str) -> pd.DataFrame:
+    """Expande una columna de diccionarios en columnas "nombre.campo"."""
+    if name not in df.columns:
+        return pd.DataFrame(index=df.index)
+    values = [value if isinstance(value, dict) else {} for value in df[name]]
+    return pd.DataFrame(values, index=df.index).add_prefix(f"{name}.")
+
+def _latest_rows(df: pd.DataFrame, key: List[str], limit: int = 0) -> pd.DataFrame:
+    """
+    Filas de un lote tal como quedan en el historial: la última de cada clave y,
+    si se indica un límite, solo las más recientes.
+
+    Args:
+        df: Filas del lote.
+        key: Columnas que identifican una fila.
+        limit: Cantidad de filas más recientes a conservar (0 para todas).
+
+    Returns:
+        pd.DataFrame: Filas resultantes.
+    """
+    if df.empty:
+        return df
+    df = df.drop_duplicates(subset=key, keep="last")
+    if limit > 0:
+        df = df.tail(limit)
+    return df.reset_index(drop=True)
+
+def _format_dates(values: pd.Series, fmt: str) -> pd.Series:
+    """Formatea una columna de fechas como texto, con "" para las vacías."""
+    try:
+        return pd.to_datetime(values, errors="coerce").dt.strftime(fmt).fillna("")
+    except (TypeError, ValueError):
+        # Fechas con y sin zona horaria mezcladas: formatear de a una
+        return values.map(lambda value: value.strftime(fmt) if hasattr(value, "strftime") else "")
+
 class ExcelExporter:
+    # Formato de las columnas numéricas
+    _NUMERIC_FMT = "#,##0.00"
+    
     def __init__(self, output_path: str = None):
         """
         Inicializa el exportador a Excel.
@@ -22,6 +120,12 @@ class ExcelExporter:
         """
         self.output_path = output_path or settings.EXCEL_OUTPUT_PATH
         
+        # Historial de filas exportadas: fuente de verdad del Excel, que se regenera
+        # a partir de él sin volver a leer el archivo .xlsx
+        self.history_path = f"{self.output_path}.history.sqlite3"
+        # Se consulta el disco solo hasta que el historial existe; después ya no hace falta
+        self._has_history = False
+        
         # Crear directorio si no existe
         os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
     
@@ -39,251 +143,292 @@ class ExcelExporter:
             logger.warning("No hay facturas para exportar")
             return ""
         
-        try:
-            # Convertir a lista de diccionarios para pandas
-            data = []
-            productos_data = []  # Para la hoja de productos
+        with _EXPORT_LOCK:
+            return self._export_invoices(invoices)
+    
+    def _export_invoices(self, invoices: List[InvoiceData]) -> str:
+        """
+        Implementación de export_invoices; se ejecuta con _EXPORT_LOCK adquirido.
+        
+        Args:
+            invoices: Lista de objetos InvoiceData para exportar.
             
-            for i, invoice in enumerate(invoices):
-                # Convertir fecha a str para mejor visualización
-                fecha_str = invoice.fecha.strftime("%d/%m/%Y") if invoice.fecha else ""
-                procesado_str = invoice.procesado_en.strftime("%d/%m/%Y %H:%M:%S") if invoice.procesado_en else ""
-                
-                # Extraer información de empresa, si está disponible
-                empresa_nombre = ""
-                empresa_direccion = ""
-                empresa_telefono = ""
-                
-                if invoice.empresa:
-                    if isinstance(invoice.empresa, dict):
-                        empresa_nombre = invoice.empresa.get('nombre', '')
-                        empresa_direccion = invoice.empresa.get('direccion', '')
-                        empresa_telefono = invoice.empresa.get('telefono', '')
-                    else:
-                        empresa_nombre = invoice.empresa.nombre if hasattr(invoice.empresa, 'nombre') else ""
-                        empresa_direccion = invoice.empresa.direccion if hasattr(invoice.empresa, 'direccion') else ""
-                        empresa_telefono = invoice.empresa.telefono if hasattr(invoice.empresa, 'telefono') else ""
-                
-                # Extraer información del timbrado
-                timbrado_inicio = ""
-                timbrado_fin = ""
-                
-                if invoice.timbrado_data:
-                    if isinstance(invoice.timbrado_data, dict):
-                        timbrado_inicio = invoice.timbrado_data.get('fecha_inicio_vigencia', '')
-                        timbrado_fin = invoice.timbrado_data.get('valido_hasta', '')
-                    else:
-                        timbrado_inicio = invoice.timbrado_data.fecha_inicio_vigencia if hasattr(invoice.timbrado_data, 'fecha_inicio_vigencia') else ""
-                        timbrado_fin = invoice.timbrado_data.valido_hasta if hasattr(invoice.timbrado_data, 'valido_hasta') else ""
-                
-                # Información de totales
-                total_iva = 0
-                subtotal = 0
-                
-                if invoice.totales:
-                    if isinstance(invoice.totales, dict):
-                        total_iva = float(invoice.totales.get('total_iva', 0))
-                        subtotal = float(invoice.totales.get('subtotal', 0))
-                    else:
-                        total_iva = float(invoice.totales.total_iva) if hasattr(invoice.totales, 'total_iva') else 0
-                        subtotal = float(invoice.totales.subtotal) if hasattr(invoice.totales, 'subtotal') else 0
-                
-                # Datos principales para la hoja principal
-                data.append({
-                    "Fecha": fecha_str,
-                    "RUC Emisor": invoice.ruc_emisor or "",
-                    "Nombre Emisor": invoice.nombre_emisor or empresa_nombre,
-                    "Dirección Emisor": empresa_direccion,
-                    "Teléfono Emisor": empresa_telefono,
-                    "Nro. Factura": invoice.numero_factura or "",
-                    "Condición Venta": invoice.condicion_venta or "",
-                    "Moneda": invoice.moneda or "PYG",
-                    "Monto Total": float(invoice.monto_total) if invoice.monto_total else 0.0,
-                    "Subtotal": subtotal,
-                    "IVA": float(invoice.iva) if invoice.iva else total_iva,
-                    "Subtotal Exentas": float(invoice.subtotal_exentas) if invoice.subtotal_exentas else 0.0,
-                    "Subtotal 5%": float(invoice.subtotal_5) if invoice.subtotal_5 else 0.0,
-                    "Subtotal 10%": float(invoice.subtotal_10) if invoice.subtotal_10 else 0.0,
-                    "RUC Cliente": invoice.ruc_cliente or "",
-                    "Nombre Cliente": invoice.nombre_cliente or "",
-                    "Email Cliente": invoice.email_cliente or "",
-                    "Timbrado": invoice.timbrado or "",
-                    "Timbrado Inicio": timbrado_inicio,
-                    "Timbrado Fin": timbrado_fin,
-                    "CDC": invoice.cdc or "",
-                    "Actividad Económica": invoice.actividad_economica or "",
-                    "Productos": len(invoice.productos) if invoice.productos else 0,
-                    "PDF": invoice.pdf_path or "",
-                    "Origen (correo)": invoice.email_origen or "",
-                    "Procesado en": procesado_str
-                })
-                
-                # Añadir datos de productos
-                if invoice.productos:
-                    for producto in invoice.productos:
-                        # Manejar productos tanto como objetos ProductoFactura como diccionarios
-                        if isinstance(producto, dict):
-                            articulo = producto.get('articulo', '')
-                            cantidad = float(producto.get('cantidad', 0))
-                            precio_unitario = float(producto.get('precio_unitario', 0))
-                            total = float(producto.get('total', 0))
-                        else:
-                            articulo = producto.articulo if hasattr(producto, 'articulo') else ""
-                            cantidad = float(producto.cantidad) if hasattr(producto, 'cantidad') else 0
-                            precio_unitario = float(producto.precio_unitario) if hasattr(producto, 'precio_unitario') else 0
-                            total = float(producto.total) if hasattr(producto, 'total') else 0
-                        
-                        productos_data.append({
-                            "Factura": invoice.numero_factura or "",
-                            "RUC Emisor": invoice.ruc_emisor or "",
-                            "Fecha": fecha_str,
-                            "Artículo": articulo,
-                            "Cantidad": cantidad,
-                            "Precio Unitario": precio_unitario,
-                            "Total": total
-                        })
+        Returns:
+            str: Ruta del archivo Excel generado.
+        """
+        try:
+            facturas_df, productos_df = self._build_frames(invoices)
             
             # Columnas numéricas para formateo especial
             numeric_cols = ["Monto Total", "Subtotal", "IVA", "Subtotal Exentas", "Subtotal 5%", "Subtotal 10%", "Productos"]
             productos_numeric_cols = ["Cantidad", "Precio Unitario", "Total"]
             
-            # Crear o cargar el archivo Excel existente
-            if os.path.exists(self.output_path):
-                try:
-                    existing_df = pd.read_excel(self.output_path, sheet_name="Facturas")
-                    new_df = pd.DataFrame(data)
-                    
-                    # Convertir columnas numéricas a float para evitar problemas
-                    for col in numeric_cols:
-                        if col in existing_df.columns and col in new_df.columns:
-                            existing_df[col] = existing_df[col].astype(float)
-                            new_df[col] = new_df[col].astype(float)
-                    
-                    # Concatenar y eliminar duplicados
-                    combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-                    combined_df.drop_duplicates(
-                        subset=["RUC Emisor", "Nro. Factura", "Monto Total", "CDC"],
-                        keep="last",
-                        inplace=True
-                    )
-                    
-                    # Cargar datos de productos existentes
-                    try:
-                        existing_productos_df = pd.read_excel(self.output_path, sheet_name="Productos")
-                        productos_df = pd.DataFrame(productos_data)
-                        
-                        # Convertir columnas numéricas de productos a float
-                        for col in productos_numeric_cols:
-                            if col in existing_productos_df.columns and col in productos_df.columns:
-                                existing_productos_df[col] = existing_productos_df[col].astype(float)
-                                productos_df[col] = productos_df[col].astype(float)
-                        
-                        # Combinar productos
-                        combined_productos_df = pd.concat([existing_productos_df, productos_df], ignore_index=True)
-                        combined_productos_df.drop_duplicates(
-                            subset=["Factura", "RUC Emisor", "Artículo"],
-                            keep="last",
-                            inplace=True
-                        )
-                    except Exception as e:
-                        logger.warning(f"No se encontró hoja de productos existente: {str(e)}")
-                        combined_productos_df = pd.DataFrame(productos_data)
-                    
-                    # Guardar el DataFrame combinado en múltiples hojas
-                    with pd.ExcelWriter(self.output_path, engine='openpyxl') as writer:
-                        combined_df.to_excel(writer, sheet_name="Facturas", index=False)
-                        combined_productos_df.to_excel(writer, sheet_name="Productos", index=False)
-                    
-                except Exception as e:
-                    logger.error(f"Error al cargar archivo Excel existente: {str(e)}")
-                    # Si hay error al cargar, creamos uno nuevo
-                    with pd.ExcelWriter(self.output_path, engine='openpyxl') as writer:
-                        pd.DataFrame(data).to_excel(writer, sheet_name="Facturas", index=False)
-                        pd.DataFrame(productos_data).to_excel(writer, sheet_name="Productos", index=False)
-            else:
-                # Crear nuevo archivo con múltiples hojas
-                with pd.ExcelWriter(self.output_path, engine='openpyxl') as writer:
-                    pd.DataFrame(data).to_excel(writer, sheet_name="Facturas", index=False)
-                    pd.DataFrame(productos_data).to_excel(writer, sheet_name="Productos", index=False)
+            # Sin historial ni Excel previos el historial queda con las filas de este lote
+            first_export = not self._history_exists() and not os.path.exists(self.output_path)
             
-            # Aplicar formato
-            self._apply_excel_formatting(numeric_cols, productos_numeric_cols)
+            # Agregar las filas nuevas al historial (reemplazando las repetidas) y leerlo
+            # completo para regenerar el Excel
+            with closing(self._open_history()) as conn:
+                self._upsert_rows(conn, "Facturas", facturas_df, FACTURAS_KEY)
+                self._upsert_rows(conn, "Productos", productos_df, PRODUCTOS_KEY)
+                conn.commit()
+                
+                if first_export:
+                    # Primera exportación: se escribe el lote sin volver a leerlo del historial
+                    all_facturas_df = _latest_rows(facturas_df, FACTURAS_KEY, settings.EXCEL_MAX_ROWS)
+                    all_productos_df = _latest_rows(productos_df, PRODUCTOS_KEY, settings.EXCEL_MAX_ROWS)
+                else:
+                    all_facturas_df = self._read_rows(conn, "Facturas", settings.EXCEL_MAX_ROWS)
+                    all_productos_df = self._read_rows(conn, "Productos", settings.EXCEL_MAX_ROWS)
+            
+            # Escribir el archivo ya formateado en una sola pasada
+            self._write_workbook([
+                ("Facturas", all_facturas_df, numeric_cols),
+                ("Productos", all_productos_df, productos_numeric_cols)
+            ])
             
-            logger.info(f"Archivo Excel generado: {self.output_path} con {len(data)} facturas")
+            logger.info(f"Archivo Excel generado: {self.output_path} con {len(facturas_df)} facturas")
             return self.output_path
             
         except Exception as e:
             logger.error(f"Error al exportar a Excel: {str(e)}", exc_info=True)
             return ""
     
-    def _apply_excel_formatting(self, numeric_cols: List[str], productos_numeric_cols: List[str]):
+    def _build_frames(self, invoices: List[InvoiceData]) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """
-        Aplica formato al archivo Excel para mejorar su visualización.
+        Construye las filas de las hojas Facturas y Productos.
+        
+        Cada factura se vuelca a un diccionario con model_dump y las conversiones
+        (fechas, números, valores por defecto) se hacen por columna con pandas.
         
         Args:
-            numeric_cols: Lista de columnas numéricas para formateo especial en la hoja principal.
-            productos_numeric_cols: Lista de columnas numéricas para formateo especial en la hoja de productos.
-        """
-        try:
-            wb = openpyxl.load_workbook(self.output_path)
-            
-            # Definir estilos
-            header_font = Font(bold=True, size=12, color="FFFFFF")
-            header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-            header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+            invoices: Facturas a exportar.
             
-            thin_border = Border(
-                left=Side(style="thin"),
-                right=Side(style="thin"),
-                top=Side(style="thin"),
-                bottom=Side(style="thin")
+        Returns:
+            Tuple: (filas de Facturas, filas de Productos)
+        """
+        # En el mismo proceso a propósito: enviar las facturas a otro proceso (pickle de
+        # ida y vuelta) cuesta varias veces más que el propio model_dump
+        records = [invoice.model_dump(include=EXPORT_FIELDS, warnings=False) for invoice in invoices]
+        for record in records:
+            record["productos"] = record.get("productos") or []
+        
+        # Los datos anidados (empresa, timbrado_data, totales) quedan como columnas "empresa.nombre", etc.
+        flat = pd.DataFrame(records)
+        flat = pd.concat([flat] + [_flatten(flat, name) for name in ("empresa", "timbrado_data", "totales")], axis=1)
+        
+        nombre_emisor = _text(flat, "nombre_emisor")
+        moneda = _text(flat, "moneda")
+        iva = _number(flat, "iva")
+        
+        facturas_df = pd.DataFrame({
+            "Fecha": _format_dates(_column(flat, "fecha"), "%d/%m/%Y"),
+            "RUC Emisor": _text(flat, "ruc_emisor"),
+            "Nombre Emisor": nombre_emisor.where(nombre_emisor != "", _text(flat, "empresa.nombre")),
+            "Dirección Emisor": _text(flat, "empresa.direccion"),
+            "Teléfono Emisor": _text(flat, "empresa.telefono"),
+            "Nro. Factura": _text(flat, "numero_factura"),
+            "Condición Venta": _text(flat, "condicion_venta"),
+            "Moneda": moneda.where(moneda != "", "PYG"),
+            "Monto Total": _number(flat, "monto_total"),
+            "Subtotal": _number(flat, "totales.subtotal"),
+            "IVA": iva.where(iva != 0, _number(flat, "totales.total_iva")),
+            "Subtotal Exentas": _number(flat, "subtotal_exentas"),
+            "Subtotal 5%": _number(flat, "subtotal_5"),
+            "Subtotal 10%": _number(flat, "subtotal_10"),
+            "RUC Cliente": _text(flat, "ruc_cliente"),
+            "Nombre Cliente": _text(flat, "nombre_cliente"),
+            "Email Cliente": _text(flat, "email_cliente"),
+            "Timbrado": _text(flat, "timbrado"),
+            "Timbrado Inicio": _text(flat, "timbrado_data.fecha_inicio_vigencia"),
+            "Timbrado Fin": _text(flat, "timbrado_data.valido_hasta"),
+            "CDC": _text(flat, "cdc"),
+            "Actividad Económica": _text(flat, "actividad_economica"),
+            "Productos": _column(flat, "productos").map(len),
+            "PDF": _text(flat, "pdf_path"),
+            "Origen (correo)": _text(flat, "email_origen"),
+            "Procesado en": _format_dates(_column(flat, "procesado_en"), "%d/%m/%Y %H:%M:%S")
+        })
+        
+        # Una fila por producto: los productos se vuelcan a una lista por columna y los
+        # datos de la factura (ya formateados) se repiten tantas veces como productos tenga
+        items = [item for record in records for item in record["productos"]]
+        if not items:
+            return facturas_df, pd.DataFrame()
+        counts = facturas_df["Productos"]
+        
+        productos_df = pd.DataFrame({
+            "Factura": facturas_df["Nro. Factura"].repeat(counts).to_numpy(),
+            "RUC Emisor": facturas_df["RUC Emisor"].repeat(counts).to_numpy(),
+            "Fecha": facturas_df["Fecha"].repeat(counts).to_numpy(),
+            "Artículo": [item.get("articulo") or "" for item in items],
+            "Cantidad": _to_float([item.get("cantidad") for item in items]),
+            "Precio Unitario": _to_float([item.get("precio_unitario") for item in items]),
+            "Total": _to_float([item.get("total") for item in items])
+        })
+        
+        return facturas_df, productos_df
+    
+    def _history_exists(self) -> bool:
+        """
+        Indica si el historial ya existe. Una vez que existe se recuerda, de modo
+        que las exportaciones siguientes no vuelven a consultar el disco.
+        
+        Returns:
+            bool: True si el archivo del historial existe.
+        """
+        if not self._has_history:
+            self._has_history = os.path.exists(self.history_path)
+        return self._has_history
+    
+    def _open_history(self) -> sqlite3.Connection:
+        """
+        Abre el historial de filas exportadas. La primera vez, si ya existe un Excel
+        de una versión anterior, se importan sus filas.
+        
+        Returns:
+            sqlite3.Connection: Conexión al historial.
+        """
+        import_existing = not self._history_exists() and os.path.exists(self.output_path)
+        conn = sqlite3.connect(self.history_path, timeout=30)
+        self._has_history = True
+        # WAL: cada exportación agrega páginas al final en lugar de reescribir el archivo;
+        # mmap: la lectura completa del historial se hace sobre el archivo mapeado
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={HISTORY_MMAP_SIZE}")
+        
+        if import_existing:
+            try:
+                # Las claves de texto se leen como texto para que coincidan con las filas nuevas
+                sheets = pd.read_excel(
+                    self.output_path,
+                    sheet_name=["Facturas", "Productos"],
+                    dtype={col: str for col in ["RUC Emisor", "Nro. Factura", "CDC", "Factura", "Artículo"]}
+                )
+                for sheet_name, key in (("Facturas", FACTURAS_KEY), ("Productos", PRODUCTOS_KEY)):
+                    df = sheets[sheet_name]
+                    text_key = [col for col in key if df[col].dtype == object]
+                    df[text_key] = df[text_key].fillna("")
+                    self._upsert_rows(conn, sheet_name, df, key)
+                conn.commit()
+                logger.info(f"Historial importado desde el archivo Excel existente: {self.output_path}")
+            except Exception as e:
+                # Si hay error al cargar, el historial empieza vacío
+                conn.rollback()
+                logger.error(f"Error al cargar archivo Excel existente: {str(e)}")
+        
+        return conn
+    
+    def _upsert_rows(self, conn: sqlite3.Connection, table: str, df: pd.DataFrame, key: List[str]):
+        """
+        Inserta filas en una tabla del historial; las que repiten la clave
+        reemplazan a las anteriores y pasan al final.
+        
+        Args:
+            conn: Conexión al historial.
+            table: Nombre de la tabla (hoja).
+            df: Filas a insertar.
+            key: Columnas que identifican una fila.
+        """
+        if df.empty:
+            return
+        
+        columns = list(df.columns)
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({_quote_sql(table)})")]
+        if not existing:
+            conn.execute(
+                f"CREATE TABLE {_quote_sql(table)} ({', '.join(_quote_sql(col) for col in columns)}, "
+                f"PRIMARY KEY ({', '.join(_quote_sql(col) for col in key)}))"
             )
+        else:
+            # Columnas agregadas en versiones posteriores
+            for col in columns:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE {_quote_sql(table)} ADD COLUMN {_quote_sql(col)}")
+        
+        # Dentro del lote solo se envía la última fila de cada clave: las anteriores
+        # se insertarían para ser reemplazadas enseguida. Las filas ya guardadas no se
+        # leen ni se combinan con las nuevas; la clave primaria resuelve esos duplicados
+        df = df.drop_duplicates(subset=key, keep="last")
+        
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {_quote_sql(table)} ({', '.join(_quote_sql(col) for col in columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})",
+            rows
+        )
+    
+    def _read_rows(self, conn: sqlite3.Connection, table: str, limit: int = 0) -> pd.DataFrame:
+        """
+        Lee las filas de una tabla del historial en orden de inserción.
+        
+        Args:
+            conn: Conexión al historial.
+            table: Nombre de la tabla (hoja).
+            limit: Cantidad de filas más recientes a leer (0 para todas).
             
-            # Formatear cada hoja
-            for sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-                
-                # Determinar qué columnas numéricas usar según la hoja
-                sheet_numeric_cols = numeric_cols if sheet_name == "Facturas" else productos_numeric_cols
-                
-                # Aplicar formato a encabezados
-                for cell in ws[1]:
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = header_alignment
-                    cell.border = thin_border
-                
-                # Aplicar formato a celdas
-                for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-                    for cell in row:
-                        cell.border = thin_border
-                        cell.alignment = Alignment(vertical="center")
-                        
-                        # Formato para columnas numéricas
-                        header_value = ws.cell(1, cell.column).value
-                        if header_value in sheet_numeric_cols:
-                            cell.number_format = "#,##0.00"
-                
-                # Auto-ajustar anchos de columna
-                for column in ws.columns:
-                    max_length = max(
-                        len(str(cell.value)) for cell in column
-                    ) if any(cell.value for cell in column) else 0
-                    
-                    if max_length > 0:
-                        column_letter = column[0].column_letter
-                        adjusted_width = min(max_length + 2, 50)
-                        ws.column_dimensions[column_letter].width = adjusted_width
-                
-                # Congelar paneles (fila de encabezados)
-                ws.freeze_panes = "A2"
-            
-            # Guardar cambios
-            wb.save(self.output_path)
-            logger.info("Formato aplicado al archivo Excel")
+        Returns:
+            pd.DataFrame: Filas de la tabla (vacío si no existe).
+        """
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return pd.DataFrame()
+        if limit <= 0:
+            df = pd.read_sql_query(f"SELECT * FROM {_quote_sql(table)} ORDER BY rowid", conn)
+        else:
+            # Las últimas filas se toman recorriendo el rowid hacia atrás, sin leer el resto
+            df = pd.read_sql_query(f"SELECT * FROM {_quote_sql(table)} ORDER BY rowid DESC LIMIT ?", conn, params=(limit,))
+            df = df.iloc[::-1].reset_index(drop=True)
+        
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        
+        # Columnas numéricas sin decimales (montos en guaraníes, cantidades, conteos) al
+        # entero más chico que las contiene; las que tienen decimales siguen en float64,
+        # ya que float32 no alcanza para montos grandes
+        for col in df.select_dtypes(include="number").columns:
+            if df[col].notna().all():
+                df[col] = pd.to_numeric(df[col], downcast="integer")
+        return df
+    
+    def _write_workbook(self, sheets: List[Tuple[str, pd.DataFrame, List[str]]]):
+        """
+        Escribe las hojas ya formateadas en una sola pasada, generando el XML del
+        .xlsx directamente (ver xlsx_writer), sin crear un objeto por celda.
+        
+        Args:
+            sheets: Lista de (nombre de hoja, datos, columnas numéricas).
+        """
+        xlsx_sheets = []
+        for sheet_name, df, sheet_numeric_cols in sheets:
+            columns = list(df.columns)
+            styles = [NUMERIC_STYLE if col in sheet_numeric_cols else DATA_STYLE for col in columns]
+            xlsx_sheets.append((sheet_name, df, styles, self._column_widths(columns, df)))
+        
+        with open(self.output_path, "wb", buffering=SAVE_BUFFER_SIZE) as f:
+            write_xlsx(f, xlsx_sheets, self._NUMERIC_FMT, settings.EXCEL_COMPRESS_LEVEL)
+    
+    def _column_widths(self, columns: List[str], df: pd.DataFrame) -> List[int]:
+        """
+        Calcula el ancho de cada columna a partir del encabezado y de una muestra
+        acotada de filas, sin recorrer todas las celdas escritas.
+        
+        Args:
+            columns: Nombres de las columnas.
+            df: Datos de la hoja.
             
-        except Exception as e:
-            logger.error(f"Error al aplicar formato Excel: {str(e)}", exc_info=True)
+        Returns:
+            List[int]: Ancho de cada columna (0 si no tiene contenido).
+        """
+        sample = df.head(WIDTH_SAMPLE_ROWS)
+        widths = []
+        for col in columns:
+            # Largo de cada valor calculado por columna, sin iterar en Python
+            lengths = sample[col].dropna().astype(str).str.len()
+            max_length = max(len(str(col)), int(lengths.max()) if len(lengths) else 0)
+            widths.append(min(max_length + 2, MAX_COLUMN_WIDTH) if max_length > 0 else 0)
+        return widths
     
     def append_invoices(self, invoices: List[InvoiceData]) -> bool:
         """
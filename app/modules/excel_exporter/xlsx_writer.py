@@ -0,0 +1,237 @@
+import re
+import zipfile
+from typing import IO, Dict, Iterator, List, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+import pandas as pd
+
+# Escritura directa del formato .xlsx: las partes XML se arman como texto y se
+# comprimen en el ZIP, sin crear un objeto por celda como openpyxl o xlsxwriter.
+# Solo cubre lo que usa el exportador: texto, números, celdas vacías, un estilo
+# por columna, ancho de columnas y la fila de encabezados fija.
+
+# Nivel de compresión por defecto: 1 comprime casi igual que el nivel 6 en mucho menos tiempo
+COMPRESS_LEVEL = 1
+
+# Filas que se acumulan antes de escribirlas comprimidas en el ZIP
+ROWS_PER_WRITE = 1000
+
+# Caracteres de control que XML no admite
+_INVALID_XML_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Índices de estilo (cellXfs en styles.xml)
+HEADER_STYLE = 1
+DATA_STYLE = 2
+NUMERIC_STYLE = 3
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CONTENT_TYPE_PREFIX = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+
+_ROOT_RELS = (
+    f'{_XML_DECLARATION}<Relationships xmlns="{_PACKAGE_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_STYLES = (
+    f'{_XML_DECLARATION}<styleSheet xmlns="{_MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode={numeric_format}/></numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="12"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    '<fills count="3">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF4F81BD"/><bgColor rgb="FF4F81BD"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" '
+    'applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center" wrapText="1"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" applyAlignment="1">'
+    '<alignment vertical="center"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="1" xfId="0" '
+    'applyNumberFormat="1" applyBorder="1" applyAlignment="1">'
+    '<alignment vertical="center"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+def _column_letter(index: int) -> str:
+    """Letra de una columna a partir de su índice (0 -> A, 26 -> AA)."""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _clean(text: str) -> str:
+    """Escapa un texto para XML y quita los caracteres de control que no admite."""
+    return escape(_INVALID_XML_RE.sub("", text))
+
+def iter_rows(df: pd.DataFrame, chunk_size: int = ROWS_PER_WRITE) -> Iterator[tuple]:
+    """
+    Recorre las filas de un DataFrame como tuplas de valores de Python, con None
+    para los valores vacíos (NaN o texto vacío).
+
+    La conversión a objetos se hace por bloques de filas, de modo que no se crea
+    una copia completa del DataFrame como objetos además de los datos originales.
+
+    Args:
+        df: Datos a recorrer.
+        chunk_size: Filas convertidas por bloque.
+
+    Yields:
+        tuple: Valores de cada fila.
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        yield from chunk.astype(object).where(chunk.notna() & (chunk != ""), None).itertuples(index=False, name=None)
+
+def _write_sheet(stream: IO[bytes], df: pd.DataFrame, styles: List[int], widths: List[int], strings: Dict[str, int]):
+    """
+    Escribe el XML de una hoja por bloques de filas.
+
+    Args:
+        stream: Destino (la entrada xl/worksheets/sheetN.xml del ZIP).
+        df: Datos de la hoja.
+        styles: Estilo de cada columna.
+        widths: Ancho de cada columna (0 para el ancho por defecto).
+        strings: Textos compartidos del libro; se agregan los de esta hoja.
+    """
+    letters = [_column_letter(i) for i in range(len(df.columns))]
+
+    parts = [
+        f'{_XML_DECLARATION}<worksheet xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}">'
+        '<sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        '<selection pane="bottomLeft"/>'
+        '</sheetView></sheetViews>'
+        '<sheetFormatPr defaultRowHeight="15"/>'
+    ]
+
+    cols = [
+        f'<col min="{i + 1}" max="{i + 1}" width="{width}" customWidth="1"/>'
+        for i, width in enumerate(widths) if width
+    ]
+    if cols:
+        parts.append(f"<cols>{''.join(cols)}</cols>")
+
+    parts.append("<sheetData>")
+
+    header = "".join(
+        f'<c r="{letter}1" s="{HEADER_STYLE}" t="s"><v>{strings.setdefault(str(col), len(strings))}</v></c>'
+        for letter, col in zip(letters, df.columns)
+    )
+    parts.append(f'<row r="1">{header}</row>')
+
+    # Los valores vacíos se escriben como celdas vacías con su estilo
+    for row_number, values in enumerate(iter_rows(df), start=2):
+        cells = []
+        for letter, style, value in zip(letters, styles, values):
+            if value is None:
+                cells.append(f'<c r="{letter}{row_number}" s="{style}"/>')
+            elif isinstance(value, bool):
+                cells.append(f'<c r="{letter}{row_number}" s="{style}" t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, (int, float)) and abs(value) != float("inf"):
+                # repr conserva el valor exacto; los enteros se escriben sin ".0"
+                number = repr(value)
+                if number.endswith(".0"):
+                    number = number[:-2]
+                cells.append(f'<c r="{letter}{row_number}" s="{style}"><v>{number}</v></c>')
+            else:
+                index = strings.setdefault(str(value), len(strings))
+                cells.append(f'<c r="{letter}{row_number}" s="{style}" t="s"><v>{index}</v></c>')
+        parts.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+
+        if len(parts) >= ROWS_PER_WRITE:
+            stream.write("".join(parts).encode("utf-8"))
+            parts = []
+
+    parts.append("</sheetData></worksheet>")
+    stream.write("".join(parts).encode("utf-8"))
+
+def write_xlsx(file: Union[str, IO[bytes]], sheets: List[Tuple[str, pd.DataFrame, List[int], List[int]]],
+               numeric_format: str, compress_level: int = COMPRESS_LEVEL):
+    """
+    Escribe un archivo .xlsx con las hojas indicadas.
+
+    Args:
+        file: Ruta del archivo a generar o archivo binario abierto para escritura.
+        sheets: Lista de (nombre de hoja, datos, estilo de cada columna, ancho de cada columna).
+        numeric_format: Formato de número del estilo NUMERIC_STYLE (p. ej. "#,##0.00").
+        compress_level: Nivel de compresión del ZIP, de 1 a 9; 0 guarda las partes sin comprimir.
+    """
+    count = len(sheets)
+
+    content_types = (
+        f'{_XML_DECLARATION}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{_CONTENT_TYPE_PREFIX}.sheet.main+xml"/>'
+        + "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{_CONTENT_TYPE_PREFIX}.worksheet+xml"/>'
+            for i in range(1, count + 1)
+        )
+        + f'<Override PartName="/xl/styles.xml" ContentType="{_CONTENT_TYPE_PREFIX}.styles+xml"/>'
+        f'<Override PartName="/xl/sharedStrings.xml" ContentType="{_CONTENT_TYPE_PREFIX}.sharedStrings+xml"/>'
+        '</Types>'
+    )
+
+    workbook = (
+        f'{_XML_DECLARATION}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>'
+        + "".join(
+            f'<sheet name={quoteattr(name)} sheetId="{i}" r:id="rId{i}"/>'
+            for i, (name, _, _, _) in enumerate(sheets, start=1)
+        )
+        + "</sheets></workbook>"
+    )
+
+    workbook_rels = (
+        f'{_XML_DECLARATION}<Relationships xmlns="{_PACKAGE_REL_NS}">'
+        + "".join(
+            f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, count + 1)
+        )
+        + f'<Relationship Id="rId{count + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+        f'<Relationship Id="rId{count + 2}" Type="{_REL_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+        '</Relationships>'
+    )
+
+    if compress_level > 0:
+        archive = zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED, compresslevel=min(compress_level, 9))
+    else:
+        archive = zipfile.ZipFile(file, "w", zipfile.ZIP_STORED)
+
+    with archive:
+        # Las hojas se escriben primero, por bloques; así se conocen todos los textos
+        # compartidos antes de escribir sharedStrings.xml
+        strings: Dict[str, int] = {}
+        for i, (_, df, styles, widths) in enumerate(sheets, start=1):
+            with archive.open(f"xl/worksheets/sheet{i}.xml", "w") as stream:
+                _write_sheet(stream, df, styles, widths, strings)
+
+        shared_strings = (
+            f'{_XML_DECLARATION}<sst xmlns="{_MAIN_NS}" uniqueCount="{len(strings)}">'
+            + "".join(f'<si><t xml:space="preserve">{_clean(text)}</t></si>' for text in strings)
+            + "</sst>"
+        )
+
+        archive.writestr("[Content_Types].xml", content_types)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/workbook.xml", workbook)
+        archive.writestr("xl/_rels/workbook.xml.rels", workbook_rels)
+        archive.writestr("xl/styles.xml", _STYLES.replace("{numeric_format}", quoteattr(numeric_format)))
+        archive.writestr("xl/sharedStrings.xml", shared_strings)
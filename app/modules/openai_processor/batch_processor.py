@@ -0,0 +1,291 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from app.config.settings import settings
+from app.models.models import InvoiceData
+from app.modules.openai_processor.openai_processor import OpenAIProcessor
+
+logger = logging.getLogger(__name__)
+
+# Estados finales de un lote de la Batch API
+_FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# PDF pendiente de resultado: (ruta, metadatos del correo, future a resolver)
+_Waiter = Tuple[str, Optional[Dict[str, Any]], Future]
+
+class BatchQueueProcessor:
+    """
+    Extracción de facturas mediante la Batch API de OpenAI, para el modo daemon.
+    
+    Las peticiones se acumulan y se envían juntas en un archivo JSONL; OpenAI las
+    resuelve en diferido (hasta 24 horas) a la mitad de costo que las peticiones
+    individuales. Cada PDF encolado recibe un Future que se resuelve con la factura
+    cuando el lote termina.
+    
+    Un hilo en segundo plano envía el lote al llegar a OPENAI_BATCH_SIZE peticiones
+    o tras OPENAI_BATCH_FLUSH_SECONDS desde la primera, y consulta el estado de los
+    lotes enviados cada OPENAI_BATCH_POLL_SECONDS.
+    """
+    
+    def __init__(self, processor: OpenAIProcessor):
+        """
+        Inicializa la cola de lotes.
+        
+        Args:
+            processor: Procesador de OpenAI usado para convertir los PDF, armar las
+                peticiones e interpretar las respuestas.
+        """
+        self.processor = processor
+        self.max_entries = max(settings.OPENAI_BATCH_SIZE, 1)
+        self.flush_seconds = settings.OPENAI_BATCH_FLUSH_SECONDS
+        self.poll_seconds = settings.OPENAI_BATCH_POLL_SECONDS
+        
+        # PDFs aún no enviados, por custom_id, y momento en que llegó el primero
+        self._pending: Dict[str, List[_Waiter]] = {}
+        self._pending_since: Optional[float] = None
+        # Lotes enviados: id del lote -> PDFs por custom_id
+        self._batches: Dict[str, Dict[str, List[_Waiter]]] = {}
+        self._last_poll = 0.0
+        
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="invoicesync-batch", daemon=True)
+        self._thread.start()
+    
+    def submit(self, pdf_path: str, email_metadata: Optional[Dict[str, Any]] = None,
+               custom_id: Optional[str] = None) -> Future:
+        """
+        Encola un PDF para extraer su factura en el próximo lote.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            email_metadata: Metadatos del correo de donde se extrajo la factura.
+            custom_id: Identificador de la petición dentro del lote (p. ej. el hash
+                SHA-256 del PDF); los PDFs con el mismo identificador comparten petición.
+        
+        Returns:
+            Future: Se resuelve con el InvoiceData de la factura.
+        """
+        future = Future()
+        custom_id = custom_id or uuid.uuid4().hex
+        
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.setdefault(custom_id, []).append((pdf_path, email_metadata, future))
+            if len(self._pending) >= self.max_entries:
+                self._wakeup.set()
+        
+        return future
+    
+    def pending_paths(self) -> set:
+        """
+        Rutas de los PDFs que esperan resultado: aún no enviados o en lotes sin terminar.
+        
+        Returns:
+            set: Rutas absolutas de los PDFs.
+        """
+        with self._lock:
+            groups = [self._pending] + list(self._batches.values())
+            return {
+                os.path.abspath(pdf_path)
+                for entries in groups for waiters in entries.values() for pdf_path, _, _ in waiters
+            }
+    
+    def flush(self):
+        """Envía de inmediato las peticiones encoladas."""
+        with self._lock:
+            self._pending_since = 0.0
+        self._wakeup.set()
+    
+    def close(self):
+        """
+        Detiene el hilo en segundo plano. Los PDFs que no recibieron respuesta se
+        resuelven sin datos extraídos, como cuando falla la petición individual.
+        """
+        self._stop_event.set()
+        self._wakeup.set()
+        self._thread.join()
+        
+        with self._lock:
+            groups = [self._pending] + list(self._batches.values())
+            self._pending = {}
+            self._batches = {}
+        for entries in groups:
+            self._resolve(entries, {})
+    
+    def _run(self):
+        """Bucle del hilo en segundo plano: envía los lotes y consulta su estado."""
+        while not self._stop_event.is_set():
+            self._wakeup.wait(timeout=min(self.flush_seconds, self.poll_seconds, 60))
+            self._wakeup.clear()
+            if self._stop_event.is_set():
+                break
+            
+            try:
+                with self._lock:
+                    ready = self._pending and (
+                        len(self._pending) >= self.max_entries
+                        or time.monotonic() - self._pending_since >= self.flush_seconds
+                    )
+                    entries = self._pending if ready else {}
+                    if ready:
+                        self._pending = {}
+                        self._pending_since = None
+                
+                if entries:
+                    self._send_batch(entries)
+                
+                if self._batches and time.monotonic() - self._last_poll >= self.poll_seconds:
+                    self._last_poll = time.monotonic()
+                    self._poll_batches()
+            except Exception as e:
+                logger.error(f"Error en la cola de lotes de OpenAI: {str(e)}")
+    
+    def _send_batch(self, entries: Dict[str, List[_Waiter]]):
+        """
+        Convierte los PDFs, sube el archivo JSONL del lote y crea el lote.
+        
+        Args:
+            entries: PDFs a enviar, por custom_id.
+        """
+        client = self.processor.client
+        if client is None:
+            logger.error("No se ha configurado la API key de OpenAI")
+            self._resolve(entries, {})
+            return
+        
+        os.makedirs(settings.TEMP_PDF_DIR, exist_ok=True)
+        batch_path = os.path.join(settings.TEMP_PDF_DIR, f"oai_batch_{int(time.time())}_{uuid.uuid4().hex[:8]}.jsonl")
+        
+        sent: Dict[str, List[_Waiter]] = {}
+        try:
+            with open(batch_path, "wb") as batch_file:
+                for custom_id, waiters in entries.items():
+                    content = self.processor._prepare_content(waiters[0][0])
+                    if content is None:
+                        self._resolve({custom_id: waiters}, {})
+                        continue
+                    
+                    batch_file.write(orjson.dumps({
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": self.processor._build_request(content)
+                    }) + b"\n")
+                    sent[custom_id] = waiters
+            
+            if not sent:
+                return
+            
+            with open(batch_path, "rb") as batch_file:
+                input_file = client.files.create(file=batch_file, purpose="batch")
+            
+            # Llamada genérica: no todas las versiones del SDK incluyen client.batches
+            batch = client.post("/batches", cast_to=Dict[str, Any], body={
+                "input_file_id": input_file.id,
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h"
+            })
+        except Exception as e:
+            logger.error(f"Error al enviar el lote a OpenAI: {str(e)}")
+            self._resolve(sent, {})
+            return
+        finally:
+            try:
+                os.remove(batch_path)
+            except OSError:
+                pass
+        
+        with self._lock:
+            self._batches[batch["id"]] = sent
+        logger.info(f"Lote {batch['id']} enviado a OpenAI con {len(sent)} PDFs")
+    
+    def _poll_batches(self):
+        """Consulta el estado de los lotes enviados y resuelve los que terminaron."""
+        client = self.processor.client
+        
+        with self._lock:
+            batch_ids = list(self._batches)
+        
+        for batch_id in batch_ids:
+            try:
+                batch = client.get(f"/batches/{batch_id}", cast_to=Dict[str, Any])
+            except Exception as e:
+                logger.warning(f"Error al consultar el lote {batch_id}: {str(e)}")
+                continue
+            
+            status = batch.get("status")
+            if status not in _FINISHED_STATUSES:
+                continue
+            
+            results: Dict[str, Dict[str, Any]] = {}
+            if batch.get("output_file_id"):
+                try:
+                    results = self._read_results(batch["output_file_id"])
+                except Exception as e:
+                    logger.error(f"Error al descargar los resultados del lote {batch_id}: {str(e)}")
+                    continue
+            
+            with self._lock:
+                entries = self._batches.pop(batch_id, {})
+            
+            missing = len(entries) - len(results.keys() & entries.keys())
+            if status != "completed" or missing:
+                logger.warning(f"Lote {batch_id} terminado con estado {status}; {missing} PDFs sin respuesta")
+            else:
+                logger.info(f"Lote {batch_id} completado con {len(entries)} PDFs")
+            
+            self._resolve(entries, results)
+    
+    def _read_results(self, output_file_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Descarga el archivo de resultados de un lote e interpreta cada respuesta.
+        
+        Args:
+            output_file_id: ID del archivo de resultados.
+        
+        Returns:
+            Dict: Datos extraídos por custom_id (solo las respuestas exitosas).
+        """
+        content = self.processor.client.files.content(output_file_id)
+        
+        results = {}
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                logger.warning(f"Petición {record.get('custom_id')} del lote con error: {record.get('error') or response.get('body')}")
+                continue
+            message = response["body"]["choices"][0]["message"]["content"]
+            results[record["custom_id"]] = self.processor._parse_response(message)
+        return results
+    
+    def _resolve(self, entries: Dict[str, List[_Waiter]], results: Dict[str, Dict[str, Any]]):
+        """
+        Resuelve los Future de los PDFs con sus datos extraídos (vacíos si no hubo respuesta).
+        
+        Args:
+            entries: PDFs por custom_id.
+            results: Datos extraídos por custom_id.
+        """
+        for custom_id, waiters in entries.items():
+            extracted_data = results.get(custom_id, {})
+            for pdf_path, email_metadata, future in waiters:
+                if future.done():
+                    continue
+                try:
+                    invoice: InvoiceData = self.processor._build_invoice(pdf_path, email_metadata, extracted_data)
+                    future.set_result(invoice)
+                except Exception as e:
+                    future.set_exception(e)
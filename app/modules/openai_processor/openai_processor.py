@@ -1,36 +1,438 @@
 import os
+import atexit
+import asyncio
+import threading
 import base64
 import logging
-import tempfile
 import json
 import re
-import io
-from typing import Dict, Any, Optional, List, Union
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, List
 from datetime import datetime
-import requests
-import openai
+import httpx
+import orjson
+from openai import AsyncOpenAI, OpenAI
+from pydantic import ValidationError
 import fitz  # PyMuPDF
-from PIL import Image
 
 from app.config.settings import settings
-from app.models.models import InvoiceData, EmpresaData, TimbradoData, FacturaData, ClienteData, TotalesData, ProductoFactura
+from app.models.models import InvoiceData
+from app.modules.openai_processor.rate_limiter import RateLimiter
 
 logger = logging.getLogger(__name__)
 
+# Conexiones simultáneas permitidas hacia la API de OpenAI
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20)
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+# Expresiones regulares compiladas una sola vez para todas las respuestas
+_NON_NUMERIC_RE = re.compile(r'[^\d.]')
+# Fechas año-mes-día o día-mes-año con "-" o "/" (el mismo separador en ambos lugares)
+_YMD_DATE_RE = re.compile(r'(\d{4})([-/])(\d{1,2})\2(\d{1,2})')
+_DMY_DATE_RE = re.compile(r'(\d{1,2})([-/])(\d{1,2})\2(\d{4}|\d{2})')
+
+# Campos numéricos de totales y de cada producto
+_TOTAL_NUMERIC_FIELDS = ("subtotal", "total_a_pagar", "iva_0%", "iva_5%", "iva_10%", "total_iva")
+_PRODUCT_NUMERIC_FIELDS = ("cantidad", "precio_unitario", "total")
+
+# Formatos de fecha comunes en facturas paraguayas, para los casos que no cubren las expresiones anteriores
+_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%Y/%m/%d",
+    "%d/%m/%y",
+    "%Y%m%d",
+    "%d-%m-%y"
+)
+
+def _object_schema(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Esquema de un objeto para Structured Outputs: todos los campos obligatorios y ningún otro."""
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+def _text(description: str = "") -> Dict[str, Any]:
+    """Esquema de un texto ("" si no aparece: los datos estructurados no admiten null)."""
+    schema: Dict[str, Any] = {"type": "string"}
+    if description:
+        schema["description"] = description
+    return schema
+
+def _amount(description: str = "") -> Dict[str, Any]:
+    """Esquema de un monto (0 si no aparece)."""
+    schema: Dict[str, Any] = {"type": "number"}
+    if description:
+        schema["description"] = description
+    return schema
+
+# Esquema de la respuesta (Structured Outputs): el modelo devuelve siempre un JSON válido
+# con estos campos, y las descripciones reemplazan la lista de campos del prompt.
+# Los IVA de totales van sin "%" en el nombre; _parse_response los renombra a los alias de TotalesData
+INVOICE_SCHEMA = _object_schema({
+    "fecha": _text("Fecha de emisión"),
+    "ruc_emisor": _text("RUC del emisor, con guion"),
+    "nombre_emisor": _text("Nombre completo de la empresa emisora"),
+    "numero_factura": _text("Número completo, ej. 001-001-0000001"),
+    "monto_total": _amount("Importe total"),
+    "iva": _amount("Importe total del IVA"),
+    "timbrado": _text("Número de timbrado"),
+    "cdc": _text("Código de control CDC"),
+    "ruc_cliente": _text("RUC del cliente, con guion"),
+    "nombre_cliente": _text("Nombre completo del cliente"),
+    "email_cliente": _text(),
+    "condicion_venta": _text("CONTADO o CRÉDITO"),
+    "moneda": _text("Ej. PYG"),
+    "subtotal_exentas": _amount("Monto exento de IVA"),
+    "subtotal_5": _amount("Monto gravado con IVA 5%"),
+    "subtotal_10": _amount("Monto gravado con IVA 10%"),
+    "actividad_economica": _text("Actividad económica del emisor"),
+    "empresa": _object_schema({
+        "nombre": _text(),
+        "ruc": _text(),
+        "direccion": _text(),
+        "telefono": _text(),
+        "actividad_economica": _text()
+    }),
+    "timbrado_data": _object_schema({
+        "nro": _text(),
+        "fecha_inicio_vigencia": _text(),
+        "valido_hasta": _text("Fecha fin de vigencia")
+    }),
+    "factura_data": _object_schema({
+        "contado_nro": _text("Número de factura"),
+        "fecha": _text(),
+        "caja_nro": _text(),
+        "cdc": _text(),
+        "condicion_venta": _text()
+    }),
+    "productos": {
+        "type": "array",
+        "items": _object_schema({
+            "articulo": _text("Descripción del producto o servicio"),
+            "cantidad": _amount(),
+            "precio_unitario": _amount(),
+            "total": _amount()
+        })
+    },
+    "totales": _object_schema({
+        "cantidad_articulos": {"type": "integer"},
+        "subtotal": _amount("Importe antes de impuestos"),
+        "total_a_pagar": _amount(),
+        "iva_0": _amount("Monto exento de IVA"),
+        "iva_5": _amount("Monto gravado al 5%"),
+        "iva_10": _amount("Monto gravado al 10%"),
+        "total_iva": _amount()
+    }),
+    "cliente": _object_schema({
+        "nombre": _text(),
+        "ruc": _text(),
+        "email": _text()
+    })
+})
+
+# Instrucciones de extracción; los campos y su significado están en INVOICE_SCHEMA
+EXTRACTION_PROMPT = (
+    "Extrae los datos de esta factura paraguaya. Revisa todo el documento. "
+    "Montos solo con números, sin símbolos ni separadores de miles (0 si no aparecen). "
+    "Fechas en formato YYYY-MM-DD. Textos que no aparecen: cadena vacía (\"\")."
+)
+
+# Pool de procesos compartido para convertir PDF a imagen: el renderizado es trabajo
+# de CPU que bajo el GIL no escala con los hilos. Se crea al primer uso.
+_RENDER_POOL: Optional[ProcessPoolExecutor] = None
+_RENDER_POOL_LOCK = threading.Lock()
+
+def get_render_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Obtiene el pool de procesos de conversión, creándolo al primer uso.
+    
+    Returns:
+        ProcessPoolExecutor: Pool de procesos o None si está deshabilitado.
+    """
+    global _RENDER_POOL
+    
+    if settings.PDF_RENDER_PROCESSES <= 0:
+        return None
+    
+    with _RENDER_POOL_LOCK:
+        if _RENDER_POOL is None:
+            # spawn: los procesos no heredan a medio usar los hilos del principal (IMAP, logging)
+            _RENDER_POOL = ProcessPoolExecutor(
+                max_workers=settings.PDF_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _RENDER_POOL
+
+def close_render_pool():
+    """Detiene el pool de procesos de conversión de PDF, si existe."""
+    global _RENDER_POOL
+    
+    with _RENDER_POOL_LOCK:
+        pool, _RENDER_POOL = _RENDER_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+atexit.register(close_render_pool)
+
+# Tamaño al que OpenAI reduce las imágenes en detalle alto: lado corto de 768 px, sin pasar de 2048
+IMAGE_SHORT_SIDE = 768
+IMAGE_MAX_SIDE = 2048
+# Calidad JPEG de la página enviada (PyMuPDF usa 95 por defecto)
+JPEG_QUALITY = 75
+
+# Páginas y caracteres de texto que se envían cuando el PDF trae capa de texto
+TEXT_MAX_PAGES = 2
+TEXT_MAX_CHARS = 20000
+
+# Tokens que cuenta OpenAI por una imagen en detalle alto (página A4 escalada a 768x1086: 6 bloques de 512px)
+IMAGE_TOKENS = 85 + 170 * 6
+# En detalle bajo OpenAI ve la imagen a 512x512 y cobra un monto fijo de tokens
+LOW_DETAIL_SIDE = 512
+LOW_DETAIL_IMAGE_TOKENS = 85
+# Dígitos del CDC de una factura electrónica
+CDC_LENGTH = 44
+# Diferencia relativa admitida al cuadrar los montos de una factura leída en detalle
+# bajo (redondeos del IVA por ítem); por encima se reintenta en detalle alto
+AMOUNT_TOLERANCE = 0.01
+
+# Límite de peticiones y tokens por minuto compartido por todos los procesadores,
+# ya que el límite de OpenAI es por API key y no por cliente. Se crea al primer uso.
+_RATE_LIMITER: Optional[RateLimiter] = None
+_RATE_LIMITER_LOCK = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    Obtiene el limitador de peticiones a OpenAI, creándolo al primer uso.
+    
+    Returns:
+        RateLimiter: Limitador compartido.
+    """
+    global _RATE_LIMITER
+    
+    with _RATE_LIMITER_LOCK:
+        if _RATE_LIMITER is None:
+            _RATE_LIMITER = RateLimiter(
+                requests_per_minute=settings.OPENAI_MAX_REQUESTS_PER_MINUTE,
+                tokens_per_minute=settings.OPENAI_MAX_TOKENS_PER_MINUTE
+            )
+        return _RATE_LIMITER
+
+_OPENAI_CLIENT: Optional[OpenAI] = None
+_OPENAI_CLIENT_LOCK = threading.Lock()
+
+def get_openai_client() -> Optional[OpenAI]:
+    """
+    Obtiene el cliente síncrono de OpenAI del proceso, creándolo al primer uso.
+    
+    Todas las instancias de OpenAIProcessor comparten el cliente y, con él, su
+    pool de conexiones: solo la primera petición paga la conexión DNS/TLS.
+    
+    Returns:
+        OpenAI: Cliente compartido o None si no hay API key configurada.
+    """
+    global _OPENAI_CLIENT
+    
+    if not settings.OPENAI_API_KEY:
+        return None
+    
+    with _OPENAI_CLIENT_LOCK:
+        if _OPENAI_CLIENT is None:
+            # Los errores 429 y de conexión se reintentan con espera exponencial dentro del SDK
+            _OPENAI_CLIENT = OpenAI(
+                api_key=settings.OPENAI_API_KEY, http_client=create_http_client(),
+                max_retries=settings.OPENAI_MAX_RETRIES
+            )
+        return _OPENAI_CLIENT
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """
+    Estima los tokens que OpenAI descuenta del límite por una petición de chat:
+    el texto (unos 4 caracteres por token), las imágenes y el máximo de la respuesta.
+    
+    Args:
+        request: Argumentos para chat.completions.create.
+        
+    Returns:
+        int: Tokens estimados.
+    """
+    tokens = request.get("max_tokens", 0)
+    if "response_format" in request:
+        # El esquema de la respuesta también cuenta como tokens de entrada
+        tokens += len(json.dumps(request["response_format"], separators=(",", ":"), ensure_ascii=False)) // 4
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                tokens += len(part["text"]) // 4
+            elif part.get("type") == "image_url":
+                low = part["image_url"].get("detail") == "low"
+                tokens += LOW_DETAIL_IMAGE_TOKENS if low else IMAGE_TOKENS
+    return tokens
+
+def _render_first_page(doc: "fitz.Document", low_detail: bool = False) -> str:
+    """
+    Renderiza la primera página de un PDF abierto como JPEG codificado en base64.
+    
+    Args:
+        doc: Documento abierto con PyMuPDF.
+        low_detail: Renderizar al tamaño del detalle bajo (lado largo de 512 px).
+        
+    Returns:
+        str: Representación base64 de la imagen
+    """
+    page = doc.load_page(0)
+    
+    # Renderizar al tamaño que usa OpenAI: la imagen se reduce para caber en
+    # 2048x2048 y luego hasta que el lado corto mida 768 px; más resolución
+    # solo cuesta tiempo de renderizado y de codificación
+    width, height = page.rect.width, page.rect.height
+    zoom = min(IMAGE_SHORT_SIDE / min(width, height), IMAGE_MAX_SIDE / max(width, height))
+    if low_detail:
+        zoom = LOW_DETAIL_SIDE / max(width, height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    
+    # Convertir a imagen JPEG y codificar a base64
+    img_data = pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+    pix = None
+    return base64.b64encode(img_data).decode('ascii')
+
+def convert_pdf(pdf_path: str, min_text_chars: int = 0, low_detail: bool = False) -> Dict[str, str]:
+    """
+    Prepara el contenido de un PDF para enviarlo a OpenAI: el texto de sus primeras
+    páginas si el PDF lo trae (facturas electrónicas generadas desde el XML), o la
+    primera página como imagen JPEG en base64 (documentos escaneados).
+    
+    Es una función de módulo para poder ejecutarse en el pool de procesos.
+    
+    Args:
+        pdf_path: Ruta al archivo PDF
+        min_text_chars: Caracteres de texto a partir de los cuales se envía el texto
+            en lugar de la imagen (0 para enviar siempre la imagen).
+        low_detail: Renderizar la imagen para el detalle bajo de OpenAI.
+        
+    Returns:
+        Dict: {"text": texto} o {"image": imagen en base64, "detail": "low" o "high"}
+        
+    Raises:
+        Exception: Si el PDF no se puede abrir o renderizar. Enviar el PDF crudo
+            como imagen no sirve, así que el error se propaga al llamador.
+    """
+    with fitz.open(pdf_path) as doc:
+        content = None
+        if min_text_chars > 0:
+            text = "".join(
+                doc.load_page(i).get_text("text") for i in range(min(doc.page_count, TEXT_MAX_PAGES))
+            ).strip()
+            if len(text) >= min_text_chars:
+                content = {"text": text[:TEXT_MAX_CHARS]}
+        
+        if content is None:
+            content = {"image": _render_first_page(doc, low_detail), "detail": "low" if low_detail else "high"}
+    
+    # Liberar la cache de MuPDF para que no crezca con cada documento
+    fitz.TOOLS.store_shrink(100)
+    
+    return content
+
+def create_http_client() -> httpx.Client:
+    """
+    Crea el cliente HTTP síncrono para las llamadas a OpenAI desde los hilos.
+    
+    Igual que el asíncrono: conexiones reutilizadas entre peticiones y HTTP/2,
+    de modo que los hilos del procesamiento de correos comparten pocas conexiones.
+    
+    Returns:
+        httpx.Client: Cliente HTTP síncrono.
+    """
+    return httpx.Client(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+
+def create_async_http_client() -> httpx.AsyncClient:
+    """
+    Crea el cliente HTTP asíncrono compartido para las llamadas a OpenAI.
+    
+    Mantiene las conexiones TCP/TLS abiertas entre peticiones y multiplexa
+    las llamadas concurrentes sobre HTTP/2.
+    
+    Returns:
+        httpx.AsyncClient: Cliente HTTP asíncrono.
+    """
+    return httpx.AsyncClient(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+
 class OpenAIProcessor:
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
         """
         Inicializa el procesador de OpenAI.
+        
+        Args:
+            http_client: Cliente HTTP asíncrono compartido (opcional). Si no se
+                proporciona, se crea uno propio al primer uso.
         """
         # Configurar la API key de OpenAI
         self.api_key = settings.OPENAI_API_KEY
-        # Configurar la API key globalmente para el módulo openai
-        openai.api_key = self.api_key
+        self.http_client = http_client
+        
+        # Clientes de OpenAI: el síncrono es el compartido por todo el proceso y el
+        # asíncrono se crea al primer uso sobre el cliente HTTP compartido
+        self.client = get_openai_client()
+        self._async_client = None
+        self._owns_http_client = False
+        
+        # Límite de peticiones simultáneas a OpenAI: el síncrono para los hilos del
+        # procesamiento de correos y el asíncrono (creado en el event loop) para la API
+        self._request_slots = threading.BoundedSemaphore(settings.OPENAI_CONCURRENCY)
+        self._async_request_slots: Optional[asyncio.Semaphore] = None
         
         # Verificar que la API key esté configurada
         if not self.api_key:
             logger.warning("No se ha configurado la API key de OpenAI. La extracción de datos no funcionará correctamente.")
     
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Cliente asíncrono de OpenAI sobre el cliente HTTP compartido."""
+        if self._async_client is None:
+            if self.http_client is None:
+                self.http_client = create_async_http_client()
+                self._owns_http_client = True
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key, http_client=self.http_client, max_retries=settings.OPENAI_MAX_RETRIES
+            )
+        return self._async_client
+    
+    @property
+    def prompt_version(self) -> str:
+        """
+        Versión de la extracción: hash de las peticiones sin contenido (modelos,
+        prompt y parámetros). Cambia al editar el prompt, de modo que la cache de facturas
+        no reutiliza datos extraídos con uno anterior.
+        """
+        requests = [self._build_request({"image": ""}), self._build_request({"text": ""})]
+        request = json.dumps(requests, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()[:16]
+    
+    def set_http_client(self, http_client: httpx.AsyncClient):
+        """
+        Reemplaza el cliente HTTP asíncrono usado para las llamadas a OpenAI.
+        
+        Args:
+            http_client: Cliente HTTP asíncrono compartido.
+        """
+        self.http_client = http_client
+        self._async_client = None
+        self._owns_http_client = False
+    
+    async def aclose(self):
+        """Cierra el cliente HTTP asíncrono si fue creado por este procesador."""
+        if self._owns_http_client and self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+            self._async_client = None
+            self._owns_http_client = False
+    
     def extract_invoice_data(self, pdf_path: str, email_metadata: Dict[str, Any] = None) -> InvoiceData:
         """
         Extrae datos de factura de un PDF utilizando OpenAI.
@@ -42,32 +444,85 @@ class OpenAIProcessor:
         Returns:
             InvoiceData: Objeto con los datos extraídos.
         """
-        # Crear objeto de datos de factura
-        invoice_data = InvoiceData()
-        
-        # Establecer el origen del email si existe
-        if email_metadata and "sender" in email_metadata:
-            invoice_data.email_origen = email_metadata.get("sender", "")
-        
-        # Establecer la ruta del PDF si existe
-        invoice_data.pdf_path = pdf_path
-        
         try:
             # Extraer contenido del PDF usando directamente OpenAI
             extracted_data = self._process_pdf_with_openai(pdf_path, email_metadata)
+        except Exception as e:
+            logger.error(f"Error al procesar PDF con OpenAI: {str(e)}")
+            extracted_data = {}
+        
+        return self._build_invoice(pdf_path, email_metadata, extracted_data)
+    
+    async def aextract_invoice_data(self, pdf_path: str, email_metadata: Dict[str, Any] = None) -> InvoiceData:
+        """
+        Versión asíncrona de extract_invoice_data, usada desde los endpoints de la API.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            email_metadata: Metadatos del correo de donde se extrajo la factura.
             
-            if extracted_data:
-                # Actualizar el objeto de factura con los datos extraídos
-                for key, value in extracted_data.items():
-                    if hasattr(invoice_data, key):
-                        setattr(invoice_data, key, value)
-            
-            logger.info(f"Datos extraídos con OpenAI: {invoice_data}")
-            return invoice_data
-            
+        Returns:
+            InvoiceData: Objeto con los datos extraídos.
+        """
+        try:
+            extracted_data = await self._aprocess_pdf_with_openai(pdf_path, email_metadata)
         except Exception as e:
             logger.error(f"Error al procesar PDF con OpenAI: {str(e)}")
-            return invoice_data
+            extracted_data = {}
+        
+        return self._build_invoice(pdf_path, email_metadata, extracted_data)
+    
+    async def aextract_many(self, pdf_paths: List[str], email_metadata: Dict[str, Any] = None) -> List[InvoiceData]:
+        """
+        Extrae los datos de varias facturas con peticiones concurrentes a OpenAI.
+        
+        Todas las extracciones se lanzan a la vez; el semáforo de peticiones limita
+        cuántas llegan a OpenAI simultáneamente (OPENAI_CONCURRENCY), de modo que el
+        tiempo total se acerca al de la petición más lenta en lugar de la suma.
+        
+        Args:
+            pdf_paths: Rutas de los archivos PDF.
+            email_metadata: Metadatos del correo, comunes a todos los PDFs.
+        
+        Returns:
+            List[InvoiceData]: Datos extraídos, en el mismo orden que pdf_paths.
+        """
+        return list(await asyncio.gather(
+            *(self.aextract_invoice_data(pdf_path, email_metadata) for pdf_path in pdf_paths)
+        ))
+    
+    def _build_invoice(self, pdf_path: str, email_metadata: Optional[Dict[str, Any]], extracted_data: Dict[str, Any]) -> InvoiceData:
+        """
+        Construye el objeto de factura a partir de los datos extraídos.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            email_metadata: Metadatos del correo.
+            extracted_data: Datos devueltos por OpenAI.
+            
+        Returns:
+            InvoiceData: Objeto con los datos extraídos.
+        """
+        # Origen del email y ruta del PDF
+        source: Dict[str, Any] = {"pdf_path": pdf_path}
+        if email_metadata and "sender" in email_metadata:
+            source["email_origen"] = email_metadata.get("sender", "")
+        
+        # Los datos extraídos se validan (no se asignan con setattr): empresa, cliente,
+        # productos, etc. quedan como modelos y la factura se puede volver a leer
+        # desde la cache o el journal. Los campos inválidos se descartan
+        data = {**extracted_data, **source} if extracted_data else source
+        try:
+            invoice_data = InvoiceData.model_validate(data)
+        except ValidationError as e:
+            invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+            logger.warning(f"Datos extraídos con OpenAI no válidos, se omiten: {', '.join(sorted(map(str, invalid)))}")
+            invoice_data = InvoiceData.model_validate({key: value for key, value in data.items() if key not in invalid})
+        
+        logger.info(f"Factura extraída con OpenAI: {invoice_data.numero_factura or 'sin número'} ({pdf_path})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Datos extraídos con OpenAI: {invoice_data}")
+        return invoice_data
     
     def _process_pdf_with_openai(self, pdf_path: str, email_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -80,254 +535,416 @@ class OpenAIProcessor:
         Returns:
             Dict: Datos extraídos de la factura.
         """
+        content = self._prepare_content(pdf_path, settings.OPENAI_IMAGE_LOW_DETAIL_FIRST)
+        if content is None:
+            return {}
+        
+        extracted_data = self._request_extraction(content)
+        if content.get("detail") == "low" and self._needs_high_detail(extracted_data):
+            logger.info(f"Datos incompletos con la imagen en detalle bajo, se reintenta en detalle alto: {pdf_path}")
+            content = self._prepare_content(pdf_path)
+            if content is not None:
+                extracted_data = self._request_extraction(content)
+        return extracted_data
+    
+    def _request_extraction(self, content: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Envía a OpenAI el contenido de una factura e interpreta la respuesta.
+        
+        Args:
+            content: Texto o imagen de la factura (ver convert_pdf).
+            
+        Returns:
+            Dict: Datos extraídos de la factura (vacío si la petición falla).
+        """
+        # Hacer la petición a OpenAI, esperando antes si se agotó el límite por minuto
+        request = self._build_request(content)
+        try:
+            with self._request_slots:
+                get_rate_limiter().acquire(estimate_request_tokens(request))
+                response = self.client.chat.completions.create(**request)
+        except Exception as e:
+            logger.error(f"Error al hacer la petición a OpenAI: {str(e)}")
+            return {}
+        
+        return self._read_response(response)
+    
+    async def _aprocess_pdf_with_openai(self, pdf_path: str, email_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Versión asíncrona de _process_pdf_with_openai.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            email_metadata: Metadatos del email.
+            
+        Returns:
+            Dict: Datos extraídos de la factura.
+        """
+        content = await self._aprepare_content(pdf_path, settings.OPENAI_IMAGE_LOW_DETAIL_FIRST)
+        if content is None:
+            return {}
+        
+        extracted_data = await self._arequest_extraction(content)
+        if content.get("detail") == "low" and self._needs_high_detail(extracted_data):
+            logger.info(f"Datos incompletos con la imagen en detalle bajo, se reintenta en detalle alto: {pdf_path}")
+            content = await self._aprepare_content(pdf_path)
+            if content is not None:
+                extracted_data = await self._arequest_extraction(content)
+        return extracted_data
+    
+    async def _arequest_extraction(self, content: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Versión asíncrona de _request_extraction.
+        
+        Args:
+            content: Texto o imagen de la factura (ver convert_pdf).
+            
+        Returns:
+            Dict: Datos extraídos de la factura (vacío si la petición falla).
+        """
+        if self._async_request_slots is None:
+            self._async_request_slots = asyncio.Semaphore(settings.OPENAI_CONCURRENCY)
+        
+        request = self._build_request(content)
+        try:
+            async with self._async_request_slots:
+                await get_rate_limiter().aacquire(estimate_request_tokens(request))
+                response = await self.async_client.chat.completions.create(**request)
+        except Exception as e:
+            logger.error(f"Error al hacer la petición a OpenAI: {str(e)}")
+            return {}
+        
+        return self._read_response(response)
+    
+    def _prepare_content(self, pdf_path: str, low_detail: bool = False) -> Optional[Dict[str, str]]:
+        """
+        Valida la configuración y el archivo, y obtiene el texto del PDF o su imagen.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            low_detail: Renderizar la imagen para el detalle bajo de OpenAI.
+            
+        Returns:
+            Dict: Contenido a enviar (ver convert_pdf) o None si no se puede procesar.
+        """
+        if not self._can_process(pdf_path):
+            return None
+        
+        try:
+            return self._convert_pdf(pdf_path, low_detail)
+        except Exception as e:
+            logger.error(f"Error al procesar el PDF: {str(e)}")
+            return None
+    
+    async def _aprepare_content(self, pdf_path: str, low_detail: bool = False) -> Optional[Dict[str, str]]:
+        """
+        Versión asíncrona de _prepare_content.
+        
+        La conversión se espera directamente sobre el pool de procesos, sin ocupar
+        un hilo por PDF mientras dura el renderizado; así los PDFs se renderizan
+        en paralelo mientras las peticiones anteriores esperan a OpenAI.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            low_detail: Renderizar la imagen para el detalle bajo de OpenAI.
+            
+        Returns:
+            Dict: Contenido a enviar (ver convert_pdf) o None si no se puede procesar.
+        """
+        if not self._can_process(pdf_path):
+            return None
+        
+        try:
+            # Pool caído o cerrado: convertir en un hilo. Los errores del propio PDF
+            # (RuntimeError en PyMuPDF) se propagan sin reintentar
+            pool = get_render_pool()
+            if pool is not None:
+                try:
+                    future = asyncio.get_running_loop().run_in_executor(
+                        pool, convert_pdf, pdf_path, settings.PDF_TEXT_MIN_CHARS, low_detail
+                    )
+                except (BrokenProcessPool, RuntimeError) as e:
+                    logger.warning(f"Pool de conversión no disponible, se convierte en un hilo: {str(e)}")
+                else:
+                    try:
+                        return await future
+                    except BrokenProcessPool as e:
+                        logger.warning(f"Pool de conversión no disponible, se convierte en un hilo: {str(e)}")
+            
+            # La conversión es trabajo de CPU: sin pool se hace en un hilo
+            return await asyncio.to_thread(convert_pdf, pdf_path, settings.PDF_TEXT_MIN_CHARS, low_detail)
+        except Exception as e:
+            logger.error(f"Error al procesar el PDF: {str(e)}")
+            return None
+    
+    def _can_process(self, pdf_path: str) -> bool:
+        """
+        Valida la configuración y que el archivo exista.
+        
+        Args:
+            pdf_path: Ruta al archivo PDF.
+            
+        Returns:
+            bool: True si se puede enviar el PDF a OpenAI.
+        """
         if not self.api_key:
             logger.error("No se ha configurado la API key de OpenAI")
-            return {}
+            return False
         
         if not os.path.exists(pdf_path):
             logger.error(f"El archivo PDF {pdf_path} no existe")
-            return {}
+            return False
         
-        try:
-            # Convertir PDF a imagen para mejor procesamiento
-            image_data = self._convert_pdf_to_image(pdf_path)
-
-            # Prompt mejorado para el análisis de facturas
-            prompt_text = """Analiza cuidadosamente esta factura y extrae TODOS los siguientes campos (es muy importante que devuelvas TODOS los campos, incluso si están vacíos):
-
-            1. fecha: Fecha de emisión (formato YYYY-MM-DD)
-            2. ruc_emisor: RUC del emisor (con guiones)
-            3. nombre_emisor: Nombre completo de la empresa
-            4. numero_factura: Número completo (ej: 001-001-0000001)
-            5. monto_total: Importe total (solo números)
-            6. iva: Importe total del IVA (solo números)
-            7. timbrado: Número de timbrado
-            8. cdc: Código de control CDC
-            9. ruc_cliente: RUC del cliente (con guiones)
-            10. nombre_cliente: Nombre completo del cliente
-            11. email_cliente: Email del cliente
-            12. condicion_venta: CONTADO o CRÉDITO
-            13. moneda: Tipo de moneda (ej: PYG)
-            14. subtotal_exentas: Monto exento de IVA (solo números)
-            15. subtotal_5: Monto gravado IVA 5% (solo números)
-            16. subtotal_10: Monto gravado IVA 10% (solo números)
-            17. actividad_economica: Actividad económica del emisor
-
-            Además, quiero que extraigas la información en un formato estructurado:
-
-            empresa: {
-                nombre: Nombre de la empresa emisora,
-                ruc: RUC de la empresa,
-                direccion: Dirección completa,
-                telefono: Teléfono de contacto,
-                actividad_economica: Actividad económica
-            },
-            timbrado_data: {
-                nro: Número de timbrado,
-                fecha_inicio_vigencia: Fecha de inicio vigencia,
-                valido_hasta: Fecha fin vigencia
-            },
-            factura_data: {
-                contado_nro: Número de factura,
-                fecha: Fecha de emisión,
-                caja_nro: Número de caja,
-                cdc: Código CDC,
-                condicion_venta: CONTADO o CRÉDITO
-            },
-            productos: [
+        return True
+    
+    def _build_request(self, content: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Construye los parámetros de la petición de chat para una factura.
+        
+        El texto de los PDFs que lo traen se envía a un modelo más económico
+        (OPENAI_TEXT_MODEL); la imagen de los escaneados, al modelo con visión.
+        
+        Args:
+            content: Texto o imagen de la factura (ver convert_pdf).
+            
+        Returns:
+            Dict: Argumentos para chat.completions.create.
+        """
+        if "text" in content:
+            model = settings.OPENAI_TEXT_MODEL
+            parts = [{"type": "text", "text": f"Texto de la factura:\n{content['text']}"}]
+        else:
+            model = "gpt-4o"
+            parts = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{content['image']}",
+                        "detail": content.get("detail", "high")
+                    }
+                }
+            ]
+        
+        return {
+            "model": model,
+            # Las instrucciones van primero y son idénticas en todas las peticiones, de
+            # modo que OpenAI puede reutilizar ese prefijo (prompt caching); lo que
+            # cambia por factura va al final
+            "messages": [
                 {
-                    articulo: Descripción del producto/servicio,
-                    cantidad: Cantidad (número),
-                    precio_unitario: Precio unitario (número),
-                    total: Importe total (número)
+                    "role": "system",
+                    "content": EXTRACTION_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": parts
                 }
             ],
-            totales: {
-                cantidad_articulos: Cantidad total de ítems,
-                subtotal: Importe antes de impuestos,
-                total_a_pagar: Importe total a pagar,
-                iva_0%: Monto exento de IVA,
-                iva_5%: Monto gravado al 5%,
-                iva_10%: Monto gravado al 10%,
-                total_iva: Suma total del IVA
-            },
-            cliente: {
-                nombre: Nombre del cliente,
-                ruc: RUC del cliente,
-                email: Email del cliente
+            "max_tokens": settings.OPENAI_MAX_TOKENS,
+            "temperature": 0.3,
+            # El modelo responde solo con un objeto JSON que cumple el esquema
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "factura", "schema": INVOICE_SCHEMA, "strict": True}
             }
-
-            REGLAS IMPORTANTES:
-            - TODOS los campos son obligatorios. Si no encuentras el valor, devuelve null para texto o 0 para números
-            - Para montos, devuelve SOLO NÚMEROS sin símbolos ni separadores de miles
-            - Las fechas deben estar en formato YYYY-MM-DD
-            - Si el campo está vacío o no lo encuentras, devuelve null o 0 según corresponda
-            - Revisa TODO el documento, los campos pueden estar en cualquier lugar
-            - NO omitas ningún campo en la respuesta
-
-            FORMATO DE RESPUESTA:
-            Debes responder SOLO con un objeto JSON que contenga TODOS los campos listados arriba, sin explicaciones adicionales."""
-
-            # Hacer la petición a GPT-4 Vision
+        }
+    
+    def _read_response(self, response: Any) -> Dict[str, Any]:
+        """
+        Registra los tokens consumidos por una respuesta de chat e interpreta su contenido.
+        
+        Args:
+            response: Respuesta de chat.completions.create.
+            
+        Returns:
+            Dict: Datos extraídos de la factura.
+        """
+        usage = response.usage
+        if usage is not None:
+            # prompt_tokens_details no está declarado en todas las versiones del SDK
+            details = getattr(usage, "prompt_tokens_details", None) or {}
+            cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+            logger.info(
+                f"Tokens de OpenAI: {usage.prompt_tokens} de entrada ({cached or 0} en cache), "
+                f"{usage.completion_tokens} de salida"
+            )
+        
+        if response.choices[0].finish_reason == "length":
+            logger.warning(
+                f"La respuesta de OpenAI se cortó en {settings.OPENAI_MAX_TOKENS} tokens (OPENAI_MAX_TOKENS); "
+                "el JSON puede quedar incompleto"
+            )
+        
+        return self._parse_response(response.choices[0].message.content)
+    
+    def _parse_response(self, result: str) -> Dict[str, Any]:
+        """
+        Interpreta la respuesta de OpenAI y normaliza los datos extraídos.
+        
+        Args:
+            result: Contenido de texto devuelto por el modelo.
+            
+        Returns:
+            Dict: Datos extraídos de la factura.
+        """
+        try:
+            # Parsear el JSON y procesar los datos. Con response_format la respuesta es
+            # JSON puro; si viene con texto o backticks alrededor, se toma del primer
+            # "{" al último "}". orjson.JSONDecodeError hereda de json.JSONDecodeError
             try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": prompt_text
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{image_data}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=1000,
-                    temperature=0.3
-                )
-
-                result = response['choices'][0]['message']['content']
-                try:
-                    # Extraer el JSON si está dentro de backticks
-                    json_match = None
-                    if "```json" in result:
-                        json_match = re.search(r'```json\n(.*?)\n```', result, re.DOTALL)
-                    elif "```" in result:
-                        json_match = re.search(r'```\n(.*?)\n```', result, re.DOTALL)
-                    
-                    if json_match:
-                        result = json_match.group(1)
-                    
-                    # Parsear el JSON y procesar los datos
-                    result_json = json.loads(result)
-                    
-                    # Procesar y validar los datos extraídos
-                    processed_data = {}
-                    
-                    # Procesar fecha
-                    fecha_str = result_json.get("fecha")
-                    if fecha_str:
-                        fecha = self._parse_date(fecha_str)
-                        if fecha:
-                            processed_data["fecha"] = fecha
-                    
-                    # Procesar campos de texto
-                    text_fields = [
-                        "nombre_emisor", "numero_factura",
-                        "timbrado", "cdc", "nombre_cliente",
-                        "email_cliente", "condicion_venta", "actividad_economica"
-                    ]
-                    for field in text_fields:
-                        value = result_json.get(field)
-                        if value and isinstance(value, str):
-                            processed_data[field] = value.strip()
-                    
-                    # Procesar RUCs (mantener con guiones si existen)
-                    ruc_fields = ["ruc_emisor", "ruc_cliente"]
-                    for field in ruc_fields:
-                        value = result_json.get(field)
-                        if value and isinstance(value, str):
-                            # Agregar guiones al RUC si no los tiene
-                            if "-" not in value and len(value) > 1:
-                                # Para RUCs de empresas (8 dígitos + DV)
-                                if len(value) >= 8:
-                                    processed_data[field] = f"{value[:-1]}-{value[-1]}"
-                                else:
-                                    # Para RUCs de personas (6-7 dígitos + DV)
-                                    processed_data[field] = f"{value[:-1]}-{value[-1]}"
-                            else:
-                                processed_data[field] = value.strip()
-                    
-                    # Procesar campos numéricos
-                    numeric_fields = [
-                        "monto_total", "iva", "subtotal_exentas",
-                        "subtotal_5", "subtotal_10"
-                    ]
-                    for field in numeric_fields:
-                        value = self._convert_to_number(result_json.get(field))
-                        if value is not None:
-                            processed_data[field] = value
-                        else:
-                            processed_data[field] = 0.0
-                    
-                    # Establecer moneda por defecto
-                    processed_data["moneda"] = result_json.get("moneda", "PYG")
-                    
-                    # Procesar datos estructurados
-                    # Empresa
-                    if "empresa" in result_json:
-                        empresa_data = result_json["empresa"]
-                        # Asegurar que el RUC tenga guiones
-                        if "ruc" in empresa_data and "-" not in empresa_data["ruc"] and len(empresa_data["ruc"]) > 1:
-                            if len(empresa_data["ruc"]) >= 8:  # RUC de empresa
-                                empresa_data["ruc"] = f"{empresa_data['ruc'][:-1]}-{empresa_data['ruc'][-1]}"
-                            else:  # RUC de persona
-                                empresa_data["ruc"] = f"{empresa_data['ruc'][:-1]}-{empresa_data['ruc'][-1]}"
-                        processed_data["empresa"] = empresa_data
-                    
-                    # Cliente
-                    if "cliente" in result_json:
-                        cliente_data = result_json["cliente"]
-                        # Asegurar que el RUC tenga guiones
-                        if "ruc" in cliente_data and "-" not in cliente_data["ruc"] and len(cliente_data["ruc"]) > 1:
-                            if len(cliente_data["ruc"]) >= 8:  # RUC de empresa
-                                cliente_data["ruc"] = f"{cliente_data['ruc'][:-1]}-{cliente_data['ruc'][-1]}"
-                            else:  # RUC de persona
-                                cliente_data["ruc"] = f"{cliente_data['ruc'][:-1]}-{cliente_data['ruc'][-1]}"
-                        processed_data["cliente"] = cliente_data
-                    
-                    # Otros datos estructurados
-                    other_structured_fields = ["timbrado_data", "factura_data", "totales", "productos"]
-                    for field in other_structured_fields:
-                        if field in result_json:
-                            processed_data[field] = result_json[field]
-                    
-                    # Convertir campos numéricos en totales
-                    if "totales" in processed_data:
-                        numeric_total_fields = ["subtotal", "total_a_pagar", "iva_0%", "iva_5%", "iva_10%", "total_iva"]
-                        for field in numeric_total_fields:
-                            field_key = field
-                            if field in processed_data["totales"]:
-                                value = self._convert_to_number(processed_data["totales"][field])
-                                if value is not None:
-                                    processed_data["totales"][field] = value
-                            
-                    # Convertir campos numéricos en productos
-                    if "productos" in processed_data and isinstance(processed_data["productos"], list):
-                        for producto in processed_data["productos"]:
-                            numeric_product_fields = ["cantidad", "precio_unitario", "total"]
-                            for field in numeric_product_fields:
-                                if field in producto:
-                                    value = self._convert_to_number(producto[field])
-                                    if value is not None:
-                                        producto[field] = value
-                    
-                    logger.debug(f"Datos extraídos y procesados: {processed_data}")
-                    
-                    # Registrar datos procesados en formato legible
-                    logger.info(f"Datos procesados: {json.dumps(processed_data, indent=2, default=str)}")
-                    
-                    return processed_data
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error al parsear JSON de la respuesta de OpenAI: {str(e)}")
-                    return {}
-                    
-            except Exception as e:
-                logger.error(f"Error al hacer la petición a OpenAI: {str(e)}")
-                return {}
-                
+                result_json = orjson.loads(result)
+            except orjson.JSONDecodeError:
+                start, end = result.find("{"), result.rfind("}")
+                if start == -1 or end < start:
+                    raise
+                result_json = orjson.loads(result[start:end + 1])
+            
+            # Procesar y validar los datos extraídos
+            processed_data = {}
+            
+            # Procesar fecha
+            fecha_str = result_json.get("fecha")
+            if fecha_str:
+                fecha = self._parse_date(fecha_str)
+                if fecha:
+                    processed_data["fecha"] = fecha
+            
+            # Procesar campos de texto
+            text_fields = [
+                "nombre_emisor", "numero_factura",
+                "timbrado", "cdc", "nombre_cliente",
+                "email_cliente", "condicion_venta", "actividad_economica"
+            ]
+            for field in text_fields:
+                value = result_json.get(field)
+                if value and isinstance(value, str):
+                    processed_data[field] = value.strip()
+            
+            # Procesar RUCs (mantener con guiones si existen)
+            for field in ("ruc_emisor", "ruc_cliente"):
+                value = result_json.get(field)
+                if value and isinstance(value, str):
+                    processed_data[field] = self._format_ruc(value)
+            
+            # Procesar campos numéricos
+            numeric_fields = [
+                "monto_total", "iva", "subtotal_exentas",
+                "subtotal_5", "subtotal_10"
+            ]
+            for field in numeric_fields:
+                value = self._convert_to_number(result_json.get(field))
+                if value is not None:
+                    processed_data[field] = value
+                else:
+                    processed_data[field] = 0.0
+            
+            # Establecer moneda por defecto
+            processed_data["moneda"] = result_json.get("moneda") or "PYG"
+            
+            # Procesar datos estructurados: empresa y cliente, con el RUC con guion
+            for field in ("empresa", "cliente"):
+                if field in result_json:
+                    data = result_json[field]
+                    ruc = data.get("ruc")
+                    if ruc and isinstance(ruc, str):
+                        data["ruc"] = self._format_ruc(ruc)
+                    processed_data[field] = data
+            
+            # Otros datos estructurados
+            other_structured_fields = ["timbrado_data", "factura_data", "totales", "productos"]
+            for field in other_structured_fields:
+                if field in result_json:
+                    processed_data[field] = result_json[field]
+            
+            # Campos numéricos de totales y productos: se juntan todas las referencias
+            # (diccionario, campo) y se convierten en una sola pasada
+            numeric_refs = []
+            if isinstance(processed_data.get("totales"), dict):
+                totales = processed_data["totales"]
+                # El esquema nombra los IVA sin "%"; TotalesData los espera con "%"
+                for field in ("iva_0", "iva_5", "iva_10"):
+                    if field in totales:
+                        totales[f"{field}%"] = totales.pop(field)
+                numeric_refs += [(totales, field) for field in _TOTAL_NUMERIC_FIELDS if field in totales]
+            if isinstance(processed_data.get("productos"), list):
+                numeric_refs += [
+                    (producto, field)
+                    for producto in processed_data["productos"] if isinstance(producto, dict)
+                    for field in _PRODUCT_NUMERIC_FIELDS if field in producto
+                ]
+            values = [self._convert_to_number(container[field]) for container, field in numeric_refs]
+            for (container, field), value in zip(numeric_refs, values):
+                if value is not None:
+                    container[field] = value
+            
+            # Registrar datos procesados en formato legible (solo en depuración: el
+            # f-string se evaluaría aunque el nivel de log descarte el mensaje)
+            if logger.isEnabledFor(logging.DEBUG):
+                dump = orjson.dumps(processed_data, default=str, option=orjson.OPT_INDENT_2).decode()
+                logger.debug(f"Datos procesados: {dump}")
+            
+            return processed_data
+            
+        except json.JSONDecodeError as e:
+            logger.error(f"Error al parsear JSON de la respuesta de OpenAI: {str(e)}")
+            return {}
         except Exception as e:
-            logger.error(f"Error al procesar el PDF: {str(e)}")
+            logger.error(f"Error al interpretar la respuesta de OpenAI: {str(e)}")
             return {}
     
+    @staticmethod
+    def _needs_high_detail(extracted_data: Dict[str, Any]) -> bool:
+        """
+        Indica si los datos extraídos de una imagen en detalle bajo están incompletos
+        o no son creíbles: falta el número o el monto de la factura, el CDC (letra
+        pequeña) vino cortado, o los montos no cuadran entre sí (dígitos mal leídos).
+        
+        Un CDC ausente no basta para reintentar: las facturas preimpresas no lo tienen.
+        En Paraguay los subtotales gravados incluyen el IVA: su suma con el exento es
+        el total, y el IVA es 1/21 del gravado al 5% más 1/11 del gravado al 10%.
+        
+        Args:
+            extracted_data: Datos devueltos por _parse_response.
+            
+        Returns:
+            bool: True si conviene reintentar con la imagen en detalle alto.
+        """
+        if not extracted_data.get("numero_factura") or not extracted_data.get("monto_total"):
+            return True
+        cdc = extracted_data.get("cdc")
+        if cdc and len(_NON_NUMERIC_RE.sub("", cdc)) < CDC_LENGTH:
+            return True
+        
+        exentas = extracted_data.get("subtotal_exentas") or 0.0
+        gravado_5 = extracted_data.get("subtotal_5") or 0.0
+        gravado_10 = extracted_data.get("subtotal_10") or 0.0
+        if not (exentas or gravado_5 or gravado_10):
+            return False
+        
+        total = extracted_data["monto_total"]
+        if abs(exentas + gravado_5 + gravado_10 - total) > max(1.0, total * AMOUNT_TOLERANCE):
+            return True
+        
+        iva = extracted_data.get("iva") or 0.0
+        expected_iva = gravado_5 / 21 + gravado_10 / 11
+        return bool(iva) and abs(iva - expected_iva) > max(1.0, expected_iva * AMOUNT_TOLERANCE)
+    
+    @staticmethod
+    def _format_ruc(value: str) -> str:
+        """
+        Agrega el guion antes del dígito verificador de un RUC que no lo tiene.
+        
+        Args:
+            value: RUC tal como lo devolvió el modelo.
+            
+        Returns:
+            str: RUC con guion (p. ej. "80012345-6").
+        """
+        value = value.strip()
+        if "-" in value or len(value) < 2:
+            return value
+        return f"{value[:-1]}-{value[-1]}"
+    
     def _convert_to_number(self, value: Any) -> Optional[float]:
         """
         Convierte un valor a número, eliminando caracteres no numéricos.
@@ -347,10 +964,10 @@ class OpenAIProcessor:
         try:
             # Eliminar caracteres no numéricos excepto el punto decimal y la coma
             cleaned = str(value).replace(',', '.')
-            cleaned = re.sub(r'[^\d.]', '', cleaned)
+            cleaned = _NON_NUMERIC_RE.sub('', cleaned)
             if cleaned:
                 return float(cleaned)
-        except:
+        except ValueError:
             pass
             
         return None
@@ -371,18 +988,24 @@ class OpenAIProcessor:
         # Limpiar la cadena de fecha
         date_str = date_str.strip()
         
-        # Lista de formatos de fecha comunes en facturas paraguayas
-        formats = [
-            "%Y-%m-%d",
-            "%d/%m/%Y",
-            "%d-%m-%Y",
-            "%Y/%m/%d",
-            "%d/%m/%y",
-            "%Y%m%d",
-            "%d-%m-%y"
-        ]
-        
-        for fmt in formats:
+        # Caso habitual: construir la fecha directamente, sin interpretar formatos con strptime
+        match = _YMD_DATE_RE.fullmatch(date_str)
+        if match:
+            year, month, day = int(match.group(1)), int(match.group(3)), int(match.group(4))
+        else:
+            match = _DMY_DATE_RE.fullmatch(date_str)
+            if match:
+                day, month, year = int(match.group(1)), int(match.group(3)), int(match.group(4))
+                if len(match.group(4)) == 2:
+                    # Mismo criterio que %y: 69-99 son 1969-1999 y 00-68 son 2000-2068
+                    year += 1900 if year >= 69 else 2000
+        if match:
+            try:
+                return datetime(year, month, day)
+            except ValueError:
+                pass
+        
+        for fmt in _DATE_FORMATS:
             try:
                 return datetime.strptime(date_str, fmt)
             except ValueError:
@@ -390,35 +1013,30 @@ class OpenAIProcessor:
                 
         return None
 
-    def _convert_pdf_to_image(self, pdf_path: str) -> str:
+    def _convert_pdf(self, pdf_path: str, low_detail: bool = False) -> Dict[str, str]:
         """
-        Convierte la primera página de un PDF a una imagen codificada en base64.
+        Obtiene el texto del PDF o su primera página como imagen (ver convert_pdf),
+        usando el pool de procesos si está habilitado.
         
         Args:
             pdf_path: Ruta al archivo PDF
+            low_detail: Renderizar la imagen para el detalle bajo de OpenAI.
             
         Returns:
-            str: Representación base64 de la imagen
+            Dict: {"text": texto} o {"image": imagen en base64, "detail": "low" o "high"}
         """
-        try:
-            # Abrir el PDF
-            doc = fitz.open(pdf_path)
-            
-            # Obtener la primera página
-            page = doc[0]
-            
-            # Renderizar página a un pixmap (establecer una resolución decente, 300 DPI)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            
-            # Convertir a imagen PIL
-            img_data = pix.tobytes("jpeg")
-            
-            # Codificar a base64
-            return base64.b64encode(img_data).decode('utf-8')
-            
-        except Exception as e:
-            logger.error(f"Error al convertir PDF a imagen: {str(e)}")
-            
-            # Fallback: intentar leer el PDF directamente como bytes
-            with open(pdf_path, "rb") as f:
-                return base64.b64encode(f.read()).decode('utf-8')
+        pool = get_render_pool()
+        if pool is not None:
+            # Pool caído o cerrado: convertir en este mismo proceso. Los errores del
+            # propio PDF (RuntimeError en PyMuPDF) se propagan sin reintentar
+            try:
+                future = pool.submit(convert_pdf, pdf_path, settings.PDF_TEXT_MIN_CHARS, low_detail)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f"Pool de conversión no disponible, se convierte en el proceso principal: {str(e)}")
+            else:
+                try:
+                    return future.result()
+                except BrokenProcessPool as e:
+                    logger.warning(f"Pool de conversión no disponible, se convierte en el proceso principal: {str(e)}")
+        
+        return convert_pdf(pdf_path, settings.PDF_TEXT_MIN_CHARS, low_detail)
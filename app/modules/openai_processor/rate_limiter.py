@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+class RateLimiter:
+    """
+    Límite de peticiones y de tokens por minuto hacia la API de OpenAI.
+    
+    La capacidad de cada presupuesto se repone de forma continua (1/60 del límite
+    por segundo) y cada petición descuenta una unidad de peticiones y sus tokens
+    estimados. Si no alcanza, quien pide espera lo justo para que se reponga, en
+    lugar de enviar la petición y recibir un error 429.
+    
+    Se puede usar desde hilos (acquire) y desde el event loop (aacquire); ambos
+    comparten los mismos presupuestos.
+    """
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        """
+        Inicializa el limitador.
+        
+        Args:
+            requests_per_minute: Peticiones por minuto permitidas (0 sin límite).
+            tokens_per_minute: Tokens por minuto permitidos (0 sin límite).
+        """
+        self.requests_per_minute = max(requests_per_minute, 0)
+        self.tokens_per_minute = max(tokens_per_minute, 0)
+        self._request_capacity = float(self.requests_per_minute)
+        self._token_capacity = float(self.tokens_per_minute)
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        """Indica si hay algún límite configurado."""
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+    
+    def _reserve(self, tokens: int) -> float:
+        """
+        Repone la capacidad según el tiempo transcurrido y, si alcanza, descuenta
+        una petición y sus tokens.
+        
+        Args:
+            tokens: Tokens estimados de la petición.
+        
+        Returns:
+            float: 0 si se reservó la capacidad; si no, segundos a esperar antes de reintentar.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_update
+            self._last_update = now
+            
+            wait = 0.0
+            if self.requests_per_minute:
+                self._request_capacity = min(
+                    float(self.requests_per_minute),
+                    self._request_capacity + self.requests_per_minute * elapsed / 60
+                )
+                if self._request_capacity < 1:
+                    wait = (1 - self._request_capacity) * 60 / self.requests_per_minute
+            
+            if self.tokens_per_minute:
+                # Una petición mayor que el límite por minuto solo espera a tener el cupo completo
+                tokens = min(tokens, self.tokens_per_minute)
+                self._token_capacity = min(
+                    float(self.tokens_per_minute),
+                    self._token_capacity + self.tokens_per_minute * elapsed / 60
+                )
+                if self._token_capacity < tokens:
+                    wait = max(wait, (tokens - self._token_capacity) * 60 / self.tokens_per_minute)
+            
+            if wait == 0:
+                if self.requests_per_minute:
+                    self._request_capacity -= 1
+                if self.tokens_per_minute:
+                    self._token_capacity -= tokens
+            return wait
+    
+    def acquire(self, tokens: int = 0):
+        """
+        Espera (bloqueando el hilo) hasta que haya capacidad para una petición.
+        
+        Args:
+            tokens: Tokens estimados de la petición.
+        """
+        if not self.enabled:
+            return
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+    
+    async def aacquire(self, tokens: int = 0):
+        """
+        Versión asíncrona de acquire: espera sin bloquear el event loop.
+        
+        Args:
+            tokens: Tokens estimados de la petición.
+        """
+        if not self.enabled:
+            return
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
@@ -1,5 +1,4 @@
 #!/usr/bin/env python3
-import uvicorn
 import sys
 import os
 
@@ -8,7 +7,7 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
 
 # Ahora importar desde el módulo app
-from app.api.api import app
+from app.api.api import start
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    start()
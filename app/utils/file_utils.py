@@ -0,0 +1,32 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+def release_page_cache(path: str):
+    """
+    Indica al sistema operativo que el contenido de un archivo ya no se volverá a leer,
+    para que libere sus páginas de la cache de disco.
+
+    Los PDFs se escriben una vez y se leen una vez al extraer la factura; mantenerlos
+    en cache solo desplaza datos más útiles. No tiene efecto en sistemas sin
+    posix_fadvise (p. ej. Windows o macOS).
+
+    Args:
+        path: Ruta del archivo.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        logger.debug(f"No se pudo abrir {path} para liberar su cache: {str(e)}")
+        return
+
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        logger.debug(f"No se pudo liberar la cache de {path}: {str(e)}")
+    finally:
+        os.close(fd)
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.models.models import InvoiceData
+
+logger = logging.getLogger(__name__)
+
+def file_sha256(path: str) -> str:
+    """
+    Calcula el hash SHA-256 de un archivo sin cargarlo completo en memoria.
+
+    El archivo se mapea en memoria: sha256 lee directamente de la cache de páginas
+    del sistema, sin copiar bloques a objetos bytes intermedios.
+
+    Args:
+        path: Ruta del archivo.
+
+    Returns:
+        str: Hash SHA-256 en hexadecimal.
+    """
+    with open(path, "rb") as f:
+        # mmap no admite archivos vacíos
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+class InvoiceCache:
+    """
+    Cache LRU en memoria de facturas ya extraídas, indexada por el hash SHA-256
+    del contenido del PDF. Permite evitar llamadas repetidas a OpenAI cuando
+    llega dos veces el mismo documento.
+
+    Si se indica una ruta, las facturas también se guardan en una base SQLite,
+    de modo que la deduplicación se mantiene entre reinicios del servicio.
+
+    Con una versión, las facturas se indexan por hash y versión de la extracción
+    (modelo y prompt): al cambiar el prompt no se reutilizan datos extraídos con
+    el anterior. Con ttl_days, cada factura caduca tras esa cantidad de días.
+    """
+
+    def __init__(self, max_size: int = 256, path: Optional[str] = None, version: str = "", ttl_days: float = 0):
+        """
+        Inicializa la cache.
+
+        Args:
+            max_size: Número máximo de facturas a conservar en memoria.
+            path: Ruta de la base SQLite para persistir la cache (None para solo memoria).
+            version: Versión de la extracción (ver OpenAIProcessor.prompt_version).
+            ttl_days: Días que se conserva cada factura (0 para no caducar).
+        """
+        self.max_size = max_size
+        self.version = version
+        self.ttl_seconds = ttl_days * 86400
+        # Por clave: (momento en que se guardó, factura)
+        self._items: "OrderedDict[str, Tuple[float, InvoiceData]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                # La conexión se comparte entre hilos; el acceso se serializa con _lock
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS invoices (digest TEXT PRIMARY KEY, data TEXT NOT NULL, created REAL)"
+                )
+                # Bases creadas cuando las facturas no caducaban
+                columns = [row[1] for row in self._db.execute("PRAGMA table_info(invoices)")]
+                if "created" not in columns:
+                    self._db.execute("ALTER TABLE invoices ADD COLUMN created REAL")
+                if self.ttl_seconds:
+                    self._db.execute("DELETE FROM invoices WHERE created IS NULL OR created < ?", (self._expiry(),))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo abrir la cache persistente {path}, se usará solo memoria: {e}")
+                self._db = None
+
+    def get(self, digest: str) -> Optional[InvoiceData]:
+        """
+        Obtiene la factura asociada a un hash, marcándola como usada recientemente.
+
+        Args:
+            digest: Hash SHA-256 (hexadecimal) del PDF.
+
+        Returns:
+            InvoiceData: Factura cacheada o None si no existe o caducó.
+        """
+        key = self._key(digest)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item[0] >= self._expiry():
+                    self._items.move_to_end(key)
+                    return item[1]
+                del self._items[key]
+
+            if self._db is None:
+                return None
+
+            try:
+                row = self._db.execute(
+                    "SELECT data, created FROM invoices WHERE digest = ? AND IFNULL(created, 0) >= ?",
+                    (key, self._expiry())
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Error al leer la cache persistente: {e}")
+                return None
+            if row is None:
+                return None
+
+            # Una fila que no se puede leer (guardada con otra versión de los modelos)
+            # cuenta como ausente y se borra: la factura se vuelve a extraer
+            try:
+                invoice = InvoiceData.model_validate_json(row[0])
+            except ValidationError as e:
+                logger.warning(f"Factura ilegible en la cache persistente, se descarta: {e.error_count()} errores")
+                self._delete(key)
+                return None
+            self._remember(key, invoice, row[1] or 0.0)
+            return invoice
+
+    def set(self, digest: str, invoice: InvoiceData):
+        """
+        Guarda una factura en la cache, descartando la menos usada si está llena.
+
+        Args:
+            digest: Hash SHA-256 (hexadecimal) del PDF.
+            invoice: Datos extraídos de la factura.
+        """
+        key = self._key(digest)
+        created = time.time()
+        # Se guarda una factura validada: con datos asignados sin validar (dicts en
+        # lugar de los modelos anidados) model_dump_json emite advertencias y la
+        # factura no se podría volver a leer
+        invoice = InvoiceData.model_validate(invoice.model_dump(warnings=False))
+        with self._lock:
+            self._remember(key, invoice, created)
+
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO invoices (digest, data, created) VALUES (?, ?, ?)",
+                    (key, invoice.model_dump_json(), created)
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Error al guardar en la cache persistente: {e}")
+
+    def _delete(self, key: str):
+        """Borra una factura de la cache persistente (requiere _lock)."""
+        try:
+            self._db.execute("DELETE FROM invoices WHERE digest = ?", (key,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error al borrar de la cache persistente: {e}")
+
+    def _key(self, digest: str) -> str:
+        """Clave de una factura: hash del PDF y, si hay, versión de la extracción."""
+        return f"{digest}|{self.version}" if self.version else digest
+
+    def _expiry(self) -> float:
+        """Momento de guardado más antiguo que sigue vigente (0 si las facturas no caducan)."""
+        return time.time() - self.ttl_seconds if self.ttl_seconds else 0.0
+
+    def _remember(self, key: str, invoice: InvoiceData, created: float):
+        """Guarda una factura en memoria, descartando la menos usada si está llena (requiere _lock)."""
+        self._items[key] = (created, invoice)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def close(self):
+        """Cierra la base de la cache persistente, si existe."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,65 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
+from app.config.settings import settings
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Estado global del logging asíncrono
+_listener = None
+_queue_handler = None
+
+def configure_logging(log_file: str = "invoicesync.log") -> logging.handlers.QueueListener:
+    """
+    Configura el logging de la aplicación.
+
+    Los registros se encolan en memoria mediante un QueueHandler en el logger raíz
+    y un QueueListener en un hilo dedicado los escribe en consola y en archivo,
+    de modo que las escrituras a disco no bloquean a quien registra el mensaje.
+    Solo la primera llamada tiene efecto; las siguientes devuelven el mismo listener.
+
+    Args:
+        log_file: Ruta del archivo de log.
+
+    Returns:
+        QueueListener: Listener que procesa los registros encolados.
+    """
+    global _listener, _queue_handler
+
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(), logging.FileHandler(log_file)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+
+    root = logging.getLogger()
+    root.setLevel(settings.LOG_LEVEL_INT)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    return _listener
+
+def stop_logging():
+    """Vacía la cola de logs pendientes y detiene el hilo del listener."""
+    global _listener, _queue_handler
+
+    if _listener is None:
+        return
+
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+
+    _listener = None
+    _queue_handler = None
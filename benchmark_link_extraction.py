@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Mide el tiempo de lectura y extracción de enlaces sobre el email de prueba de
+test_complete_flow.py. No es una prueba: se ejecuta a mano.
+
+    python benchmark_link_extraction.py [iteraciones]
+"""
+
+import sys
+import os
+import time
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from test_complete_flow import _fresh_email, _get_processor
+
+def benchmark_link_extraction(iterations: int = 1000) -> float:
+    """Mide el tiempo de lectura y extracción de enlaces sobre el email de prueba."""
+
+    print("\n=== Benchmark de Extracción de Enlaces ===")
+
+    processor = _get_processor()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        processor._extract_links_from_email(_fresh_email())
+    elapsed = time.perf_counter() - start
+
+    print(f"✓ {iterations} extracciones en {elapsed:.3f}s ({elapsed / iterations * 1000:.3f} ms por email)")
+
+    return elapsed
+
+if __name__ == "__main__":
+    benchmark_link_extraction(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -17,16 +17,10 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 from app.config.settings import settings
 from app.main import InvoiceSync, main as main_cli
 from app.api.api import start as start_api
+from app.utils.logging_setup import configure_logging
 
-# Configurar logging
-logging.basicConfig(
-    level=getattr(logging, settings.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("invoicesync.log")
-    ]
-)
+# Configurar logging (idempotente: reutiliza la configuración ya creada al importar la app)
+configure_logging("invoicesync.log")
 
 logger = logging.getLogger(__name__)
 
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Pruebas del intérprete de respuestas IMAP: FETCH con literales, números de
+sección de BODYSTRUCTURE y decodificación de las partes (base64 y quoted-printable).
+"""
+
+import sys
+import os
+import base64
+import binascii
+import quopri
+import tempfile
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.config.settings import settings
+from app.modules.email_processor.bodystructure import (
+    decode_part, iter_decode_part, parse_fetch_response, walk_bodystructure
+)
+from app.modules.email_processor.email_processor import EmailProcessor
+
+# Contenido de prueba: varias líneas de HTML con caracteres no ASCII
+_CONTENT = ('<a href="https://facte.siga.com.py/FacturaE/printDE?ruc=1">Factura ñandú</a>\n' * 200).encode("utf-8")
+
+def _sections(response: bytes):
+    """Interpreta un BODYSTRUCTURE y devuelve (sección, content_type, nombre, alternativa) de cada parte."""
+    fields = parse_fetch_response([b"1 (UID 7 BODYSTRUCTURE " + response + b")"])["1"]
+    return [
+        (part.section, part.content_type, part.filename, part.alternative)
+        for part in walk_bodystructure(fields[b"BODYSTRUCTURE"])
+    ]
+
+def test_fetch_response_with_literals():
+    """Los literales {n} llegan como tuplas (texto, literal) y se asignan a su elemento."""
+    data = [
+        (b'1 (UID 10 BODY[1] {5}', b'hola\n'),
+        (b' BODY[2] {4}', b')(\r\n'),
+        b')',
+        (b'2 (UID 11 BODY[HEADER.FIELDS ("SUBJECT")] {16}', b'Subject: Prueba\n'),
+        b' BODY[1]<0> NIL)',
+    ]
+    messages = parse_fetch_response(data)
+
+    assert messages["1"][b"UID"] == b"10"
+    assert messages["1"][b"BODY[1]"] == b"hola\n"
+    # Un literal con paréntesis no altera la estructura de la respuesta
+    assert messages["1"][b"BODY[2]"] == b")(\r\n"
+    assert messages["2"][b'BODY[HEADER.FIELDS ("SUBJECT")]'] == b"Subject: Prueba\n"
+    assert messages["2"][b"BODY[1]<0>"] is None
+
+def test_single_part_message_is_section_1():
+    """El cuerpo de un mensaje que no es multipart es la sección 1."""
+    structure = b'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 120 4 NIL NIL NIL)'
+    assert _sections(structure) == [("1", "text/plain", "", False)]
+
+def test_nested_alternative_sections():
+    """multipart/mixed con un multipart/alternative anidado y un PDF adjunto."""
+    structure = (
+        b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 100 3 NIL NIL NIL)'
+        b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 200 4 NIL NIL NIL) "ALTERNATIVE")'
+        b'("APPLICATION" "PDF" ("NAME" "factura.pdf") NIL NIL "BASE64" 3000 NIL ("ATTACHMENT" ("FILENAME" "factura.pdf")) NIL)'
+        b' "MIXED")'
+    )
+    assert _sections(structure) == [
+        ("1.1", "text/plain", "", True),
+        ("1.2", "text/html", "", True),
+        ("2", "application/pdf", "factura.pdf", False),
+    ]
+
+def test_message_rfc822_sections():
+    """Las partes de un mensaje adjunto se numeran dentro de la sección del adjunto."""
+    envelope = b'(NIL "Reenviado" NIL NIL NIL NIL NIL NIL NIL NIL)'
+    inner_multipart = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 50 2 NIL NIL NIL)'
+        b'("APPLICATION" "PDF" ("NAME" "adjunta.pdf") NIL NIL "BASE64" 900 NIL ("ATTACHMENT" NIL) NIL) "MIXED")'
+    )
+    structure = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 1200 ' + envelope + b' ' + inner_multipart + b' 30 NIL NIL NIL)'
+        b' "MIXED")'
+    )
+    assert _sections(structure) == [
+        ("1", "text/plain", "", False),
+        ("2.1", "text/plain", "", False),
+        ("2.2", "application/pdf", "adjunta.pdf", False),
+    ]
+
+    # Mensaje adjunto que no es multipart: su cuerpo es la sección <adjunto>.1
+    inner_single = b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "7BIT" 50 2 NIL NIL NIL)'
+    structure = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 300 ' + envelope + b' ' + inner_single + b' 8 NIL NIL NIL)'
+        b' "MIXED")'
+    )
+    assert _sections(structure)[1] == ("2.1", "text/html", "", False)
+
+def test_rfc2231_filename():
+    """El nombre extendido filename* se decodifica con su charset."""
+    structure = (
+        b'(("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+        b'("APPLICATION" "PDF" NIL NIL NIL "BASE64" 3000 NIL'
+        b' ("ATTACHMENT" ("FILENAME*" "utf-8\'es\'factura%20n%C2%BA%201.pdf")) NIL)'
+        b' "MIXED")'
+    )
+    assert _sections(structure)[1] == ("2", "application/pdf", "factura nº 1.pdf", False)
+
+def test_decode_part():
+    """base64, quoted-printable y codificaciones sin transformar."""
+    assert decode_part(base64.encodebytes(_CONTENT), "BASE64") == _CONTENT
+    assert decode_part(quopri.encodestring(_CONTENT), "quoted-printable") == _CONTENT
+    assert decode_part(_CONTENT, "8bit") == _CONTENT
+    assert decode_part(_CONTENT, "") == _CONTENT
+
+def test_decode_truncated_part():
+    """Un FETCH parcial corta la parte en cualquier byte: se decodifica el comienzo."""
+    encoded_b64 = base64.encodebytes(_CONTENT)
+    encoded_qp = quopri.encodestring(_CONTENT)
+    for size in range(1, 400):
+        decoded = decode_part(encoded_b64[:size], "base64", truncated=True)
+        assert _CONTENT.startswith(decoded)
+        decoded = decode_part(encoded_qp[:size], "quoted-printable", truncated=True)
+        assert _CONTENT.startswith(decoded)
+
+    # Sin truncated, un grupo base64 incompleto es un error
+    try:
+        decode_part(encoded_b64[:10], "base64")
+    except binascii.Error:
+        pass
+    else:
+        raise AssertionError("Se esperaba binascii.Error")
+
+def test_iter_decode_part_matches_decode_part():
+    """La decodificación por bloques coincide con la completa con cualquier tamaño de bloque."""
+    for encoding, encoded in (
+        ("base64", base64.encodebytes(_CONTENT)),
+        ("base64", base64.b64encode(_CONTENT)),
+        ("quoted-printable", quopri.encodestring(_CONTENT)),
+        ("7bit", _CONTENT),
+    ):
+        for chunk_size in (1, 3, 4, 5, 76, 77, 1000, 1 << 20):
+            assert b"".join(iter_decode_part(encoded, encoding, chunk_size)) == _CONTENT
+
+def test_iter_decode_truncated_part():
+    """Un adjunto base64 cortado falla en lugar de guardarse incompleto sin aviso."""
+    encoded = base64.b64encode(_CONTENT)
+    try:
+        b"".join(iter_decode_part(encoded[:-2], "base64", 64))
+    except binascii.Error:
+        pass
+    else:
+        raise AssertionError("Se esperaba binascii.Error")
+
+    # quoted-printable cortado a mitad de línea: se decodifica lo recibido
+    encoded = quopri.encodestring(_CONTENT)
+    cut = encoded.index(b"=C3") + 2
+    decoded = b"".join(iter_decode_part(encoded[:cut], "quoted-printable", 64))
+    assert decoded.startswith(_CONTENT[:_CONTENT.index("ñ".encode("utf-8"))])
+
+def test_iter_decode_malformed_base64_matches_decode_part():
+    """Caracteres fuera del alfabeto y relleno mal ubicado dan el mismo resultado o el mismo error."""
+    encoded = base64.encodebytes(_CONTENT)
+    samples = [
+        encoded.replace(b"\n", b"\r\n*"),
+        encoded[:100] + b"==" + encoded[100:],
+        encoded[:101] + b"=" + encoded[101:],
+        encoded.rstrip() + b"=A",
+        encoded[:-3],
+    ]
+    for data in samples:
+        try:
+            expected = decode_part(data, "base64")
+        except binascii.Error:
+            expected = binascii.Error
+        for chunk_size in (1, 5, 64, 1 << 20):
+            try:
+                decoded = b"".join(iter_decode_part(data, "base64", chunk_size))
+            except binascii.Error:
+                decoded = binascii.Error
+            assert decoded == expected
+
+def test_failed_stream_leaves_no_file():
+    """Si la decodificación falla a mitad del guardado, no queda un PDF cortado en disco."""
+    processor = EmailProcessor.__new__(EmailProcessor)
+    original_dir = settings.TEMP_PDF_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.TEMP_PDF_DIR = tmp
+        try:
+            encoded = base64.b64encode(_CONTENT)[:-2]
+            assert processor.save_pdf_stream(iter_decode_part(encoded, "base64", 64), "factura.pdf") == ""
+            assert os.listdir(tmp) == []
+
+            path = processor.save_pdf_stream(iter_decode_part(encoded + b"==", "base64", 64), "factura.pdf")
+            assert os.listdir(tmp) == [os.path.basename(path)]
+        finally:
+            settings.TEMP_PDF_DIR = original_dir
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"\n✅ {len(tests)} pruebas exitosas")
@@ -6,9 +6,12 @@ Script de prueba completo para validar la detección y descarga de facturas elec
 import sys
 import os
 import email
+from email import policy
+from email.parser import BytesHeaderParser
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import logging
+from functools import lru_cache
 
 # Configurar logging para ver los detalles del proceso
 logging.basicConfig(level=logging.INFO)
@@ -17,7 +20,7 @@ logger = logging.getLogger(__name__)
 # Agregar el directorio del proyecto al path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app.modules.email_processor.email_processor import EmailProcessor
+from app.modules.email_processor.email_processor import EmailProcessor, LinkKind, _classify_link
 
 def create_test_email_with_multiple_links():
     """Crea un email de prueba con diferentes tipos de enlaces."""
@@ -63,16 +66,38 @@ def create_test_email_with_multiple_links():
     
     return msg
 
-def test_complete_flow():
-    """Prueba el flujo completo de detección y procesamiento."""
+# El email de prueba se construye una sola vez; cada uso parte de sus bytes
+_CACHED_EMAIL_BYTES = create_test_email_with_multiple_links().as_bytes()
+
+def _fresh_email():
+    """Devuelve una copia nueva del email de prueba, leída desde los bytes cacheados."""
+    return email.message_from_bytes(_CACHED_EMAIL_BYTES)
+
+@lru_cache(maxsize=None)
+def _get_processor() -> EmailProcessor:
+    """
+    Procesador compartido por todas las pruebas del módulo: se crea una sola vez
+    (configuración, procesador de OpenAI, cache de facturas). Las pruebas solo usan
+    métodos sin estado, sin conexión IMAP.
+    """
+    return EmailProcessor()
+
+def _run_complete_flow():
+    """
+    Ejecuta el flujo completo de detección y procesamiento sobre el email de prueba,
+    mostrando cada paso.
+    
+    Returns:
+        Tuple: (éxito, enlaces detectados, enlaces por tipo, enlaces procesables)
+    """
     
     print("=== Test Completo de Procesamiento de Facturas Electrónicas ===\n")
     
     # Crear email de prueba
-    test_email = create_test_email_with_multiple_links()
+    test_email = _fresh_email()
     
     # Crear instancia del procesador
-    processor = EmailProcessor()
+    processor = _get_processor()
     
     print("1. Extrayendo enlaces del correo...")
     links = processor._extract_links_from_email(test_email)
@@ -83,10 +108,20 @@ def test_complete_flow():
     
     print("\n2. Analizando tipos de enlaces...")
     
-    siga_links = [link for link in links if "facte.siga.com.py" in link]
-    pdf_links = [link for link in links if link.endswith(".pdf")]
-    print_links = [link for link in links if "printDE" in link]
-    xml_links = [link for link in links if "downloadXML" in link]
+    # Clasificar los enlaces en una sola pasada, con el mismo criterio (servidor y
+    # ruta de la URL) que usa el procesador al descargarlos
+    buckets = {"siga": [], "pdf": [], "print": [], "xml": []}
+    for link in links:
+        kind = _classify_link(link)
+        if kind.is_siga:
+            buckets["siga"].append(link)
+        if kind is LinkKind.PDF:
+            buckets["pdf"].append(link)
+        elif kind is LinkKind.SIGA_PRINT:
+            buckets["print"].append(link)
+        elif kind is LinkKind.SIGA_XML:
+            buckets["xml"].append(link)
+    siga_links, pdf_links, print_links, xml_links = buckets["siga"], buckets["pdf"], buckets["print"], buckets["xml"]
     
     print(f"   ✓ Enlaces SIGA: {len(siga_links)}")
     print(f"   ✓ Enlaces PDF directos: {len(pdf_links)}")
@@ -95,20 +130,21 @@ def test_complete_flow():
     
     print("\n3. Simulando procesamiento de enlaces...")
     
-    # Simular el procesamiento de cada enlace
+    # Simular el procesamiento de cada enlace. Los enlaces procesables (SIGA o PDF
+    # directo) ya quedaron clasificados: no se vuelve a evaluar cada condición. Como
+    # en el procesador, el XML de SIGA no se descarga
+    processable = set(siga_links).union(pdf_links).difference(xml_links)
     processed_count = 0
     for link in links:
         print(f"\n   Procesando: {link}")
         
         # Generar nombre de archivo que se usaría
-        if "facte.siga.com.py" in link:
-            filename = processor._generate_filename_from_url(link, "pdf")
-            print(f"   ✓ Nombre de archivo generado: {filename}")
-            processed_count += 1
-        elif link.endswith(".pdf"):
+        if link in processable:
             filename = processor._generate_filename_from_url(link, "pdf")
             print(f"   ✓ Nombre de archivo generado: {filename}")
             processed_count += 1
+        elif link in xml_links:
+            print(f"   ⚠ XML de SIGA: se omite (no es PDF)")
         else:
             print(f"   ⚠ Enlace no procesable directamente")
     
@@ -125,27 +161,44 @@ def test_complete_flow():
         print(f"\n🎉 Test EXITOSO: El sistema puede detectar y procesar facturas electrónicas SIGA")
         print(f"   - Se detectaron {len(siga_links)} enlaces de SIGA")
         print(f"   - El sistema procesará automáticamente estos enlaces")
-        print(f"   - Los PDFs se descargarán y enviarán a OpenAI para extracción de datos")
+        print(f"   - Los PDFs se descargarán y se extraerán con OpenAI en paralelo (OPENAI_CONCURRENCY)")
+        print(f"   - En modo daemon con OPENAI_BATCH_MODE se envían juntos por la Batch API")
     else:
         print(f"\n❌ Test FALLIDO: No se detectaron suficientes enlaces")
     
-    return success, links
+    return success, links, buckets, processable
 
-def test_metadata_extraction():
-    """Prueba la extracción de metadatos del email."""
+def test_complete_flow():
+    """Prueba el flujo completo de detección y procesamiento."""
+    success, links, buckets, processable = _run_complete_flow()
+    
+    assert success
+    assert len(links) == 3
+    assert {kind: len(found) for kind, found in buckets.items()} == {"siga": 2, "pdf": 1, "print": 1, "xml": 1}
+    # Se descargan el printDE de SIGA y el PDF directo; el XML de SIGA se omite
+    assert processable == set(buckets["print"] + buckets["pdf"])
+    assert not processable.intersection(buckets["xml"])
+
+def _run_metadata_extraction():
+    """
+    Extrae los metadatos del email de prueba, mostrándolos.
+    
+    Returns:
+        Dict: Metadatos del correo, con sus enlaces.
+    """
     
     print("\n=== Test de Extracción de Metadatos ===")
     
-    test_email = create_test_email_with_multiple_links()
-    processor = EmailProcessor()
+    processor = _get_processor()
+    
+    # Como en producción (BODY.PEEK[HEADER.FIELDS ...]), los metadatos salen solo de
+    # los encabezados, sin interpretar el cuerpo ni los adjuntos del mensaje
+    headers = BytesHeaderParser(policy=policy.default).parsebytes(_CACHED_EMAIL_BYTES)
+    metadata = processor._build_metadata("test", headers)
+    metadata["date"] = metadata["date"] or "2025-05-31"
     
-    # Simular extracción de metadatos (el método real requiere conexión IMAP)
-    metadata = {
-        "sender": test_email['From'],
-        "subject": test_email['Subject'],
-        "date": "2025-05-31",
-        "links": processor._extract_links_from_email(test_email)
-    }
+    # El mensaje completo solo se interpreta para buscar los enlaces
+    metadata["links"] = processor._extract_links_from_email(_fresh_email())
     
     print(f"✓ Remitente: {metadata['sender']}")
     print(f"✓ Asunto: {metadata['subject']}")
@@ -154,11 +207,20 @@ def test_metadata_extraction():
     
     return metadata
 
+def test_metadata_extraction():
+    """Prueba la extracción de metadatos del email."""
+    metadata = _run_metadata_extraction()
+    
+    assert metadata["sender"] == "facturacion@dasegroup.com.py"
+    assert metadata["subject"] == "FACTURA ELECTRONICA - Prueba Completa"
+    assert len(metadata["links"]) == 3
+    assert [_classify_link(link) for link in metadata["links"]].count(LinkKind.SIGA_PRINT) == 1
+
 if __name__ == "__main__":
     try:
         # Ejecutar tests
-        success, links = test_complete_flow()
-        metadata = test_metadata_extraction()
+        success, links, _, _ = _run_complete_flow()
+        metadata = _run_metadata_extraction()
         
         print(f"\n" + "="*60)
         print(f"RESULTADO FINAL:")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la cache persistente de facturas: las facturas guardadas se vuelven
+a leer iguales y una fila ilegible cuenta como ausente.
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+import warnings
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.models.models import InvoiceData, EmpresaData, TotalesData
+from app.utils.invoice_cache import InvoiceCache
+
+_DIGEST = "ab" * 32
+
+def _invoice() -> InvoiceData:
+    """Factura con datos estructurados asignados sin validar, como llegaban antes de validarlos."""
+    invoice = InvoiceData(numero_factura="001-001-0000561", monto_total=110000)
+    invoice.empresa = {"nombre": "DASE GROUP E.A.S.", "direccion": None}
+    invoice.totales = {"total_a_pagar": 110000, "iva_10%": 110000}
+    return invoice
+
+def test_set_and_get_from_disk():
+    """Una factura guardada se lee desde SQLite (otra instancia) sin advertencias de serialización."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        cache = InvoiceCache(path=path, version="v1")
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            cache.set(_DIGEST, _invoice())
+        cache.close()
+
+        cache = InvoiceCache(path=path, version="v1")
+        invoice = cache.get(_DIGEST)
+        cache.close()
+
+    assert invoice.numero_factura == "001-001-0000561"
+    assert invoice.empresa == EmpresaData(nombre="DASE GROUP E.A.S.")
+    assert isinstance(invoice.totales, TotalesData)
+    assert invoice.totales.iva_10 == 110000
+
+def test_unreadable_row_is_a_miss():
+    """Una fila que no valida se trata como ausente y se borra de la base."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        cache = InvoiceCache(path=path)
+        cache._db.execute(
+            "INSERT INTO invoices (digest, data, created) VALUES (?, ?, 0)",
+            (_DIGEST, '{"monto_total": "no es un número", "productos": [{"total": []}]}')
+        )
+        cache._db.commit()
+
+        assert cache.get(_DIGEST) is None
+        cache.close()
+
+        with sqlite3.connect(path) as db:
+            assert db.execute("SELECT COUNT(*) FROM invoices").fetchone()[0] == 0
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"\n✅ {len(tests)} pruebas exitosas")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Pruebas del diario JSONL de facturas pendientes de volcar al Excel: las facturas
+extraídas se recuperan tras una caída y las líneas ilegibles no se pierden.
+"""
+
+import sys
+import os
+import json
+import subprocess
+import tempfile
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.config.settings import settings
+from app.main import InvoiceSync, _process_journal_path
+from app.modules.openai_processor.openai_processor import OpenAIProcessor
+
+# Respuesta de OpenAI con datos estructurados en null
+_RESPONSE = {
+    "numero_factura": "001-001-0000561",
+    "monto_total": 110000,
+    "empresa": {"nombre": "DASE GROUP E.A.S.", "ruc": "801245443", "direccion": None, "telefono": None},
+    "totales": {"total_a_pagar": 110000, "iva_10": 110000, "total_iva": 10000},
+    "productos": [{"articulo": None, "cantidad": 1, "precio_unitario": 110000, "total": 110000}],
+}
+
+def _dead_pid() -> int:
+    """PID de un proceso que ya terminó."""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+def _invoice_sync(pid: int) -> InvoiceSync:
+    """InvoiceSync sin inicializar (sin correo, OpenAI ni Excel), con el diario del PID indicado."""
+    sync = InvoiceSync.__new__(InvoiceSync)
+    sync._journal_path = _process_journal_path(pid)
+    return sync
+
+def test_recover_extracted_invoice():
+    """Una factura extraída y registrada por un proceso caído se recupera completa."""
+    processor = OpenAIProcessor()
+    invoice = processor._build_invoice("factura.pdf", {"sender": "a@b.com"}, processor._parse_response(json.dumps(_RESPONSE)))
+
+    original_path = settings.EXCEL_JOURNAL_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.EXCEL_JOURNAL_PATH = os.path.join(tmp, "facturas.jsonl")
+        try:
+            # Diario de un proceso terminado, escrito como lo hace enqueue_invoice
+            _invoice_sync(_dead_pid())._write_journal([invoice])
+            # Diario sin PID de versiones anteriores: una factura con datos
+            # estructurados en null y una línea cortada por la caída
+            legacy = invoice.model_dump(mode="json")
+            legacy["empresa"]["direccion"] = None
+            legacy["cliente"] = {"nombre": "Cliente", "ruc": None, "email": None}
+            with open(settings.EXCEL_JOURNAL_PATH, "w", encoding="utf-8") as journal:
+                journal.write(json.dumps(legacy) + "\n")
+                journal.write('{"numero_factura": "001-001-00005\n')
+
+            sync = _invoice_sync(os.getpid())
+            recovered = sync._recover_journals()
+
+            assert [item.numero_factura for item in recovered] == ["001-001-0000561"] * 2
+            assert invoice in recovered
+            legacy_invoice = next(item for item in recovered if item.cliente is not None)
+            assert legacy_invoice.cliente.ruc == ""
+            assert legacy_invoice.empresa.direccion == ""
+
+            # Solo queda el diario de este proceso (con las facturas) y el de rechazos
+            assert sorted(os.listdir(tmp)) == sorted([
+                os.path.basename(sync._journal_path), "facturas.jsonl.rejected"
+            ])
+            assert len(sync._load_journal(sync._journal_path)) == 2
+            with open(f"{settings.EXCEL_JOURNAL_PATH}.rejected", encoding="utf-8") as rejects:
+                assert rejects.read() == '{"numero_factura": "001-001-00005\n'
+        finally:
+            settings.EXCEL_JOURNAL_PATH = original_path
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"\n✅ {len(tests)} pruebas exitosas")
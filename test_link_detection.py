@@ -12,7 +12,7 @@ from email.mime.multipart import MIMEMultipart
 # Agregar el directorio del proyecto al path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app.modules.email_processor.email_processor import EmailProcessor
+from app.modules.email_processor.email_processor import EmailProcessor, LinkKind, _classify_link
 
 def create_test_email_with_siga_link():
     """Crea un email de prueba con un enlace de factura SIGA."""
@@ -51,13 +51,20 @@ def create_test_email_with_siga_link():
     
     return msg
 
+# El email de prueba se construye una sola vez; cada uso parte de sus bytes
+_CACHED_EMAIL_BYTES = create_test_email_with_siga_link().as_bytes()
+
+def _fresh_email():
+    """Devuelve una copia nueva del email de prueba, leída desde los bytes cacheados."""
+    return email.message_from_bytes(_CACHED_EMAIL_BYTES)
+
 def test_link_extraction():
     """Prueba la extracción de enlaces."""
     
     print("=== Test de Detección de Enlaces de Facturas Electrónicas ===\n")
     
     # Crear email de prueba
-    test_email = create_test_email_with_siga_link()
+    test_email = _fresh_email()
     
     # Crear instancia del procesador
     processor = EmailProcessor()
@@ -80,8 +87,9 @@ def test_link_extraction():
         print(f"  {i}. {link}")
     
     # Verificar resultados
-    found_printDE = any("printDE" in link for link in links)
-    found_downloadXML = any("downloadXML" in link for link in links)
+    kinds = [_classify_link(link) for link in links]
+    found_printDE = LinkKind.SIGA_PRINT in kinds
+    found_downloadXML = LinkKind.SIGA_XML in kinds
     
     print(f"\n=== Resultados ===")
     print(f"✓ Enlace de visualización encontrado: {'SÍ' if found_printDE else 'NO'}")
@@ -89,7 +97,7 @@ def test_link_extraction():
     
     if found_printDE:
         print(f"\n=== Test de Descarga ===")
-        printDE_link = next(link for link in links if "printDE" in link)
+        printDE_link = links[kinds.index(LinkKind.SIGA_PRINT)]
         print(f"Intentando acceder a: {printDE_link}")
         
         # Simular descarga (sin ejecutar realmente para evitar hacer requests)
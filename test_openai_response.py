@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la interpretación de las respuestas de OpenAI: la factura construida
+a partir de la respuesta se puede guardar y volver a leer (cache y journal).
+"""
+
+import sys
+import os
+import json
+import warnings
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.models.models import InvoiceData, EmpresaData, TotalesData, ProductoFactura
+from app.modules.openai_processor.openai_processor import OpenAIProcessor, INVOICE_SCHEMA
+
+# Respuesta con la forma de Structured Outputs (todos los campos presentes) y textos
+# en null, como los devolvía el esquema anterior
+_RESPONSE = {
+    "fecha": "2025-05-06",
+    "ruc_emisor": "801245443",
+    "nombre_emisor": "DASE GROUP E.A.S.",
+    "numero_factura": "001-001-0000561",
+    "monto_total": 110000,
+    "iva": 10000,
+    "timbrado": "12345678",
+    "cdc": None,
+    "ruc_cliente": None,
+    "nombre_cliente": "VARGAS RAMIREZ, CARLOS VICENTE",
+    "email_cliente": None,
+    "condicion_venta": "CONTADO",
+    "moneda": None,
+    "subtotal_exentas": 0,
+    "subtotal_5": 0,
+    "subtotal_10": 110000,
+    "actividad_economica": None,
+    "empresa": {"nombre": "DASE GROUP E.A.S.", "ruc": "801245443", "direccion": None, "telefono": None, "actividad_economica": None},
+    "timbrado_data": {"nro": "12345678", "fecha_inicio_vigencia": None, "valido_hasta": None},
+    "factura_data": {"contado_nro": "001-001-0000561", "fecha": "2025-05-06", "caja_nro": None, "cdc": None, "condicion_venta": "CONTADO"},
+    "productos": [{"articulo": "Servicio", "cantidad": 1, "precio_unitario": "110000", "total": 110000}, {"articulo": None, "cantidad": 0, "precio_unitario": 0, "total": 0}],
+    "totales": {"cantidad_articulos": 1, "subtotal": 110000, "total_a_pagar": 110000, "iva_0": 0, "iva_5": 0, "iva_10": 110000, "total_iva": 10000},
+    "cliente": {"nombre": "VARGAS RAMIREZ, CARLOS VICENTE", "ruc": None, "email": None},
+}
+
+def _build(response: dict) -> InvoiceData:
+    """Interpreta una respuesta y construye la factura como lo hace el procesador."""
+    processor = OpenAIProcessor()
+    extracted = processor._parse_response(json.dumps(response))
+    return processor._build_invoice("data/temp_pdfs/factura.pdf", {"sender": "facturacion@dasegroup.com.py"}, extracted)
+
+def test_schema_texts_are_not_nullable():
+    """El esquema pide "" (no null) para los textos, incluidos los de los datos estructurados."""
+    def texts(schema):
+        if schema.get("type") == "object":
+            for value in schema["properties"].values():
+                yield from texts(value)
+        elif schema.get("type") == "array":
+            yield from texts(schema["items"])
+        elif "string" in schema.get("type", ""):
+            yield schema
+    assert all(schema["type"] == "string" for schema in texts(INVOICE_SCHEMA))
+
+def test_build_invoice_validates_nested_data():
+    """Los datos estructurados quedan como modelos y los null toman su valor por defecto."""
+    invoice = _build(_RESPONSE)
+
+    assert isinstance(invoice.empresa, EmpresaData)
+    assert invoice.empresa.direccion == ""
+    assert invoice.empresa.ruc == "80124544-3"
+    assert isinstance(invoice.totales, TotalesData)
+    assert invoice.totales.iva_10 == 110000
+    assert all(isinstance(producto, ProductoFactura) for producto in invoice.productos)
+    assert invoice.productos[0].precio_unitario == 110000
+    assert invoice.productos[1].articulo == ""
+    assert invoice.cliente.ruc == ""
+    assert invoice.moneda == "PYG"
+    assert invoice.email_origen == "facturacion@dasegroup.com.py"
+
+def test_invoice_round_trip():
+    """La factura se serializa sin advertencias y se vuelve a leer igual (cache y journal)."""
+    invoice = _build(_RESPONSE)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        data = invoice.model_dump_json()
+    assert InvoiceData.model_validate_json(data) == invoice
+    assert InvoiceData.model_validate(json.loads(data)) == invoice
+
+def test_invalid_fields_are_dropped():
+    """Un campo inválido se descarta sin perder el resto de la factura."""
+    invoice = _build({**_RESPONSE, "productos": "sin detalle"})
+    assert invoice.productos == []
+    assert invoice.numero_factura == "001-001-0000561"
+    assert invoice.empresa.nombre == "DASE GROUP E.A.S."
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"\n✅ {len(tests)} pruebas exitosas")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Pruebas del generador directo de archivos .xlsx: el libro escrito por
+write_xlsx se vuelve a leer con openpyxl y se comparan valores y formato.
+"""
+
+import sys
+import os
+import io
+
+import openpyxl
+import pandas as pd
+
+# Agregar el directorio del proyecto al path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.modules.excel_exporter.xlsx_writer import (
+    write_xlsx, DATA_STYLE, NUMERIC_STYLE, ROWS_PER_WRITE
+)
+
+NUMERIC_FORMAT = "#,##0.00"
+
+def _round_trip(sheets, compress_level: int = 1) -> openpyxl.Workbook:
+    """Escribe las hojas en memoria y las vuelve a abrir con openpyxl."""
+    buffer = io.BytesIO()
+    write_xlsx(buffer, sheets, NUMERIC_FORMAT, compress_level)
+    buffer.seek(0)
+    return openpyxl.load_workbook(buffer)
+
+def test_values_round_trip():
+    """Textos (con caracteres especiales), números, booleanos y vacíos conservan su valor."""
+    df = pd.DataFrame({
+        "Texto": ['<a href="x">&amp;</a>', "ñandú ÁÉÍ", "con\x01control", "", None],
+        "Entero": [1, -2, 0, 10 ** 12, 7],
+        "Decimal": [0.1, 1234567.891, -0.5, float("nan"), 3.0],
+        "Booleano": [True, False, True, False, True],
+    })
+    wb = _round_trip([("Facturas", df, [DATA_STYLE, NUMERIC_STYLE, NUMERIC_STYLE, DATA_STYLE], [20, 10, 10, 0])])
+    ws = wb["Facturas"]
+
+    assert [cell.value for cell in ws[1]] == ["Texto", "Entero", "Decimal", "Booleano"]
+    rows = [[cell.value for cell in row] for row in ws.iter_rows(min_row=2)]
+    assert rows == [
+        ['<a href="x">&amp;</a>', 1, 0.1, True],
+        ["ñandú ÁÉÍ", -2, 1234567.891, False],
+        # XML no admite caracteres de control: se quitan
+        ["concontrol", 0, -0.5, True],
+        # Texto vacío y NaN se escriben como celdas vacías
+        [None, 10 ** 12, None, False],
+        [None, 7, 3, True],
+    ]
+    assert isinstance(ws["B2"].value, int)
+
+def test_styles_and_layout():
+    """Formato numérico, encabezado en negrita, panel fijo y anchos de columna."""
+    df = pd.DataFrame({"Nombre": ["A"], "Monto": [1500.25]})
+    ws = _round_trip([("Hoja", df, [DATA_STYLE, NUMERIC_STYLE], [15, 0])])["Hoja"]
+
+    assert ws["A1"].font.bold
+    assert ws["B2"].number_format == NUMERIC_FORMAT
+    assert ws["A2"].number_format == "General"
+    assert ws["A2"].border.left.style == "thin"
+    assert ws.freeze_panes == "A2"
+    assert ws.column_dimensions["A"].width == 15
+
+def test_several_sheets_and_many_rows():
+    """Varias hojas comparten los textos; las filas se escriben por bloques sin perder ninguna."""
+    rows = ROWS_PER_WRITE * 2 + 7
+    facturas = pd.DataFrame({"RUC": [f"80{i % 10}-1" for i in range(rows)], "Total": list(range(rows))})
+    productos = pd.DataFrame({"RUC": ["801-1", "nuevo"], "Artículo": ["Servicio", "Producto"]})
+    for level in (0, 1, 9):
+        wb = _round_trip([
+            ("Facturas", facturas, [DATA_STYLE, NUMERIC_STYLE], [0, 0]),
+            ("Productos", productos, [DATA_STYLE, DATA_STYLE], [0, 0]),
+        ], compress_level=level)
+
+        assert wb.sheetnames == ["Facturas", "Productos"]
+        facturas_ws = wb["Facturas"]
+        assert facturas_ws.max_row == rows + 1
+        assert facturas_ws.cell(row=rows + 1, column=1).value == f"80{(rows - 1) % 10}-1"
+        assert facturas_ws.cell(row=rows + 1, column=2).value == rows - 1
+        assert [[cell.value for cell in row] for row in wb["Productos"].iter_rows(min_row=2)] == [
+            ["801-1", "Servicio"], ["nuevo", "Producto"]
+        ]
+
+def test_empty_sheet():
+    """Una hoja sin filas conserva solo los encabezados."""
+    df = pd.DataFrame({"Factura": [], "Monto": []})
+    ws = _round_trip([("Vacía", df, [DATA_STYLE, NUMERIC_STYLE], [0, 0])])["Vacía"]
+    assert ws.max_row == 1
+    assert [cell.value for cell in ws[1]] == ["Factura", "Monto"]
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print(f"\n✅ {len(tests)} pruebas exitosas")